@@ -0,0 +1,140 @@
+import os
+import shutil
+import tarfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import yaml
+from loguru import logger
+
+from journal import ARCHIVED, JobJournal
+from layout import JobsLayout
+from permissions import PERMISSION_FILE, add_permission_rule
+from settings import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH, ARCHIVE_INTERVAL
+from spec import ARCHIVED_SUFFIX
+from utils import write_yaml_atomic
+
+DAY = 24 * 3600
+
+
+class Archiver:
+    """
+    Compacts done folders older than `after_days` into per-month tarballs
+    (<YYYY-MM>.tar, by the time the project was moved to done) in `root`.
+
+    Each archived project is stored under its name in the tarball, and the
+    journal records which tarball it is in. Its outputs are left in place,
+    and its done folder is replaced by a <name>.archived.yaml stub with its
+    status, readable by whoever could read the folder.
+    Runs at most every ARCHIVE_INTERVAL seconds, `batch` projects at a time.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        journal: JobJournal,
+        layout: JobsLayout,
+        after_days: int = ARCHIVE_AFTER_DAYS,
+        batch: int = ARCHIVE_BATCH,
+    ):
+        self.root = Path(root)
+        self.journal = journal
+        self.layout = layout
+        self.after_days = after_days
+        self.batch = max(1, batch)
+        self._last_run = float("-inf")
+
+    @property
+    def enabled(self) -> bool:
+        return self.after_days > 0
+
+    def write_stub(self, row, folder: Path, tarball: Path) -> Path:
+        """
+        Writes the client-visible stub of an archived done folder.
+        """
+        failed = bool(row["failure"]) or (row["exit_code"] or 0) != 0
+        stub = folder.with_name(f"{row['name']}{ARCHIVED_SUFFIX}")
+        write_yaml_atomic(stub, {
+            "project": row["name"],
+            "status": "failed" if failed else "success",
+            "exit_code": row["exit_code"],
+            "failure": row["failure"],
+            "finished_at": row["finished_at"],
+            "archived_at": time.time(),
+            "archive": tarball.name,
+        }, sort_keys=False)
+        add_permission_rule(stub.parent, stub.name, read=folder_readers(folder), write=[])
+        return stub
+
+    def tarball(self, done_at: float) -> Path:
+        return self.root / f"{time.strftime('%Y-%m', time.gmtime(done_at))}.tar"
+
+    def run(self, force: bool = False) -> int:
+        """
+        Archives the next batch of old done folders. Returns how many.
+        """
+        now = time.monotonic()
+        if not self.enabled or (not force and now - self._last_run < ARCHIVE_INTERVAL):
+            return 0
+        self._last_run = now
+        rows = self.journal.done_before(time.time() - self.after_days * DAY, self.batch)
+        by_tarball: Dict[Path, List] = {}
+        for row in rows:
+            by_tarball.setdefault(self.tarball(row["updated_at"]), []).append(row)
+
+        archived = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+        for tarball, rows in by_tarball.items():
+            folders = {}
+            rows_by_name = {row["name"]: row for row in rows}
+            for row in rows:
+                folder = self.layout.find_done(row["name"])
+                if folder is None:
+                    # Removed by hand, nothing left to archive
+                    self.journal.transition(row["name"], ARCHIVED, archive=None)
+                else:
+                    folders[row["name"]] = folder
+            if not folders:
+                continue
+            try:
+                with tarfile.open(tarball, "a") as tar:
+                    for name, folder in folders.items():
+                        tar.add(folder, arcname=name)
+                with open(tarball, "rb") as f:
+                    os.fsync(f.fileno())
+            except (OSError, tarfile.TarError) as e:
+                logger.error(f"Could not archive into {tarball}: {e}")
+                continue
+            # Only removed once the tarball and the stub are durable; a crash
+            # in between archives them again, the latest copy wins on extraction
+            moved = 0
+            for name, folder in folders.items():
+                try:
+                    self.write_stub(rows_by_name[name], folder, tarball)
+                except OSError as e:
+                    # Left in done, archived again on a later run
+                    logger.error(f"Could not write the archive stub of {name}: {e}")
+                    continue
+                self.journal.transition(name, ARCHIVED, archive=str(tarball))
+                shutil.rmtree(folder)
+                moved += 1
+            archived += moved
+            logger.info(f"Archived {moved} done project(s) into {tarball}")
+        return archived
+
+
+def folder_readers(folder: Path) -> List[str]:
+    """
+    Everyone granted read access by the syft.pub.yaml of a folder.
+    """
+    try:
+        data = yaml.safe_load((folder / PERMISSION_FILE).read_text()) or {}
+    except (OSError, yaml.YAMLError):
+        return []
+    readers = []
+    for rule in data.get("rules") or []:
+        for reader in (rule.get("access") or {}).get("read") or []:
+            if reader not in readers:
+                readers.append(reader)
+    return readers
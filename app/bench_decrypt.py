@@ -0,0 +1,129 @@
+"""
+Benchmark: peak RSS of .enc decryption against dataset size.
+
+Each measurement runs in a fresh child process and reads its ru_maxrss via
+os.wait4, so runs don't pollute each other's high-water mark.
+
+    python app/bench_decrypt.py --sizes 16 64 256 1024   # sizes in MiB
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives import serialization
+
+from encryption import OAEP_PADDING, decrypt_file, encrypt_file
+
+MiB = 1024 * 1024
+
+
+def _write_random(path: Path, size: int):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            block = os.urandom(min(remaining, 4 * MiB))
+            f.write(block)
+            remaining -= len(block)
+
+
+def _encrypt_legacy(src: Path, dst: Path, public_key):
+    # Produces the same bytes as the single-shot v1 writer, but streams so the
+    # benchmark parent stays small (children inherit its high-water mark)
+    aes_key = AESGCM.generate_key(bit_length=256)
+    nonce = os.urandom(12)
+    encryptor = Cipher(algorithms.AES(aes_key), modes.GCM(nonce)).encryptor()
+    encrypted_key = public_key.encrypt(aes_key, OAEP_PADDING)
+    with open(src, "rb") as fin, open(dst, "wb") as f:
+        f.write(len(encrypted_key).to_bytes(2, "big"))
+        f.write(encrypted_key)
+        f.write(nonce)
+        while block := fin.read(4 * MiB):
+            f.write(encryptor.update(block))
+        f.write(encryptor.finalize())
+        f.write(encryptor.tag)
+
+
+def _child(mode: str, key_path: str, enc_path: str):
+    with open(key_path, "rb") as f:
+        private_key = serialization.load_pem_private_key(f.read(), password=None)
+    if mode == "oneshot":
+        # The previous decrypt_data: whole ciphertext and plaintext in memory
+        with open(enc_path, "rb") as f:
+            key_len = int.from_bytes(f.read(2), "big")
+            encrypted_key = f.read(key_len)
+            nonce = f.read(12)
+            ciphertext = f.read()
+        aes_key = private_key.decrypt(encrypted_key, OAEP_PADDING)
+        AESGCM(aes_key).decrypt(nonce, ciphertext, associated_data=None)
+    else:
+        with open(os.devnull, "wb") as out:
+            decrypt_file(enc_path, private_key, out)
+
+
+def _measure(mode: str, key_path: Path, enc_path: Path):
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, __file__, "--child", mode, str(key_path), str(enc_path)],
+        cwd=Path(__file__).parent,
+    )
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"{mode} child failed on {enc_path}")
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 64, 256], help="Dataset sizes in MiB")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(*args.child)
+        return
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        key_path = tmp / "private_key.pem"
+        key_path.write_bytes(
+            private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.TraditionalOpenSSL,
+                encryption_algorithm=serialization.NoEncryption(),
+            )
+        )
+
+        print(f"{'size':>8} {'format':>8} {'decrypt':>10} {'peak RSS':>10} {'time':>8}")
+        for size_mib in args.sizes:
+            plain = tmp / "plain.bin"
+            _write_random(plain, size_mib * MiB)
+            v1 = tmp / "v1.enc"
+            v2 = tmp / "v2.enc"
+            _encrypt_legacy(plain, v1, private_key.public_key())
+            encrypt_file(plain, v2, private_key.public_key())
+            plain.unlink()
+
+            for fmt, enc_path, mode in [
+                ("v1", v1, "oneshot"),
+                ("v1", v1, "stream"),
+                ("v2", v2, "stream"),
+            ]:
+                peak, elapsed = _measure(mode, key_path, enc_path)
+                print(f"{size_mib:>6}Mi {fmt:>8} {mode:>10} {peak / MiB:>8.1f}Mi {elapsed:>7.2f}s")
+            v1.unlink()
+            v2.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from encryption import load_header
+from settings import DATASET_CACHE_LIMIT
+from utils import COPY_BUFSIZE, directory_size
+
+STAGING_PREFIX = ".staging-"
+# ioctl cloning a whole file, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+def dataset_key(enc_file_path: Path) -> str:
+    """
+    Content address of a .enc file, derived from its header and size.
+
+    The header holds a wrapped key and nonce that are random for every
+    encryption, and the ciphertext is authenticated against them, so a
+    re-encrypted or modified dataset always gets a different key.
+    """
+    header = load_header(enc_file_path)
+    digest = hashlib.sha256()
+    digest.update(bytes([header.version]))
+    digest.update(header.raw or header.wrapped_key + header.nonce)
+    digest.update(str(os.path.getsize(enc_file_path)).encode())
+    return digest.hexdigest()
+
+
+def _clone_file(src: str, dst: str):
+    # A copy-on-write clone (reflink) where the filesystem supports it,
+    # e.g. btrfs or XFS, a plain copy otherwise
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+
+
+class DatasetCache:
+    """
+    Content-addressed store of extracted datasets shared across jobs.
+
+    Each entry is the extracted content of one .enc file, stored under
+    `root/<dataset_key>`. Jobs get their own copy of the files (a reflink
+    where possible), so a dataset used by many projects is decrypted once
+    and a job changing its input can't affect the next one. The total size is
+    kept under `budget` bytes by evicting the least recently used entries
+    that no job holds a reference to. A budget of 0 disables the cache.
+    Safe to use from the prefetch thread and the main loop at once.
+    """
+
+    def __init__(self, root: Path, budget: int = DATASET_CACHE_LIMIT):
+        self.root = Path(root)
+        self.budget = budget
+        # key -> size in bytes, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        # key -> owners (project names) currently using the entry
+        self.refs: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return sum(self.entries.values())
+
+    def _load(self):
+        # Rebuilds the index from disk, using mtimes as the LRU order
+        self.root.mkdir(parents=True, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.root):
+            path = Path(entry.path)
+            if entry.name.startswith(STAGING_PREFIX):
+                # Left over from an interrupted decryption
+                shutil.rmtree(path, ignore_errors=True)
+            elif entry.is_dir(follow_symlinks=False):
+                found.append((entry.stat().st_mtime, entry.name, directory_size(path)))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+        if self.entries:
+            logger.info(f"Dataset cache has {len(self.entries)} entries, {self.size / 2**20:.1f} MiB")
+        self._evict()
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """
+        Returns the directory of a cached dataset and marks it as recently used.
+        """
+        with self._lock:
+            if key not in self.entries:
+                return None
+            path = self.root / key
+            if not path.is_dir():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            os.utime(path)
+            return path
+
+    def staging_dir(self, key: str) -> Path:
+        """
+        New empty directory to extract a dataset into before commit().
+        """
+        return Path(tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{key}-", dir=self.root))
+
+    def commit(self, key: str, staging_dir: Path) -> Path:
+        """
+        Moves a fully extracted staging directory into the cache.
+        """
+        path = self.root / key
+        with self._lock:
+            if path.is_dir():
+                # Staged by another project in the meantime
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            else:
+                os.rename(staging_dir, path)
+                self.entries[key] = directory_size(path)
+            self.entries.move_to_end(key)
+        return path
+
+    def copy(self, key: str, target_dir: Path):
+        """
+        Recreates a cached dataset in target_dir with copies of its files.
+        """
+        source = self.root / key
+        # A restarted job may still have files from its previous run
+        shutil.rmtree(target_dir, ignore_errors=True)
+        for dirpath, _, filenames in os.walk(source):
+            rel_dir = Path(dirpath).relative_to(source)
+            (target_dir / rel_dir).mkdir(parents=True, exist_ok=True)
+            for filename in filenames:
+                _clone_file(os.path.join(dirpath, filename), str(target_dir / rel_dir / filename))
+
+    def acquire(self, owner: str, key: str):
+        """
+        Protects an entry from eviction while `owner` uses it.
+        """
+        with self._lock:
+            self.refs.setdefault(key, set()).add(owner)
+
+    def release(self, owner: str):
+        """
+        Drops every reference held by `owner` and evicts down to the budget.
+        """
+        with self._lock:
+            for key in list(self.refs):
+                self.refs[key].discard(owner)
+                if not self.refs[key]:
+                    del self.refs[key]
+            self._evict()
+
+    def _evict(self):
+        total = self.size
+        for key in list(self.entries):
+            if total <= self.budget:
+                break
+            if key in self.refs:
+                continue
+            size = self.entries.pop(key)
+            shutil.rmtree(self.root / key, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted dataset {key[:12]} from the cache ({size / 2**20:.1f} MiB)")
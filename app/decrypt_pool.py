@@ -0,0 +1,222 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from encryption import ENC_V2, estimate_decrypt_memory, load_header, open_decrypted
+from keys import KeyManager
+from settings import DECRYPT_MEMORY_LIMIT, DECRYPT_WORKERS
+from utils import directory_size, extract_zip, zip_extracted_size
+
+# Extracted sizes kept by DecryptPool.extracted_size
+SIZE_CACHE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class DatasetTask:
+    dataset_id: str
+    datasite: str
+    enc_file_path: Path
+    target_dir: Path
+
+
+class DatasetDecryptError(Exception):
+    """
+    Raised when one dataset of a job could not be decrypted or extracted.
+    """
+
+    def __init__(self, task: DatasetTask, cause: BaseException):
+        self.task = task
+        self.cause = cause
+        super().__init__(
+            f"Dataset {task.dataset_id} from {task.datasite} ({task.enc_file_path.name}): "
+            f"{type(cause).__name__}: {cause}"
+        )
+
+
+class _TimedReader:
+    """
+    Wraps a plaintext stream, adding up the time spent reading from it.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self.seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        try:
+            return self._stream.read(size)
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def extract_dataset(enc_file_path: Path, target_dir: Path, aes_key: bytes) -> dict:
+    """
+    Decrypts and extracts a single .enc dataset into target_dir.
+    Runs inside a pool worker, so it only takes picklable arguments; the
+    data key is unwrapped by the daemon and the private key never leaves it.
+    v2 files are decrypted while being extracted: the time spent reading
+    plaintext counts as decryption, the rest as extraction.
+    """
+    start = time.perf_counter()
+    with open_decrypted(enc_file_path, aes_key, spool_dir=target_dir.parent) as stream:
+        opened = time.perf_counter()
+        reader = _TimedReader(stream)
+        extract_zip(reader, target_dir)
+    total = time.perf_counter() - start
+    decrypt = opened - start + reader.seconds
+    return {
+        "decrypt_seconds": round(decrypt, 3),
+        "extract_seconds": round(total - decrypt, 3),
+        "encrypted_bytes": os.path.getsize(enc_file_path),
+        "extracted_bytes": directory_size(target_dir),
+    }
+
+
+class DecryptPool:
+    """
+    Decrypts the datasets of a job concurrently in worker processes.
+
+    At most `max_workers` datasets are in flight, and a new one is only
+    started while the estimated memory of all in-flight decryptions stays
+    below `memory_limit` (a single dataset is always admitted).
+    """
+
+    def __init__(
+        self,
+        key_manager: KeyManager,
+        max_workers: int = DECRYPT_WORKERS,
+        memory_limit: int = DECRYPT_MEMORY_LIMIT,
+    ):
+        self.key_manager = key_manager
+        self.max_workers = max(1, max_workers)
+        self.memory_limit = memory_limit
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._sizes: "OrderedDict[tuple, int]" = OrderedDict()
+        self._sizes_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers don't inherit the daemon's threads and open files
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _prepare(self, task: DatasetTask) -> Tuple[int, bytes]:
+        # Header parsing and the (cached) RSA unwrap happen in the daemon
+        header = load_header(task.enc_file_path)
+        return estimate_decrypt_memory(header), self.key_manager.unwrap(header.wrapped_key)
+
+    def extracted_size(self, enc_file_path: Path) -> int:
+        """
+        Bytes a .enc dataset takes once extracted. For v2 files this is the
+        uncompressed size from the zip's central directory, which is read
+        by decrypting only the last chunks. Legacy files would have to be
+        decrypted whole, their encrypted size is used instead, as it is for
+        files that can't be read (staging reports those).
+
+        Sizes are cached by file identity and version, admission asks for
+        them on every pass of the main loop.
+        """
+        st = os.stat(enc_file_path)
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._sizes_lock:
+            size = self._sizes.get(key)
+            if size is not None:
+                self._sizes.move_to_end(key)
+                return size
+        size = st.st_size
+        try:
+            header = load_header(enc_file_path)
+            if header.version == ENC_V2:
+                with open_decrypted(enc_file_path, self.key_manager.unwrap(header.wrapped_key)) as stream:
+                    size = zip_extracted_size(stream)
+        except Exception as e:
+            logger.warning(f"Could not read the extracted size of {enc_file_path.name}: {e}")
+            return size
+        with self._sizes_lock:
+            self._sizes[key] = size
+            while len(self._sizes) > SIZE_CACHE_SIZE:
+                self._sizes.popitem(last=False)
+        return size
+
+    def run(self, tasks: List[DatasetTask]) -> Dict[str, dict]:
+        """
+        Decrypts all tasks and returns per-dataset stats keyed by dataset id.
+        On the first failure no further datasets are started, the ones in
+        flight are awaited and a DatasetDecryptError is raised for it.
+        """
+        if self.max_workers == 1:
+            return self._run_inline(tasks)
+
+        results: Dict[str, dict] = {}
+        pending = list(tasks)
+        in_flight: Dict[Future, Tuple[DatasetTask, int]] = {}
+        reserved = 0
+        error: Optional[DatasetDecryptError] = None
+
+        while (pending and error is None) or in_flight:
+            while pending and error is None and len(in_flight) < self.max_workers:
+                task = pending[0]
+                try:
+                    memory, aes_key = self._prepare(task)
+                except Exception as e:
+                    error = DatasetDecryptError(task, e)
+                    break
+                if in_flight and reserved + memory > self.memory_limit:
+                    break
+                pending.pop(0)
+                future = self._get_executor().submit(
+                    extract_dataset, task.enc_file_path, task.target_dir, aes_key
+                )
+                in_flight[future] = (task, memory)
+                reserved += memory
+
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, memory = in_flight.pop(future)
+                reserved -= memory
+                try:
+                    results[task.dataset_id] = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. OOM killed), start a fresh pool next time
+                    self._executor = None
+                    error = error or DatasetDecryptError(task, e)
+                except Exception as e:
+                    error = error or DatasetDecryptError(task, e)
+
+        if error is not None:
+            raise error
+        return results
+
+    def _run_inline(self, tasks: List[DatasetTask]) -> Dict[str, dict]:
+        results = {}
+        for task in tasks:
+            try:
+                _, aes_key = self._prepare(task)
+                results[task.dataset_id] = extract_dataset(task.enc_file_path, task.target_dir, aes_key)
+            except Exception as e:
+                raise DatasetDecryptError(task, e) from e
+        return results
+
+    def shutdown(self):
+        if self._executor is not None:
+            logger.info("Shutting down dataset decryption workers")
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
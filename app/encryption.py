@@ -0,0 +1,467 @@
+import hashlib
+import io
+import json
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+PathLike = Union[str, Path]
+
+# Encrypted dataset (.enc) container formats
+#
+# v1 (legacy):
+#   key_len (2, BE) | wrapped_key | nonce (12) | AES-GCM(zip) | tag (16)
+#
+# v2 (chunked):
+#   magic (4) | version (1) | flags (1) | chunk_size (4, BE)
+#   | plaintext_size (8, BE) | nonce_prefix (7) | key_len (2, BE) | wrapped_key
+#   followed by ceil(plaintext_size / chunk_size) chunks (at least one), each
+#   sealed with AES-GCM on its own:
+#     nonce = nonce_prefix | chunk_index (4, BE) | final_flag (1)
+#     aad   = sha256(header) | chunk_index (4, BE) | final_flag (1)
+#
+# Binding the index and the final flag into every chunk means chunks cannot be
+# reordered, dropped or appended without failing authentication, and since each
+# chunk is independent the plaintext can be produced one chunk at a time.
+ENC_MAGIC = b"SBEN"
+ENC_V1 = 1
+ENC_V2 = 2
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# Legacy files can't be read at random offsets, they are decrypted into a
+# temp file that stays in memory up to this size
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Optional sidecar a data owner writes next to a .enc file, recording the
+# size of the complete file and the sha256 of its header:
+#   <dataset_id>.enc.manifest.json  {"size": ..., "header_sha256": ...}
+MANIFEST_SUFFIX = ".manifest.json"
+
+TAG_SIZE = 16
+NONCE_SIZE = 12
+NONCE_PREFIX_SIZE = 7
+_V2_FIXED = struct.Struct(">4sBBIQ7sH")
+
+OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None,
+)
+
+
+class InvalidEncFile(ValueError):
+    """
+    Raised when a .enc file is malformed or truncated.
+    """
+
+
+@dataclass(frozen=True)
+class EncHeader:
+    version: int
+    wrapped_key: bytes
+    # Offset of the first ciphertext byte
+    payload_offset: int
+    # v1: the GCM nonce, v2: the per-file nonce prefix
+    nonce: bytes
+    # Raw header bytes (v2 only), authenticated by every chunk
+    raw: bytes = b""
+    chunk_size: int = 0
+    plaintext_size: int = 0
+
+    @property
+    def chunk_count(self) -> int:
+        """
+        Number of chunks in a v2 file (an empty plaintext still has one).
+        """
+        if self.version != ENC_V2:
+            return 1
+        return max(1, -(-self.plaintext_size // self.chunk_size))
+
+    @property
+    def expected_file_size(self) -> int:
+        """
+        Total size a complete v2 file must have on disk.
+        """
+        return self.payload_offset + self.plaintext_size + self.chunk_count * TAG_SIZE
+
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise InvalidEncFile(f"Unexpected end of file: wanted {size} bytes, got {len(data)}")
+    return data
+
+
+def read_header(f: BinaryIO) -> EncHeader:
+    """
+    Reads the header of a .enc file, auto-detecting its version.
+    Leaves the file positioned at the first ciphertext byte.
+    """
+    f.seek(0)
+    magic = f.read(len(ENC_MAGIC))
+    if magic != ENC_MAGIC:
+        # Legacy files start directly with the length of the wrapped key
+        f.seek(0)
+        key_len = int.from_bytes(_read_exact(f, 2), "big")
+        wrapped_key = _read_exact(f, key_len)
+        nonce = _read_exact(f, NONCE_SIZE)
+        return EncHeader(
+            version=ENC_V1,
+            wrapped_key=wrapped_key,
+            payload_offset=2 + key_len + NONCE_SIZE,
+            nonce=nonce,
+        )
+
+    fixed = magic + _read_exact(f, _V2_FIXED.size - len(ENC_MAGIC))
+    _, version, _flags, chunk_size, plaintext_size, nonce_prefix, key_len = _V2_FIXED.unpack(fixed)
+    if version != ENC_V2:
+        raise InvalidEncFile(f"Unsupported .enc version {version}")
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise InvalidEncFile(f"Invalid chunk size {chunk_size}")
+    wrapped_key = _read_exact(f, key_len)
+    raw = fixed + wrapped_key
+    return EncHeader(
+        version=version,
+        wrapped_key=wrapped_key,
+        payload_offset=len(raw),
+        nonce=nonce_prefix,
+        raw=raw,
+        chunk_size=chunk_size,
+        plaintext_size=plaintext_size,
+    )
+
+
+def read_private_key(private_key_path: PathLike) -> RSAPrivateKey:
+    """
+    Loads an unencrypted PEM private key.
+    """
+    with open(private_key_path, "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+def unwrap_key(private_key: RSAPrivateKey, wrapped_key: bytes) -> bytes:
+    """
+    Decrypts the AES data key with the enclave private key.
+    """
+    return private_key.decrypt(wrapped_key, OAEP_PADDING)
+
+
+def _chunk_binding(header: EncHeader, header_digest: bytes, index: int, final: bool):
+    suffix = index.to_bytes(4, "big") + (b"\x01" if final else b"\x00")
+    return header.nonce + suffix, header_digest + suffix
+
+
+def decrypt_chunk(header: EncHeader, aesgcm: AESGCM, header_digest: bytes, index: int, sealed: bytes) -> bytes:
+    """
+    Authenticates and decrypts a single v2 chunk.
+    """
+    final = index == header.chunk_count - 1
+    nonce, aad = _chunk_binding(header, header_digest, index, final)
+    return aesgcm.decrypt(nonce, sealed, aad)
+
+
+def iter_decrypt(f: BinaryIO, header: EncHeader, aes_key: bytes, block_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the plaintext of an open .enc file piece by piece.
+
+    v2 chunks are authenticated before they are yielded. A v1 file is a
+    single GCM message, so its plaintext is only authenticated once the
+    iterator is exhausted; callers must discard everything already
+    written if it raises.
+    """
+    f.seek(header.payload_offset)
+    if header.version == ENC_V2:
+        aesgcm = AESGCM(aes_key)
+        digest = hashlib.sha256(header.raw).digest()
+        remaining = header.plaintext_size
+        for index in range(header.chunk_count):
+            size = min(header.chunk_size, remaining)
+            yield decrypt_chunk(header, aesgcm, digest, index, _read_exact(f, size + TAG_SIZE))
+            remaining -= size
+        if f.read(1):
+            raise InvalidEncFile("Trailing data after final chunk")
+        return
+
+    # Legacy: stream through the low-level GCM API, the tag is the last 16 bytes
+    body_size = os.fstat(f.fileno()).st_size - header.payload_offset - TAG_SIZE
+    if body_size < 0:
+        raise InvalidEncFile("File too short for legacy format")
+    f.seek(header.payload_offset + body_size)
+    tag = _read_exact(f, TAG_SIZE)
+    f.seek(header.payload_offset)
+    decryptor = Cipher(algorithms.AES(aes_key), modes.GCM(header.nonce, tag)).decryptor()
+    while body_size > 0:
+        block = _read_exact(f, min(block_size, body_size))
+        body_size -= len(block)
+        yield decryptor.update(block)
+    yield decryptor.finalize()
+
+
+class DecryptedReader(io.RawIOBase):
+    """
+    Seekable, read-only plaintext view of a v2 .enc file.
+
+    Chunks are decrypted and authenticated on demand and only the current
+    one is kept in memory, so consumers like ZipFile can jump to the
+    central directory and then stream members without a plaintext copy.
+    """
+
+    def __init__(self, f: BinaryIO, header: EncHeader, aes_key: bytes):
+        if header.version != ENC_V2:
+            raise ValueError("Random access requires a v2 .enc file")
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size != header.expected_file_size:
+            raise InvalidEncFile(
+                f"Size mismatch: header declares {header.expected_file_size} bytes, file has {file_size}"
+            )
+        self._f = f
+        self._header = header
+        self._aesgcm = AESGCM(aes_key)
+        self._digest = hashlib.sha256(header.raw).digest()
+        self._pos = 0
+        self._chunk_index = -1
+        self._chunk = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._header.plaintext_size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def _load_chunk(self, index: int):
+        header = self._header
+        start = index * header.chunk_size
+        size = min(header.chunk_size, header.plaintext_size - start)
+        self._f.seek(header.payload_offset + index * (header.chunk_size + TAG_SIZE))
+        sealed = _read_exact(self._f, size + TAG_SIZE)
+        self._chunk = memoryview(decrypt_chunk(header, self._aesgcm, self._digest, index, sealed))
+        self._chunk_index = index
+
+    def readinto(self, b) -> int:
+        if self._pos >= self._header.plaintext_size:
+            return 0
+        index, start = divmod(self._pos, self._header.chunk_size)
+        if index != self._chunk_index:
+            self._load_chunk(index)
+        n = min(len(b), len(self._chunk) - start)
+        b[:n] = self._chunk[start:start + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._chunk = memoryview(b"")
+            self._f.close()
+        super().close()
+
+
+def load_header(enc_file_path: PathLike) -> EncHeader:
+    """
+    Reads only the header of a .enc file on disk.
+    """
+    with open(enc_file_path, "rb") as f:
+        return read_header(f)
+
+
+def manifest_path(enc_file_path: PathLike) -> Path:
+    return Path(f"{enc_file_path}{MANIFEST_SUFFIX}")
+
+
+def _read_manifest_fields(f: BinaryIO, header: EncHeader) -> dict:
+    f.seek(0)
+    return {
+        "size": os.fstat(f.fileno()).st_size,
+        "header_sha256": hashlib.sha256(_read_exact(f, header.payload_offset)).hexdigest(),
+    }
+
+
+def write_manifest(enc_file_path: PathLike) -> Path:
+    """
+    Writes the manifest of a complete .enc file, so the enclave can tell
+    when a synced copy of it is complete.
+    """
+    with open(enc_file_path, "rb") as f:
+        manifest = _read_manifest_fields(f, read_header(f))
+    path = manifest_path(enc_file_path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest))
+    os.replace(tmp_path, path)
+    return path
+
+
+def check_enc_file(enc_file_path: PathLike, require_manifest: bool = False) -> EncHeader:
+    """
+    Checks that a .enc file is complete without decrypting it: its header
+    parses, a v2 file has the size its header declares (the payload plus a
+    tag per chunk), and the file matches its manifest if it has one.
+    Only the header is read. Raises InvalidEncFile otherwise.
+    """
+    with open(enc_file_path, "rb") as f:
+        header = read_header(f)
+        size = os.fstat(f.fileno()).st_size
+        if header.version == ENC_V2 and size != header.expected_file_size:
+            raise InvalidEncFile(
+                f"Size mismatch: header declares {header.expected_file_size} bytes "
+                f"({header.chunk_count} chunks), file has {size}"
+            )
+        if size < header.payload_offset + TAG_SIZE:
+            raise InvalidEncFile(f"Truncated: {size} bytes")
+        try:
+            manifest = json.loads(manifest_path(enc_file_path).read_text())
+        except FileNotFoundError:
+            if require_manifest:
+                raise InvalidEncFile("No manifest")
+            return header
+        except (OSError, ValueError) as e:
+            raise InvalidEncFile(f"Unreadable manifest: {e}")
+        if not isinstance(manifest, dict):
+            raise InvalidEncFile("Unreadable manifest")
+        if manifest.get("size") != size:
+            raise InvalidEncFile(f"Size mismatch: manifest declares {manifest.get('size')} bytes, file has {size}")
+        if manifest.get("header_sha256") != _read_manifest_fields(f, header)["header_sha256"]:
+            # A new upload of the file, or of the manifest, still syncing
+            raise InvalidEncFile("Header does not match the manifest")
+    return header
+
+
+def enc_file_problem(enc_file_path: PathLike, require_manifest: bool = False) -> Optional[str]:
+    """
+    Why a .enc file can't be decrypted yet (missing, incomplete), or None.
+    """
+    try:
+        check_enc_file(enc_file_path, require_manifest)
+    except FileNotFoundError:
+        return "not found"
+    except (OSError, InvalidEncFile) as e:
+        return str(e)
+    return None
+
+
+@contextmanager
+def open_decrypted(
+    enc_file_path: PathLike, aes_key: bytes, spool_dir: Optional[PathLike] = None
+) -> Iterator[BinaryIO]:
+    """
+    Opens a .enc file as a seekable binary plaintext stream, given its
+    unwrapped AES data key.
+
+    v2 files are decrypted lazily through DecryptedReader. Legacy files are
+    fully decrypted and authenticated into a spooled temp file first.
+    """
+    f = open(enc_file_path, "rb")
+    try:
+        header = read_header(f)
+        if header.version == ENC_V2:
+            reader = io.BufferedReader(DecryptedReader(f, header, aes_key))
+        else:
+            reader = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=spool_dir)
+            for block in iter_decrypt(f, header, aes_key):
+                reader.write(block)
+            reader.seek(0)
+            f.close()
+    except BaseException:
+        f.close()
+        raise
+    with reader:
+        yield reader
+
+
+def estimate_decrypt_memory(header: EncHeader) -> int:
+    """
+    Rough upper bound of the plaintext held in memory while a .enc file is
+    decrypted through open_decrypted.
+    """
+    if header.version == ENC_V2:
+        # Current chunk, its ciphertext and the zip inflate buffers
+        return 2 * header.chunk_size + DEFAULT_CHUNK_SIZE
+    return SPOOL_MAX_SIZE + 2 * DEFAULT_CHUNK_SIZE
+
+
+def decrypt_file(enc_file_path: PathLike, private_key: RSAPrivateKey, out: BinaryIO) -> int:
+    """
+    Decrypts a .enc file of either version into the binary file object `out`.
+    Returns the number of plaintext bytes written.
+    """
+    written = 0
+    with open(enc_file_path, "rb") as f:
+        header = read_header(f)
+        aes_key = unwrap_key(private_key, header.wrapped_key)
+        for block in iter_decrypt(f, header, aes_key):
+            out.write(block)
+            written += len(block)
+    return written
+
+
+def encrypt_stream(
+    src: BinaryIO,
+    plaintext_size: int,
+    dst: BinaryIO,
+    public_key: RSAPublicKey,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """
+    Encrypts `plaintext_size` bytes from `src` into `dst` using the v2 format.
+    """
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Invalid chunk size {chunk_size}")
+    aes_key = AESGCM.generate_key(bit_length=256)
+    wrapped_key = public_key.encrypt(aes_key, OAEP_PADDING)
+    nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    raw = _V2_FIXED.pack(
+        ENC_MAGIC, ENC_V2, 0, chunk_size, plaintext_size, nonce_prefix, len(wrapped_key),
+    ) + wrapped_key
+    header = EncHeader(
+        version=ENC_V2,
+        wrapped_key=wrapped_key,
+        payload_offset=len(raw),
+        nonce=nonce_prefix,
+        raw=raw,
+        chunk_size=chunk_size,
+        plaintext_size=plaintext_size,
+    )
+    aesgcm = AESGCM(aes_key)
+    digest = hashlib.sha256(raw).digest()
+    dst.write(raw)
+    remaining = plaintext_size
+    for index in range(header.chunk_count):
+        chunk = _read_exact(src, min(chunk_size, remaining))
+        remaining -= len(chunk)
+        nonce, aad = _chunk_binding(header, digest, index, index == header.chunk_count - 1)
+        dst.write(aesgcm.encrypt(nonce, chunk, aad))
+
+
+def encrypt_file(
+    src_path: PathLike,
+    enc_file_path: PathLike,
+    public_key: RSAPublicKey,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    """
+    Encrypts a (zip) file on disk into a v2 .enc file, with its manifest.
+    """
+    with open(src_path, "rb") as src, open(enc_file_path, "wb") as dst:
+        encrypt_stream(src, os.fstat(src.fileno()).st_size, dst, public_key, chunk_size)
+    write_manifest(enc_file_path)
@@ -0,0 +1,208 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+from loguru import logger
+
+from settings import ENV_BUILD_TIMEOUT, ENV_CACHE_SIZE, WHEELHOUSE
+
+# Looked up in this order in a project's code directory
+REQUIREMENTS_FILES = ("requirements.lock", "requirements.txt")
+READY_MARKER = ".enclave-ready"
+
+
+class EnvBuildError(Exception):
+    """
+    Raised when the environment for a project's requirements can't be built.
+    """
+
+
+def find_requirements(code_dir: Path) -> Optional[Path]:
+    for name in REQUIREMENTS_FILES:
+        path = code_dir / name
+        if path.is_file():
+            return path
+    return None
+
+
+class EnvCache:
+    """
+    Virtualenvs for projects that ship a requirements file in code/.
+
+    One environment is built per distinct requirements content (and base
+    interpreter) in a background thread, on top of the host python3's
+    site-packages. With a `wheelhouse` directory, packages are installed
+    from it only, without network access. At most `max_envs` environments
+    are kept; the least recently used ones that no running project holds
+    are removed first.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_envs: int = ENV_CACHE_SIZE,
+        wheelhouse: str = WHEELHOUSE,
+        python: str = "python3",
+        on_ready: Callable[[], None] = lambda: None,
+    ):
+        self.root = Path(root)
+        self.max_envs = max(1, max_envs)
+        self.wheelhouse = wheelhouse
+        self.base_python = python
+        self.on_ready = on_ready
+        self.builds: Dict[str, Future] = {}
+        # key -> error of the last build, not retried until a restart
+        self.failed: Dict[str, str] = {}
+        # key -> owners (project names) running in the environment
+        self.refs: Dict[str, Set[str]] = {}
+        self._python_version: Optional[str] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and not (Path(entry.path) / READY_MARKER).exists():
+                # Interrupted build
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    @property
+    def runtime_version(self) -> str:
+        """
+        Path and version of the host python3.
+        """
+        if self._python_version is None:
+            self._python_version = subprocess.run(
+                [self.base_python, "-c", "import sys; print(sys.executable, sys.version)"],
+                capture_output=True, text=True, check=True,
+            ).stdout
+        return self._python_version
+
+    def _key(self, requirements: bytes) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.runtime_version.encode())
+        digest.update(self.wheelhouse.encode())
+        digest.update(requirements)
+        return digest.hexdigest()[:32]
+
+    def _env_python(self, key: str) -> Path:
+        return self.root / key / "bin" / "python"
+
+    def _is_ready(self, key: str) -> bool:
+        return (self.root / key / READY_MARKER).exists()
+
+    def prepare(self, code_dir: Path) -> Optional[str]:
+        """
+        Starts building the environment for a project's requirements if it
+        doesn't exist yet. Returns its key, or None without requirements.
+        """
+        requirements_path = find_requirements(code_dir)
+        if requirements_path is None:
+            return None
+        requirements = requirements_path.read_bytes()
+        key = self._key(requirements)
+        if key in self.builds or key in self.failed or self._is_ready(key):
+            return key
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="envs")
+        logger.info(f"Building environment {key[:12]} for {requirements_path}")
+        future = self._executor.submit(self._build, key, requirements)
+        future.add_done_callback(lambda future: self.on_ready())
+        self.builds[key] = future
+        return key
+
+    def python(self, owner: str, code_dir: Path) -> Optional[str]:
+        """
+        Interpreter to run a project with: the host python3 without
+        requirements, the environment's python once it is built, None
+        while it is building. Raises EnvBuildError if the build failed.
+        """
+        key = self.prepare(code_dir)
+        if key is None:
+            return self.base_python
+        future = self.builds.get(key)
+        if future is not None:
+            if not future.done():
+                return None
+            del self.builds[key]
+            if future.exception() is not None:
+                self.failed[key] = str(future.exception())
+        if key in self.failed:
+            raise EnvBuildError(self.failed[key])
+        with self._lock:
+            self.refs.setdefault(key, set()).add(owner)
+        os.utime(self.root / key / READY_MARKER)
+        return str(self._env_python(key))
+
+    def _build(self, key: str, requirements: bytes):
+        path = self.root / key
+        shutil.rmtree(path, ignore_errors=True)
+        requirements_file = self.root / f"{key}.requirements.txt"
+        requirements_file.write_bytes(requirements)
+        log_path = self.root / f"{key}.log"
+        pip_install = [
+            str(self._env_python(key)), "-m", "pip", "install",
+            "--disable-pip-version-check", "--no-input", "-r", str(requirements_file),
+        ]
+        if self.wheelhouse:
+            pip_install += ["--no-index", "--find-links", self.wheelhouse]
+        steps = [
+            ("venv", [self.base_python, "-m", "venv", "--system-site-packages", str(path)]),
+            ("pip install", pip_install),
+        ]
+        try:
+            with open(log_path, "w") as log:
+                for step, cmd in steps:
+                    try:
+                        subprocess.run(
+                            cmd, stdout=log, stderr=subprocess.STDOUT, check=True, timeout=ENV_BUILD_TIMEOUT,
+                            stdin=subprocess.DEVNULL,
+                        )
+                    except subprocess.CalledProcessError as e:
+                        raise EnvBuildError(f"{step} exited with code {e.returncode}") from e
+                    except subprocess.TimeoutExpired as e:
+                        raise EnvBuildError(f"{step} timed out after {ENV_BUILD_TIMEOUT}s") from e
+                    except OSError as e:
+                        raise EnvBuildError(f"{step} failed: {e}") from e
+        except EnvBuildError as e:
+            shutil.rmtree(path, ignore_errors=True)
+            logger.error(f"Building environment {key[:12]} failed: {e}")
+            tail = log_path.read_text(errors="replace").strip().splitlines()[-5:]
+            raise EnvBuildError("\n".join([str(e)] + tail)) from e.__cause__
+        finally:
+            requirements_file.unlink(missing_ok=True)
+        (path / READY_MARKER).touch()
+        logger.info(f"Environment {key[:12]} is ready")
+        self._evict()
+
+    def release(self, owner: str):
+        """
+        Drops the references held by `owner` and evicts down to max_envs.
+        """
+        with self._lock:
+            for key in list(self.refs):
+                self.refs[key].discard(owner)
+                if not self.refs[key]:
+                    del self.refs[key]
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            ready = sorted(
+                (marker.stat().st_mtime, marker.parent.name)
+                for marker in self.root.glob(f"*/{READY_MARKER}")
+            )
+            for _, key in ready[:max(0, len(ready) - self.max_envs)]:
+                if key in self.refs:
+                    continue
+                logger.info(f"Removing least recently used environment {key[:12]}")
+                shutil.rmtree(self.root / key, ignore_errors=True)
+                (self.root / f"{key}.log").unlink(missing_ok=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,185 @@
+"""
+Fork server for enclave jobs.
+
+Started by the enclave with the same python3 that runs entrypoints. It
+imports the modules listed in ENCLAVE_WARM_POOL_PRELOAD once, then forks
+a child for every job it is asked to run, so jobs skip interpreter
+startup and the preloaded imports. Each child gets a new session, its
+own environment, working directory and log file, like a fresh process,
+and enters the job's cgroup and resource limits before the entrypoint runs.
+
+Requests and replies are JSON messages on a SOCK_SEQPACKET socket whose
+fd is passed as the only argument; the job's log file descriptor travels
+with the request. Only the standard library is used here, as the host
+python3 may not have the enclave's dependencies.
+"""
+import atexit
+import importlib
+import json
+import os
+import resource
+import runpy
+import select
+import signal
+import socket
+import sys
+import threading
+import traceback
+
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+
+def _send(sock: socket.socket, message: dict):
+    sock.send(json.dumps(message).encode())
+
+
+def _preload(modules):
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f"forkserver: could not preload {name}: {e}", file=sys.stderr, flush=True)
+    return loaded
+
+
+def apply_limits(rlimits, cgroup=None):
+    """
+    Moves the calling process into `cgroup` (a cgroup v2 directory) and
+    sets its (resource, soft, hard) `rlimits`. Run in a job's process
+    before the entrypoint, also as the preexec_fn of jobs started without
+    the fork server.
+    """
+    if cgroup:
+        fd = os.open(os.path.join(cgroup, "cgroup.procs"), os.O_WRONLY)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+        finally:
+            os.close(fd)
+    for rlimit, soft, hard in rlimits:
+        resource.setrlimit(rlimit, (soft, hard))
+
+
+def _exit_code(e: SystemExit) -> int:
+    # Same rules as the interpreter applies to an uncaught SystemExit
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def _run_job(request: dict, log_fd: int) -> int:
+    os.setsid()
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(null_fd)
+    os.close(log_fd)
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.argv = list(request["argv"])
+    sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+    try:
+        apply_limits(request.get("rlimits", []), request.get("cgroup"))
+    except OSError as e:
+        print(f"Could not apply resource limits: {e}", file=sys.stderr, flush=True)
+        return 1
+    try:
+        runpy.run_path(sys.argv[0], run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        code = _exit_code(e)
+    except BaseException as e:
+        # Starts at the entrypoint's frames, like an uncaught exception would
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        code = 1
+    _finalize()
+    return code
+
+
+def _finalize():
+    # What the interpreter does on exit and os._exit() skips: wait for
+    # non-daemon threads, run atexit handlers, flush stdio
+    try:
+        threading._shutdown()
+    except BaseException:
+        traceback.print_exc()
+    atexit._run_exitfuncs()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+
+
+def _reap(sock: socket.socket):
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        _send(sock, {
+            "exited": pid,
+            "returncode": os.waitstatus_to_exitcode(status),
+            "rusage": [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss],
+        })
+
+
+def serve(sock: socket.socket):
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w, warn_on_full_buffer=False)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    loaded = _preload(filter(None, os.environ.get("ENCLAVE_WARM_POOL_PRELOAD", "").split(",")))
+    _send(sock, {"ready": os.getpid(), "preloaded": loaded})
+
+    while True:
+        ready, _, _ = select.select([sock, wake_r], [], [])
+        if wake_r in ready:
+            try:
+                while os.read(wake_r, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            _reap(sock)
+        if sock not in ready:
+            continue
+        message, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE_SIZE, 1)
+        if not message:
+            # The enclave went away
+            return
+        request = json.loads(message)
+        if not fds:
+            _send(sock, {"id": request["id"], "error": "missing log file descriptor"})
+            continue
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                sock.close()
+                os.close(wake_r)
+                os.close(wake_w)
+                code = _run_job(request, fds[0])
+            finally:
+                # Never return into the server loop
+                os._exit(code)
+        os.close(fds[0])
+        _send(sock, {"id": request["id"], "pid": pid})
+
+
+if __name__ == "__main__":
+    serve(socket.socket(fileno=int(sys.argv[1])))
@@ -0,0 +1,173 @@
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Job states. "launching" and "finishing" are recorded before a folder is
+# moved and cleared once it has been, so an interrupted move can be told
+# apart from a finished one on recovery.
+LAUNCH = "launch"
+LAUNCHING = "launching"
+RUNNING = "running"
+STARTED = "started"
+FINISHING = "finishing"
+DONE = "done"
+# Done folder compacted into an archive tarball
+ARCHIVED = "archived"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitter TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    submitted_at REAL,
+    launched_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    exit_code INTEGER,
+    failure TEXT,
+    -- Tarball an archived job's done folder is in
+    archive TEXT,
+    -- Of its code, datasets, output owners and runtime (see job_fingerprint),
+    -- empty if it could not be computed
+    fingerprint TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, launched_at, name);
+CREATE INDEX IF NOT EXISTS jobs_by_finish ON jobs (finished_at);
+CREATE INDEX IF NOT EXISTS jobs_by_update ON jobs (state, updated_at);
+CREATE TABLE IF NOT EXISTS datasets (
+    job TEXT NOT NULL,
+    dataset_id TEXT NOT NULL,
+    datasite TEXT NOT NULL,
+    path TEXT NOT NULL,
+    ready INTEGER NOT NULL,
+    PRIMARY KEY (job, dataset_id)
+);
+"""
+
+
+class JobJournal:
+    """
+    SQLite (WAL) journal of the state of every job, its attempts, the time
+    of its transitions and the readiness of its datasets.
+
+    The job folders in jobs/launch|running|done stay the source of truth
+    the clients see; the journal records the daemon's intent before each
+    move, so recovery on startup can finish or roll back interrupted
+    moves, and answers state queries without walking the directories.
+    Only used from the main thread.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(self.path, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints, a power loss may only lose the last transitions
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        self._conn.executescript(SCHEMA)
+
+    def _migrate(self):
+        # Columns added after the first version of the journal
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if not columns:
+            return
+        for column, definition in [
+            ("submitter", "TEXT"),
+            ("priority", "INTEGER NOT NULL DEFAULT 0"),
+            ("archive", "TEXT"),
+            ("fingerprint", "TEXT"),
+        ]:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    def get(self, name: str) -> Optional[sqlite3.Row]:
+        return self._conn.execute("SELECT * FROM jobs WHERE name = ?", (name,)).fetchone()
+
+    def jobs(self, *states: str) -> List[sqlite3.Row]:
+        """
+        Jobs in any of the given states, in launch order.
+        """
+        marks = ",".join("?" * len(states))
+        return self._conn.execute(
+            f"SELECT * FROM jobs WHERE state IN ({marks}) ORDER BY launched_at, name", states
+        ).fetchall()
+
+    def names(self, *states: str) -> List[str]:
+        return [row["name"] for row in self.jobs(*states)]
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def transition(self, name: str, state: str, **fields):
+        """
+        Moves a job to `state`, creating it if needed, and sets the given
+        columns.
+        """
+        columns = {"state": state, "updated_at": time.time(), **fields}
+        assignments = ", ".join(f"{column} = excluded.{column}" for column in columns)
+        self._conn.execute(
+            f"INSERT INTO jobs (name, {', '.join(columns)}) VALUES (?{', ?' * len(columns)}) "
+            f"ON CONFLICT (name) DO UPDATE SET {assignments}",
+            (name, *columns.values()),
+        )
+
+    def increment_attempts(self, name: str) -> int:
+        self._conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE name = ?", (name,))
+        return self.get(name)["attempts"]
+
+    def usage_rows(self, finished_since: float) -> List[sqlite3.Row]:
+        """
+        Submitters of the started jobs and of the ones finished since then.
+        """
+        return self._conn.execute(
+            "SELECT submitter, state, finished_at FROM jobs WHERE state = ? OR finished_at >= ?",
+            (STARTED, finished_since),
+        ).fetchall()
+
+    def done_before(self, cutoff: float, limit: int) -> List[sqlite3.Row]:
+        """
+        Up to `limit` jobs moved to done before `cutoff`, oldest first.
+        """
+        return self._conn.execute(
+            "SELECT * FROM jobs WHERE state = ? AND updated_at < ? ORDER BY updated_at LIMIT ?",
+            (DONE, cutoff, limit),
+        ).fetchall()
+
+    def set_datasets(self, name: str, datasets: Iterable[Tuple[str, str, Path, bool]]):
+        """
+        Replaces the (dataset_id, datasite, path, ready) entries of a job.
+        """
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM datasets WHERE job = ?", (name,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO datasets (job, dataset_id, datasite, path, ready) VALUES (?, ?, ?, ?, ?)",
+                [(name, str(dataset_id), datasite, str(path), int(ready)) for dataset_id, datasite, path, ready in datasets],
+            )
+
+    def datasets(self, name: str) -> List[sqlite3.Row]:
+        return self._conn.execute("SELECT * FROM datasets WHERE job = ? ORDER BY dataset_id", (name,)).fetchall()
+
+    def remove(self, name: str):
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM jobs WHERE name = ?", (name,))
+            self._conn.execute("DELETE FROM datasets WHERE job = ?", (name,))
+
+    def sync_launch(self, names: Iterable[str]):
+        """
+        Forgets jobs recorded as waiting in launch that are no longer there,
+        e.g. withdrawn by their owner.
+        """
+        names = set(names)
+        for name in self.names(LAUNCH):
+            if name not in names:
+                self.remove(name)
+
+    def close(self):
+        self._conn.close()
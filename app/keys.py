@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from loguru import logger
+
+from encryption import read_private_key, unwrap_key
+from settings import KEY_CACHE_SIZE
+
+
+def _wipe(buf: bytearray):
+    buf[:] = bytes(len(buf))
+
+
+class KeyManager:
+    """
+    Holds the enclave private key and a bounded, memory-only LRU of
+    unwrapped AES data keys.
+
+    The PEM file is parsed once and only re-read when its mtime, size or
+    inode change. Data keys are cached by the SHA-256 of the wrapped key,
+    so a .enc file used by several projects costs a single RSA unwrap.
+    Evicted keys are zeroed. Callers receive an immutable copy of the key.
+    """
+
+    def __init__(self, private_key_path: Path, max_cached_keys: int = KEY_CACHE_SIZE):
+        self.private_key_path = Path(private_key_path)
+        self.max_cached_keys = max_cached_keys
+        self._private_key: Optional[RSAPrivateKey] = None
+        self._key_stat: Optional[Tuple[int, int, int]] = None
+        self._data_keys: "OrderedDict[bytes, bytearray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _stat(self) -> Tuple[int, int, int]:
+        st = os.stat(self.private_key_path)
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def private_key(self) -> RSAPrivateKey:
+        """
+        Returns the private key, reloading it if the file changed on disk.
+        """
+        with self._lock:
+            key_stat = self._stat()
+            if self._private_key is None or key_stat != self._key_stat:
+                if self._private_key is not None:
+                    logger.info(f"Private key {self.private_key_path} changed, reloading")
+                    # Keys unwrapped with the previous key pair are dropped
+                    self._clear()
+                self._private_key = read_private_key(self.private_key_path)
+                self._key_stat = key_stat
+            return self._private_key
+
+    def unwrap(self, wrapped_key: bytes) -> bytes:
+        """
+        Returns the AES data key for `wrapped_key`, from the cache if possible.
+        """
+        digest = hashlib.sha256(wrapped_key).digest()
+        private_key = self.private_key()
+        with self._lock:
+            cached = self._data_keys.get(digest)
+            if cached is not None:
+                self._data_keys.move_to_end(digest)
+                return bytes(cached)
+
+        data_key = unwrap_key(private_key, wrapped_key)
+        if self.max_cached_keys <= 0:
+            return data_key
+
+        with self._lock:
+            self._data_keys[digest] = bytearray(data_key)
+            self._data_keys.move_to_end(digest)
+            while len(self._data_keys) > self.max_cached_keys:
+                _, evicted = self._data_keys.popitem(last=False)
+                _wipe(evicted)
+        return data_key
+
+    def _clear(self):
+        while self._data_keys:
+            _, key = self._data_keys.popitem()
+            _wipe(key)
+
+    def clear(self):
+        """
+        Wipes all cached data keys.
+        """
+        with self._lock:
+            self._clear()
@@ -0,0 +1,241 @@
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from encryption import enc_file_problem
+from spec import JobSpec
+from settings import REQUIRE_DATASET_MANIFEST
+
+
+def stat_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """
+    (mtime_ns, size) of a path, or None if it does not exist.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@dataclass
+class PendingProject:
+    """
+    Cached state of a project folder waiting in jobs/launch.
+    """
+    name: str
+    folder: Path
+    # Signature of the folder and its config.yaml when they were last parsed
+    signature: Optional[tuple] = None
+    spec: Optional[JobSpec] = None
+    dataset_paths: List[Path] = field(default_factory=list)
+    data_sources: List[list] = field(default_factory=list)
+    # Dataset files known to be complete
+    found: Set[Path] = field(default_factory=set)
+    # Why dataset files that exist are not complete yet
+    incomplete: Dict[Path, str] = field(default_factory=dict)
+    # Dataset ids last written to metrics.yaml as succeeded, and the
+    # signature metrics.yaml had right after that write
+    reported: Set[str] = field(default_factory=set)
+    metrics_signature: Optional[tuple] = None
+    error: Optional[str] = None
+    # Whether error is an invalid config.yaml, rather than a missing one
+    invalid: bool = False
+
+    @property
+    def missing(self) -> List[Path]:
+        return [path for path in self.dataset_paths if path not in self.found]
+
+    @property
+    def found_ids(self) -> Set[str]:
+        return {
+            str(dataset_id)
+            for path, (_, dataset_id) in zip(self.dataset_paths, self.data_sources)
+            if path in self.found
+        }
+
+
+class LaunchIndex:
+    """
+    In-memory index of the projects in jobs/launch.
+
+    A project's config.yaml is only parsed again when the signature of the
+    project folder or of the config file changes. Missing dataset files are
+    tracked in a reverse index, grouped by data directory, from each .enc
+    path to the projects waiting on it, so every missing file is checked
+    once no matter how many projects need it. A file only counts once it
+    is complete, which its header (and manifest) tell without decrypting
+    it, so a partly synced file never makes a project ready.
+
+    refresh() only returns projects whose config, dataset availability or
+    metrics.yaml changed. Given the set of directories that changed (from
+    file events) it only looks at those, so a tick costs time proportional
+    to what changed rather than to the queue size.
+    """
+
+    def __init__(self, launch_dir: Path, load_project: Callable[[Path], Tuple[JobSpec, list, list]]):
+        self.launch_dir = launch_dir
+        # Returns (spec, dataset_paths, data_sources) for a config.yaml path
+        self.load_project = load_project
+        self.projects: Dict[str, PendingProject] = {}
+        # Names of the projects with an invalid config.yaml
+        self.invalid: Set[str] = set()
+        # data dir -> missing .enc path -> names of the projects waiting on it
+        self.waiting: Dict[Path, Dict[Path, Set[str]]] = {}
+        self._dir_signature = None
+
+    def _sync_folders(self) -> List[PendingProject]:
+        signature = stat_signature(self.launch_dir)
+        if signature == self._dir_signature:
+            return []
+        self._dir_signature = signature
+        names = {entry.name for entry in os.scandir(self.launch_dir) if entry.is_dir()}
+        for name in self.projects.keys() - names:
+            self.remove(name)
+        added = []
+        for name in names - self.projects.keys():
+            project = PendingProject(name=name, folder=self.launch_dir / name)
+            self.projects[name] = project
+            added.append(project)
+        return added
+
+    def _check(self, project: PendingProject, path: Path) -> bool:
+        problem = enc_file_problem(path, REQUIRE_DATASET_MANIFEST)
+        if problem is None:
+            project.found.add(path)
+            project.incomplete.pop(path, None)
+            return True
+        if path.exists():
+            project.incomplete[path] = problem
+        return False
+
+    def _wait_for(self, project: PendingProject, path: Path):
+        self.waiting.setdefault(path.parent, {}).setdefault(path, set()).add(project.name)
+
+    def _stop_waiting(self, project: PendingProject):
+        for path in project.missing:
+            by_path = self.waiting.get(path.parent, {})
+            names = by_path.get(path)
+            if names is None:
+                continue
+            names.discard(project.name)
+            if not names:
+                del by_path[path]
+            if not by_path:
+                self.waiting.pop(path.parent, None)
+
+    def _load(self, project: PendingProject):
+        config_file_path = project.folder / "config.yaml"
+        self._stop_waiting(project)
+        project.spec = None
+        project.dataset_paths, project.data_sources = [], []
+        project.found = set()
+        project.incomplete = {}
+        project.invalid = False
+        self.invalid.discard(project.name)
+        if not config_file_path.exists() or config_file_path.stat().st_size == 0:
+            # Not written yet, the folder or config signature changes once it is
+            project.error = "config.yaml not found"
+            return
+        try:
+            project.spec, project.dataset_paths, project.data_sources = self.load_project(config_file_path)
+            project.error = None
+        except Exception as e:
+            project.error = str(e)
+            project.invalid = True
+            self.invalid.add(project.name)
+            logger.warning(f"Invalid launch project {project.name}: {e}")
+            return
+        for path in project.dataset_paths:
+            if not self._check(project, path):
+                self._wait_for(project, path)
+
+    def _check_project(self, project: PendingProject) -> bool:
+        signature = (
+            stat_signature(project.folder),
+            stat_signature(project.folder / "config.yaml"),
+        )
+        dirty = False
+        if signature != project.signature:
+            project.signature = signature
+            self._load(project)
+            dirty = True
+        if project.error is not None:
+            return False
+        if stat_signature(project.folder / "metrics.yaml") != project.metrics_signature:
+            # Someone else (re)wrote metrics.yaml, report the statuses again
+            project.reported = set()
+            dirty = True
+        return dirty
+
+    def _arrived(self, data_dirs: Iterable[Path]) -> Set[str]:
+        # Stats each waited-on file under the given data dirs once and
+        # returns the projects that gained a dataset
+        ready = set()
+        for data_dir in list(data_dirs):
+            by_path = self.waiting.get(data_dir, {})
+            for path, names in list(by_path.items()):
+                problem = enc_file_problem(path, REQUIRE_DATASET_MANIFEST)
+                projects = [self.projects[name] for name in names if name in self.projects]
+                if problem is not None:
+                    if path.exists():
+                        for project in projects:
+                            project.incomplete[path] = problem
+                    continue
+                del by_path[path]
+                for project in projects:
+                    project.found.add(path)
+                    project.incomplete.pop(path, None)
+                    ready.add(project.name)
+            if not by_path:
+                self.waiting.pop(data_dir, None)
+        return ready
+
+    def refresh(self, changed: Optional[Set[Path]] = None) -> List[PendingProject]:
+        """
+        Brings the index up to date and returns the projects to re-evaluate.
+        `changed` is the set of directories with file events since the last
+        call, or None to check everything.
+        """
+        if changed is None:
+            self._sync_folders()
+            candidates = list(self.projects.values())
+            data_dirs = list(self.waiting)
+        else:
+            candidates = self._sync_folders() if self.launch_dir in changed else []
+            candidates += [
+                self.projects[path.name]
+                for path in changed
+                if path.parent == self.launch_dir and path.name in self.projects
+            ]
+            # A data dir is affected by events on itself or on an ancestor
+            # (e.g. a datasite folder that was synced as a whole)
+            data_dirs = [
+                data_dir for data_dir in self.waiting
+                if data_dir in changed or any(parent in changed for parent in data_dir.parents)
+            ]
+
+        dirty = {project.name for project in candidates if self._check_project(project)}
+        dirty |= self._arrived(data_dirs)
+        return [self.projects[name] for name in dirty if name in self.projects]
+
+    def recheck(self, project: PendingProject) -> bool:
+        """
+        Checks again, right before a project is launched, that its datasets
+        are complete, e.g. not replaced by an upload still syncing. Waits
+        again for the ones that aren't. Returns whether all are.
+        """
+        for path in list(project.found):
+            project.found.discard(path)
+            if not self._check(project, path):
+                self._wait_for(project, path)
+        return not project.missing
+
+    def remove(self, name: str):
+        project = self.projects.pop(name, None)
+        self.invalid.discard(name)
+        if project is not None:
+            self._stop_waiting(project)
@@ -0,0 +1,57 @@
+from pathlib import Path
+from typing import Optional
+
+from settings import JOBS_LAYOUT
+from spec import ARCHIVED_SUFFIX, shard
+
+FLAT = "flat"
+SHARDED = "sharded"
+
+
+class JobsLayout:
+    """
+    Where finished projects and their outputs live under jobs/.
+
+    In the flat layout they are jobs/done/<name> and jobs/outputs/<name>;
+    in the sharded layout jobs/done/<shard>/<name> and
+    jobs/outputs/<shard>/<name>. An archived done folder is replaced by a
+    <name>.archived.yaml stub next to where it was. New projects are written in the configured
+    layout, lookups also find projects written in the other one.
+    """
+
+    def __init__(self, jobs_dir: Path, layout: str = JOBS_LAYOUT):
+        if layout not in (FLAT, SHARDED):
+            raise ValueError(f"Unknown jobs layout {layout!r}")
+        self.jobs_dir = Path(jobs_dir)
+        self.sharded = layout == SHARDED
+
+    def _path(self, kind: str, name: str, sharded: bool) -> Path:
+        if sharded:
+            return self.jobs_dir / kind / shard(name) / name
+        return self.jobs_dir / kind / name
+
+    def done_dir(self, name: str) -> Path:
+        return self._path("done", name, self.sharded)
+
+    def output_dir(self, name: str) -> Path:
+        return self._path("outputs", name, self.sharded)
+
+    def _find(self, kind: str, name: str) -> Optional[Path]:
+        for sharded in (self.sharded, not self.sharded):
+            path = self._path(kind, name, sharded)
+            if path.exists():
+                return path
+        return None
+
+    def find_done(self, name: str) -> Optional[Path]:
+        return self._find("done", name)
+
+    def find_output(self, name: str) -> Optional[Path]:
+        return self._find("outputs", name)
+
+    def find_archived(self, name: str) -> Optional[Path]:
+        for sharded in (self.sharded, not self.sharded):
+            path = self._path("done", name, sharded).with_name(f"{name}{ARCHIVED_SUFFIX}")
+            if path.exists():
+                return path
+        return None
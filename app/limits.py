@@ -0,0 +1,174 @@
+import resource
+import signal
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+from settings import (
+    CGROUP_ROOT,
+    JOB_ADDRESS_SPACE_MB,
+    JOB_CPU_SECONDS,
+    JOB_MEMORY_MB,
+    JOB_OPEN_FILES,
+    JOB_WALL_TIME_SECONDS,
+)
+
+MiB = 1024 * 1024
+# Seconds between SIGXCPU and SIGKILL once the CPU limit is reached
+CPU_GRACE_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class JobLimits:
+    """
+    Resource limits of a job, 0 meaning unlimited.
+
+    Projects set them in the `limits` section of config.yaml. The enclave
+    settings are both the defaults and the ceilings: a project can lower
+    a limit, but not raise it above the enclave's.
+    """
+    wall_time_seconds: int = JOB_WALL_TIME_SECONDS
+    cpu_seconds: int = JOB_CPU_SECONDS
+    # Resident memory, enforced through cgroup v2 when available
+    memory_mb: int = JOB_MEMORY_MB
+    address_space_mb: int = JOB_ADDRESS_SPACE_MB
+    open_files: int = JOB_OPEN_FILES
+
+    @classmethod
+    def from_spec(cls, spec) -> "JobLimits":
+        requested = spec.limits or {}
+        values = {}
+        for f in fields(cls):
+            default = getattr(cls, f.name)
+            value = requested.get(f.name)
+            if value is None:
+                values[f.name] = default
+            elif default:
+                values[f.name] = min(int(value), default)
+            else:
+                values[f.name] = int(value)
+        return cls(**values)
+
+
+def job_rlimits(limits: JobLimits, use_address_space_for_memory: bool = False) -> List[Tuple[int, int, int]]:
+    """
+    The (resource, soft, hard) CPU, address space and open file limits a
+    job is started with, capped by our own hard limits. Without a cgroup,
+    `memory_mb` is applied as an address space limit.
+    """
+    address_space_mb = limits.address_space_mb
+    if use_address_space_for_memory and limits.memory_mb:
+        address_space_mb = min(filter(None, [address_space_mb, limits.memory_mb]))
+    rlimits = []
+    for rlimit, soft, hard in [
+        (resource.RLIMIT_CPU, limits.cpu_seconds, limits.cpu_seconds + CPU_GRACE_SECONDS),
+        (resource.RLIMIT_AS, address_space_mb * MiB, address_space_mb * MiB),
+        (resource.RLIMIT_NOFILE, limits.open_files, limits.open_files),
+    ]:
+        if not soft:
+            continue
+        _, current_hard = resource.getrlimit(rlimit)
+        if current_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, current_hard), min(hard, current_hard)
+        rlimits.append((rlimit, soft, hard))
+    return rlimits
+
+
+class Cgroups:
+    """
+    Per-job cgroup v2 groups created under a cgroup delegated to the
+    enclave (ENCLAVE_CGROUP_ROOT), enforcing `memory_mb` as memory.max.
+    """
+
+    def __init__(self, root: str = CGROUP_ROOT):
+        self.root = Path(root) if root else None
+        if self.root is not None and not (self.root / "cgroup.procs").exists():
+            logger.warning(f"{self.root} is not a cgroup v2 directory, memory limits use rlimits")
+            self.root = None
+
+    @property
+    def available(self) -> bool:
+        return self.root is not None
+
+    def create(self, name: str, limits: JobLimits) -> Optional[Path]:
+        """
+        Creates the cgroup of a job about to start, which its process joins
+        before running any project code. Returns the cgroup path, or None
+        when it could not be created.
+        """
+        if self.root is None:
+            return None
+        path = self.root / f"job-{name}"
+        try:
+            path.mkdir(exist_ok=True)
+            if limits.memory_mb:
+                (path / "memory.max").write_text(str(limits.memory_mb * MiB))
+                try:
+                    (path / "memory.swap.max").write_text("0")
+                except OSError:
+                    pass
+        except OSError as e:
+            logger.warning(f"Could not create cgroup for {name}: {e}")
+            self.remove(path)
+            return None
+        return path
+
+    @staticmethod
+    def oom_killed(path: Optional[Path]) -> bool:
+        if path is None:
+            return False
+        try:
+            events = (path / "memory.events").read_text()
+        except OSError:
+            return False
+        counts = dict(line.split() for line in events.splitlines() if line.strip())
+        return int(counts.get("oom_kill", 0)) > 0
+
+    @staticmethod
+    def remove(path: Optional[Path]):
+        if path is None:
+            return
+        try:
+            path.rmdir()
+        except OSError:
+            pass
+
+
+def cpu_seconds_used(rusage: Optional[dict]) -> float:
+    if not rusage:
+        return 0.0
+    return rusage.get("user_cpu_seconds", 0.0) + rusage.get("system_cpu_seconds", 0.0)
+
+
+def signal_name(signum: int) -> str:
+    # Realtime signals (SIGRTMIN..SIGRTMAX) have no Signals member
+    try:
+        return signal.Signals(signum).name
+    except ValueError:
+        return f"signal {signum}"
+
+
+def failure_reason(
+    returncode: int, limits: JobLimits, context: dict, rusage: Optional[dict] = None
+) -> Optional[str]:
+    """
+    Why a job failed, or None if it succeeded. The CPU limit is only blamed
+    for a SIGKILL (sent past the soft limit's grace) if the job's `rusage`
+    shows it used that much CPU time.
+    """
+    if context.get("failure"):
+        return context["failure"]
+    if returncode == 0:
+        return None
+    if Cgroups.oom_killed(context.get("cgroup")):
+        return f"memory limit of {limits.memory_mb} MB exceeded"
+    if limits.cpu_seconds and (
+        returncode == -signal.SIGXCPU
+        or (returncode == -signal.SIGKILL and cpu_seconds_used(rusage) >= limits.cpu_seconds)
+    ):
+        return f"CPU time limit of {limits.cpu_seconds}s exceeded"
+    if returncode < 0:
+        return f"killed by {signal_name(-returncode)}"
+    return f"exited with code {returncode}"
@@ -1,23 +1,82 @@
+import copy
+import errno
 import os
 import shutil
+import signal
 import subprocess
-from time import sleep
+import threading
+import time
+from dataclasses import replace
+from typing import List, Optional, Tuple
 from syft_core import Client
 from pathlib import Path
 from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives import serialization
 from loguru import logger
 import yaml
 
-from utils import validate_config_file
-from utils import extract_zip
-from permissions import add_permission_rule
+from utils import directory_size, load_job_spec, write_yaml_atomic
+from encryption import enc_file_problem
+from keys import KeyManager
+from launch_index import LaunchIndex, PendingProject, stat_signature
+from scheduler import Job, JobScheduler
+from settings import (
+    INVALID_SPEC_GRACE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    REQUIRE_DATASET_MANIFEST,
+    STAGING_MEMORY_DIR,
+    STAGING_MODE,
+    WARM_POOL,
+    WATCH_MODE,
+)
+from watcher import create_watcher
+from decrypt_pool import DatasetDecryptError, DatasetTask, DecryptPool
+from dataset_cache import DatasetCache, dataset_key
+from plaintext import PlaintextStore
+from prefetch import Prefetcher
+from run_stats import update_run_stats
+from journal import DONE, FINISHING, LAUNCH, LAUNCHING, RUNNING, STARTED, JobJournal
+from layout import JobsLayout
+from archive import Archiver
+from results import ResultCache, job_fingerprint
+from policy import FairSharePolicy, QueueStatus, project_submitter
+from metrics import (
+    DATASETS_STAGED,
+    DECRYPT_SECONDS,
+    ENCRYPTED_BYTES,
+    ERRORS,
+    EXTRACT_SECONDS,
+    EXTRACTED_BYTES,
+    JOB_SLOTS,
+    JOB_STAGE_SECONDS,
+    JOBS,
+    JOBS_FINISHED,
+    JOBS_STARTED,
+    LAST_FINISHED,
+    LAUNCH_SCAN_SECONDS,
+    PERMISSION_FILES_WRITTEN,
+    PERMISSION_FLUSH_SECONDS,
+    PLAINTEXT_BYTES,
+    PREFETCHED,
+    PROJECTS_LAUNCHED,
+    RESULT_CACHE,
+    STAGING_SECONDS,
+    VERIFY_SECONDS,
+    MetricsExporter,
+)
+from forkserver import apply_limits
+from warm_pool import WarmPool
+from envs import EnvBuildError, EnvCache
+from limits import Cgroups, JobLimits, failure_reason, job_rlimits
+from permissions import add_permission_rule, permission_manager
 from models import DatasetStatus
+from spec import JobSpec, YamlLoader
 
 APP_NAME = "enclave"
 KEYS_DIR = "keys"
+ARCHIVE_DIR = "archive"
+# Decrypted data of each project, <name> under it
+PROJECTS_DIR = "projects"
 PUBLIC_KEY_FILE = "public_key.pem"
 PRIVATE_KEY_FILE = "private_key.pem"
 
@@ -136,17 +195,10 @@ def create_key_pair(client: Client):
         )
     logger.info(f"Public key saved to {public_key_path}")
 
-def get_dataset_path_from_config(client: Client,config_file_path: Path) -> list:
+def get_dataset_paths(client: Client, data_sources: list) -> list:
     """
-    Returns the sources from the config file.
+    Returns the encrypted dataset paths for the data sources of a config file.
     """
-    # Load the config file
-    with open(config_file_path, "r") as f:
-        config_file = yaml.safe_load(f)
-
-    # Get the data sources from the config file
-    data_sources = config_file.get("data", [])
-
     dataset_paths = []
     
     for source in data_sources:
@@ -157,217 +209,899 @@ def get_dataset_path_from_config(client: Client,config_file_path: Path) -> list:
         
         dataset_paths.append(dataset_path)
 
-    return dataset_paths, data_sources
+    return dataset_paths
 
-    
-    
+def get_dataset_path_from_config(client: Client,config_file_path: Path) -> list:
+    """
+    Returns the sources from the config file.
+    """
+    spec = load_job_spec(config_file_path)
+    return get_dataset_paths(client, spec.data), spec.data
+
+def load_launch_project(client: Client, config_file_path: Path) -> Tuple[JobSpec, list, list]:
+    """
+    Parses and validates a launch project's config.yaml once.
+    Returns the spec with its dataset paths and data sources.
+    """
+    spec = load_job_spec(config_file_path)
+    return spec, get_dataset_paths(client, spec.data), spec.data
+
+def project_output_owners(folder: Path) -> list:
+    """
+    Output owners of a project, from its config.yaml. For an invalid one,
+    the owners it names if it names any, so they can see why it failed.
+    """
+    config_file_path = folder / "config.yaml"
+    try:
+        return load_job_spec(config_file_path).output
+    except (OSError, ValueError):
+        pass
+    try:
+        config = yaml.load(config_file_path.read_text(), Loader=YamlLoader)
+    except (OSError, ValueError, yaml.YAMLError):
+        return []
+    owners = config.get("output") if isinstance(config, dict) else None
+    if not isinstance(owners, list):
+        return []
+    return [owner for owner in owners if isinstance(owner, str)]
+
+def quarantine_project(client: Client, folder: Path, journal: JobJournal, error: str):
+    """
+    Moves a project with an invalid config.yaml to done as failed, with
+    the problem in its execution.log, instead of trying it on every pass.
+    """
+    reason = f"invalid config.yaml: {error}"
+    logger.error(f"Enclave project {folder.name} has an {reason}")
+    ERRORS.inc(stage="spec")
+    (folder / "execution.log").write_text(f"Job not started. Invalid config.yaml: {error}\n")
+    observe_done(update_run_stats(folder, states={"done": time.time()}, failure=reason))
+    output_owners = project_output_owners(folder)
+    create_output_dir(client, folder.name, output_owners)
+    move_to_done(client, folder, output_owners, journal, failure=reason)
+
+def verify_data_sources(project: PendingProject) -> bool:
+    """
+    Verifies if all the required files are present in the data sources and
+    updates metrics.yaml when a dataset's status changed.
+    """
+    metrics_file_path = project.folder / "metrics.yaml"
+    found_ids = project.found_ids
+
+    if found_ids != project.reported:
+        updates = {}
+        for datasite, dataset_id in project.data_sources:
+            if str(dataset_id) in found_ids:
+                updates[str(dataset_id)] = {
+                    "datasite": datasite,
+                    "status": DatasetStatus.SUCCESS.value,
+                }
+        folder_signature = stat_signature(project.folder)
+        if update_dataset_metrics(metrics_file_path, updates) and project.signature[0] == folder_signature:
+            # The atomic rename touched the folder, that alone is no reason to re-parse
+            project.signature = (stat_signature(project.folder), project.signature[1])
+        project.reported = found_ids
+    project.metrics_signature = stat_signature(metrics_file_path)
+
+    for dataset_path, (datasite, _) in zip(project.dataset_paths, project.data_sources):
+        if dataset_path in project.incomplete:
+            logger.warning(
+                f"Encrypted Dataset File {dataset_path} of datasite {datasite} is not complete yet: "
+                f"{project.incomplete[dataset_path]}"
+            )
+        elif dataset_path not in project.found:
+            logger.warning(f"Encrypted Dataset File {dataset_path} not found for datasite {datasite}")
+
+    return not project.missing
+
+def launch_enclave_project(
+    client: Client,
+    launch_index: LaunchIndex,
+    env_cache: EnvCache,
+    journal: JobJournal,
+    changed: Optional[set] = None,
+):
+    """
+    Launches the enclave project with the given client.
+    Only projects whose config or data availability changed are evaluated,
+    `changed` narrows the check down to directories with file events.
+    Environments for projects shipping requirements are built while they wait.
+    """
+    running_dir = client.app_data(APP_NAME) / "jobs" / "running"
+    with LAUNCH_SCAN_SECONDS.time():
+        for project in launch_index.refresh(changed):
+            journal_launch_project(journal, project)
+            try:
+                env_cache.prepare(project.folder / "code")
+            except Exception as e:
+                logger.warning(f"Could not prepare the environment of {project.name}: {e}")
+            try:
+                # Datasets may have been replaced since they were found
+                launch_index.recheck(project)
+                launch_project_folder(project, running_dir, journal)
+            except Exception as e:
+                logger.warning(f"Skipping launch project {project.name}: {e}")
+                ERRORS.inc(stage="launch")
+                # Re-evaluate it from scratch on the next pass
+                project.signature = None
+            else:
+                if not project.folder.exists():
+                    launch_index.remove(project.name)
+        # Projects whose config.yaml stayed invalid leave the queue
+        for name, deadline in invalid_spec_deadlines(launch_index).items():
+            if deadline <= time.time():
+                project = launch_index.projects[name]
+                quarantine_project(client, project.folder, journal, project.error)
+                launch_index.remove(name)
+        journal.sync_launch(launch_index.projects)
+
+def invalid_spec_deadlines(launch_index: LaunchIndex) -> dict:
+    """
+    When each launch project with an invalid config.yaml is quarantined.
+    """
+    deadlines = {}
+    for name in launch_index.invalid:
+        try:
+            written_at = (launch_index.projects[name].folder / "config.yaml").stat().st_mtime
+        except OSError:
+            # Removed, the index notices on its next refresh
+            continue
+        deadlines[name] = written_at + INVALID_SPEC_GRACE_SECONDS
+    return deadlines
+
+def journal_launch_project(journal: JobJournal, project: PendingProject):
+    """
+    Records a project waiting in launch and the readiness of its datasets.
+    """
+    fields = {"submitter": project_submitter(project.spec), "priority": project.spec.priority}
+    row = journal.get(project.name)
+    if row is None or row["state"] != LAUNCH:
+        # A new project, or a new one reusing the name of a finished one
+        fields.update(
+            attempts=0, launched_at=None, started_at=None, finished_at=None, exit_code=None, failure=None,
+            fingerprint=None,
+        )
+    journal.transition(project.name, LAUNCH, **fields)
+    journal.set_datasets(project.name, [
+        (dataset_id, datasite, path, path in project.found)
+        for path, (datasite, dataset_id) in zip(project.dataset_paths, project.data_sources)
+    ])
 
-def verify_data_sources(client: Client, config_file_path: Path, launch_dir: Path) -> bool:
+def launch_project_folder(project: PendingProject, running_dir: Path, journal: JobJournal):
     """
-    Verifies if all the required files are present in the data sources and updates metrics.yaml accordingly.
+    Moves a single launch project to the running directory once its data is ready.
     """
-    dataset_paths, data_sources = get_dataset_path_from_config(client, config_file_path)
-    metrics_file_path = config_file_path.parent / "metrics.yaml"
+    folder = project.folder
 
-    # Load existing metrics
+    # Check if all the required files are sent by the datasites
+    with VERIFY_SECONDS.time():
+        verify_sources = verify_data_sources(project)
+
+    # force start check
+    # Checks if the force_start.ext file is present in the launch folder
+    # and if any dataset has succeeded
+    force_start_file = folder / "force_start.ext"
+    if not verify_sources and force_start_file.exists() and project.found:
+        logger.info(f"Force start file found in {folder}. Skipping data source verification.")        
+        verify_sources = True
+        
+    # if all the files are present, move the folder to the running directory
+    if verify_sources:
+        logger.info(f"Moving {folder} to running directory")
+        # The config is the last file written when a project is submitted
+        submitted_at = (folder / "config.yaml").stat().st_mtime
+        journal.transition(folder.name, LAUNCHING, submitted_at=submitted_at)
+        # Move the folder to the running directory
+        shutil.move(folder, running_dir / folder.name)
+        launched_at = time.time()
+        journal.transition(folder.name, RUNNING, launched_at=launched_at)
+        update_run_stats(running_dir / folder.name, states={"submitted": submitted_at, "launched": launched_at})
+        PROJECTS_LAUNCHED.inc()
+
+def get_watch_paths(client: Client, launch_index: LaunchIndex) -> list:
+    """
+    Returns the directories whose changes can make enclave work ready:
+    the launch and running queues, each launch project and the folders the
+    datasites upload encrypted data for this enclave into.
+    """
+    jobs_dir = client.app_data(APP_NAME) / "jobs"
+    paths = [jobs_dir / "launch", jobs_dir / "running", client.datasites]
+    paths.extend(project.folder for project in launch_index.projects.values())
+    for datasite in client.datasites.iterdir():
+        data_dir = client.app_data(APP_NAME, datasite=datasite.name) / "data" / client.email
+        # Watch the deepest existing ancestor, so each level that gets
+        # created wakes the enclave up and the next one is watched
+        while not data_dir.exists() and data_dir != datasite:
+            data_dir = data_dir.parent
+        paths.append(data_dir)
+    return paths
+
+def update_dataset_metrics(metrics_file_path: Path, updates: dict) -> bool:
+    """
+    Merges per-dataset fields into the project's metrics.yaml.
+    The file is only rewritten (atomically) if the merge changes it.
+    Returns whether it was written.
+    """
     if metrics_file_path.exists():
         with open(metrics_file_path, 'r') as f:
             metrics = yaml.safe_load(f) or {}
     else:
         metrics = {}
+    updated = copy.deepcopy(metrics)
+    for dataset_id, fields in updates.items():
+        updated.setdefault(str(dataset_id), {}).update(fields)
+    if updated == metrics and metrics_file_path.exists():
+        return False
+    write_yaml_atomic(metrics_file_path, updated)
+    return True
 
-    all_found = True
-    for dataset_path, data_source in zip(dataset_paths, data_sources):
-        datasite, dataset_id = data_source
-        dataset_id_str = str(dataset_id)
-        if dataset_path.exists():
-            metrics.setdefault(dataset_id_str, {})
-            metrics[dataset_id_str]["datasite"] = datasite
-            metrics[dataset_id_str]["status"] = DatasetStatus.SUCCESS.value
-        else:
-            logger.warning(f"Encrypted Dataset File {dataset_path} not found for datasite {datasite}")
-            all_found = False
+def get_jobs_layout(client: Client) -> JobsLayout:
+    """
+    Where done projects and outputs are written, see JOBS_LAYOUT.
+    """
+    return JobsLayout(client.app_data(APP_NAME) / "jobs")
 
-    # Write back updated metrics
-    with open(metrics_file_path, 'w') as f:
-        yaml.dump(metrics, f)
+def create_output_dir(client: Client, project_name: str, output_owners: list) -> Path:
+    """
+    Creates the project's output directory readable by the output owners.
+    """
+    proj_output_dir = get_jobs_layout(client).output_dir(project_name)
+    proj_output_dir.mkdir(parents=True, exist_ok=True)
+    # Add permission rules for the output directory
+    permission_manager.add_rule(
+        proj_output_dir,
+        '**',
+        read=output_owners,
+        write=[],
+    )
+    return proj_output_dir
 
-    return all_found
+def move_to_done(client: Client, folder: Path, output_owners: list, journal: JobJournal, **result):
+    """
+    Moves a finished project folder to the done directory. `result`
+    (exit_code, failure, finished_at) is recorded in the journal.
+    """
+    project_done_dir = get_jobs_layout(client).done_dir(folder.name)
+    project_done_dir.mkdir(parents=True, exist_ok=True)
+    # Add permission rules for the done directory
+    permission_manager.add_rule(
+        project_done_dir,
+        '**',
+        read=output_owners,
+        write=[],
+    )
+    # Written before the move, recovery doesn't queue the rules again
+    PERMISSION_FILES_WRITTEN.inc(permission_manager.flush())
+    # Move the folder to the done directory
+    logger.info(f"Moving {folder} to done directory")
+    journal.transition(folder.name, FINISHING, **result)
+    shutil.move(folder, project_done_dir)
+    journal.transition(folder.name, DONE)
+
+def decrypt_datasets(
+    tasks: list, decrypt_pool: DecryptPool, dataset_cache: Optional[DatasetCache], owner: str
+) -> dict:
+    """
+    Makes every task's dataset available in its target dir, copying it from
+    the dataset cache when possible and decrypting only the missing ones.
+    Returns per-dataset stats. Raises DatasetDecryptError.
+    """
+    if dataset_cache is None or not dataset_cache.enabled:
+        return decrypt_pool.run(tasks)
 
-def _any_success(metrics):
-    return any(info.get('status') == DatasetStatus.SUCCESS.value for info in metrics.values())
+    stats = {}
+    misses = {}
+    for task in tasks:
+        try:
+            key = dataset_key(task.enc_file_path)
+        except Exception as e:
+            raise DatasetDecryptError(task, e) from e
+        dataset_cache.acquire(owner, key)
+        if dataset_cache.lookup(key) is None:
+            misses.setdefault(key, []).append(task)
+            continue
+        dataset_cache.copy(key, task.target_dir)
+        stats[task.dataset_id] = {
+            "cache_hit": True,
+            "encrypted_bytes": task.enc_file_path.stat().st_size,
+            "extracted_bytes": directory_size(task.target_dir),
+        }
 
-def launch_enclave_project(client: Client):
+    # Each missing file is decrypted once into the cache, then copied
+    staged = {key: replace(group[0], target_dir=dataset_cache.staging_dir(key)) for key, group in misses.items()}
+    try:
+        decrypted = decrypt_pool.run(list(staged.values()))
+    except DatasetDecryptError:
+        for task in staged.values():
+            shutil.rmtree(task.target_dir, ignore_errors=True)
+        raise
+    for key, group in misses.items():
+        dataset_cache.commit(key, staged[key].target_dir)
+        for task in group:
+            dataset_cache.copy(key, task.target_dir)
+            stats[task.dataset_id] = {**decrypted[staged[key].dataset_id], "cache_hit": False}
+    return stats
+
+def admit_enclave_project(
+    client: Client, folder: Path, decrypt_pool: DecryptPool, plaintext: PlaintextStore, idle: bool
+) -> bool:
     """
-    Launches the enclave project with the given client.
+    Checks the plaintext quota before a running project is started.
+    The extracted sizes of its datasets are used as the estimate.
     """
-    launch_dir = client.app_data(APP_NAME) / "jobs" / "launch"
-    running_dir = client.app_data(APP_NAME) / "jobs" / "running"
-    # Iterates through each folder inside the launch folder and looks for 
-    # config.yaml file and code directory
-    for folder in launch_dir.iterdir():
-        if folder.is_dir():
-            config_file_path = folder / "config.yaml"
-            code_dir = folder / "code"
-            if not config_file_path.exists() and not code_dir.exists():
-                logger.warning(f"Config file or code directory not found in {folder}")
-                continue
-            # Check if the config file is valid
-            validate_config_file(config_file_path)
-
-            # Check if all the required files are sent by the datasites
-            verify_sources = verify_data_sources(client, config_file_path, launch_dir)
-
-            # force start check
-            # Checks if the force_start.ext file is present in the launch folder
-            force_start_file = folder / "force_start.ext"
-            if force_start_file.exists():
-                # Open the metrics file to check if any dataset has succeeded
-                metrics_file_path = folder / "metrics.yaml"
-                if metrics_file_path.exists():
-                    with open(metrics_file_path, 'r') as f:
-                        metrics = yaml.safe_load(f) or {}
-                    if _any_success(metrics):
-                        logger.info(f"Force start file found in {folder}. Skipping data source verification.")        
-                        verify_sources = True
-                
-            # if all the files are present, move the folder to the running directory
-            if verify_sources:
-                logger.info(f"Moving {folder} to running directory")
-                # Move the folder to the running directory
-                shutil.move(folder, running_dir / folder.name)
-
-def decrypt_data(client: Client, enc_file_path: Path):
-    """
-    Decrypts the data files in the given config file.
+    try:
+        dataset_paths, _ = get_dataset_path_from_config(client, folder / "config.yaml")
+    except Exception:
+        # Let start_enclave_project report the problem
+        return True
+    needed = sum(decrypt_pool.extracted_size(path) for path in dataset_paths if path.exists())
+    return plaintext.admit(folder.name, needed, idle)
+
+def get_project_sources(client: Client, folder: Path) -> List[tuple]:
     """
-    private_key_path = get_private_key_path(client)
-    # Step 1: Load the private key
-    with open(private_key_path, "rb") as f:
-        private_key = serialization.load_pem_private_key(
-            f.read(),
-            password=None,
-        )
+    Returns (dataset_id, datasite, path) of the project's complete datasets.
+    """
+    dataset_paths, data_sources = get_dataset_path_from_config(client, folder / "config.yaml")
 
-    # Step 2: Read the encrypted file
-    with open(enc_file_path, "rb") as f:
-        key_len = int.from_bytes(f.read(2), "big")
-        encrypted_key = f.read(key_len)
-        nonce = f.read(12)
-        ciphertext = f.read()
-    
-    # Step 3: Decrypt the AES key using private key
-    aes_key = private_key.decrypt(
-        encrypted_key,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None,
-        ),
+    sources = []
+    for dataset_path, (datasite, dataset_id) in zip(dataset_paths, data_sources):
+        problem = enc_file_problem(dataset_path, REQUIRE_DATASET_MANIFEST)
+        if problem is not None:
+            # Force started without it
+            logger.warning(f"Ignoring dataset path {dataset_path}: {problem}")
+            continue
+        sources.append((str(dataset_id), datasite, dataset_path))
+    return sources
+
+def stage_project_data(
+    client: Client,
+    folder: Path,
+    decrypt_pool: DecryptPool,
+    dataset_cache: DatasetCache,
+    plaintext: PlaintextStore,
+) -> Tuple[List[DatasetTask], dict]:
+    """
+    Decrypts all the datasets of a project concurrently into its plaintext
+    directory. Returns the tasks and per-dataset stats.
+    Projects staged in memory bypass the on-disk dataset cache, and are
+    staged again on disk if the tmpfs runs out of space.
+    Runs in the prefetch thread.
+    """
+    name = folder.name
+    sources = get_project_sources(client, folder)
+    # Uncompressed, a compressible zip can be many times its encrypted size
+    needed = sum(decrypt_pool.extracted_size(path) for _, _, path in sources)
+    memory = True
+    while True:
+        pvt_proj_dir = plaintext.stage(name, needed, memory=memory)
+        in_memory = name in plaintext.in_memory
+        tasks = [
+            DatasetTask(
+                dataset_id=dataset_id,
+                datasite=datasite,
+                enc_file_path=path,
+                target_dir=pvt_proj_dir / path.name,
+            )
+            for dataset_id, datasite, path in sources
+        ]
+        try:
+            stats = decrypt_datasets(tasks, decrypt_pool, None if in_memory else dataset_cache, name)
+            observe_staged_datasets(stats)
+            return tasks, stats
+        except DatasetDecryptError as e:
+            out_of_space = isinstance(e.cause, OSError) and e.cause.errno == errno.ENOSPC
+            if not (in_memory and out_of_space):
+                raise
+            logger.warning(f"Out of space staging {name} in memory, falling back to disk")
+            memory = False
+
+def observe_staged_datasets(stats: dict):
+    """
+    Adds the per-dataset stats of a staging to the enclave metrics.
+    """
+    for dataset in stats.values():
+        ENCRYPTED_BYTES.inc(dataset.get("encrypted_bytes", 0))
+        EXTRACTED_BYTES.inc(dataset.get("extracted_bytes", 0))
+        if dataset.get("cache_hit"):
+            DATASETS_STAGED.inc(cache="hit")
+            continue
+        DATASETS_STAGED.inc(cache="miss")
+        DECRYPT_SECONDS.observe(dataset["decrypt_seconds"])
+        EXTRACT_SECONDS.observe(dataset["extract_seconds"])
+
+def observe_done(stats: dict):
+    """
+    Adds a project moved to done, and the durations of its run, to the
+    enclave metrics.
+    """
+    JOBS_FINISHED.inc(status="failed" if stats.get("failure") else "success")
+    for name, seconds in stats["durations"].items():
+        JOB_STAGE_SECONDS.observe(seconds, stage=name.removesuffix("_seconds"))
+    LAST_FINISHED.set(time.time())
+
+def start_enclave_project(
+    client: Client,
+    folder: Path,
+    prefetcher: Prefetcher,
+    dataset_cache: DatasetCache,
+    plaintext: PlaintextStore,
+    env_cache: EnvCache,
+    cgroups: Cgroups,
+    journal: JobJournal,
+    warm_pool: Optional[WarmPool] = None,
+) -> Optional[Job]:
+    """
+    Starts the project's entrypoint without waiting for it, once its
+    datasets are staged and its environment is built. Returns None if the
+    project could not be started or is not ready yet.
+    The entrypoint is forked from the warm pool when one is available and
+    the project has no requirements of its own. The project's resource
+    limits are applied to the process right after it starts.
+    """
+    metrics_file_path = folder / "metrics.yaml"
+    code_dir = folder / "code"
+
+    try:
+        spec = load_job_spec(folder / "config.yaml")
+    except ValueError as e:
+        prefetcher.discard(folder.name)
+        quarantine_project(client, folder, journal, str(e))
+        return None
+    except OSError as e:
+        logger.warning(f"Could not read the config of enclave project {folder.name}: {e}")
+        return None
+    entrypoint = spec.code.entrypoint
+    output_owners = spec.output
+    limits = JobLimits.from_spec(spec)
+
+    try:
+        python = env_cache.python(folder.name, code_dir)
+    except EnvBuildError as e:
+        logger.error(f"Failed to build the environment of enclave project {folder.name}: {e}")
+        (folder / "execution.log").write_text(f"Job not started. Could not build the environment: {e}\n")
+        ERRORS.inc(stage="environment")
+        observe_done(update_run_stats(
+            folder, states={"done": time.time()}, failure=f"could not build the environment: {e}"
+        ))
+        # Data may have been staged while the environment was building
+        prefetcher.discard(folder.name)
+        dataset_cache.release(folder.name)
+        plaintext.remove(folder.name)
+        create_output_dir(client, folder.name, output_owners)
+        move_to_done(client, folder, output_owners, journal, failure=f"could not build the environment: {e}")
+        return None
+    if python is None:
+        # Environment still building, started on a later pass
+        return None
+
+    staged = prefetcher.fetch(folder)
+    if staged is None:
+        # Still staging in the background, started on a later pass
+        return None
+    timings = staged.timings()
+    try:
+        tasks, dataset_stats = staged.result()
+    except DatasetDecryptError as e:
+        dataset_cache.release(folder.name)
+        env_cache.release(folder.name)
+        logger.error(f"Failed to prepare data for enclave project {folder.name}: {e}")
+        update_dataset_metrics(metrics_file_path, {
+            e.task.dataset_id: {
+                "status": DatasetStatus.ERROR.value,
+                "error": f"{type(e.cause).__name__}: {e.cause}",
+            }
+        })
+        (folder / "execution.log").write_text(f"Job not started. {e}\n")
+        ERRORS.inc(stage="decrypt")
+        observe_done(update_run_stats(folder, states={"done": time.time()}, failure=str(e)))
+        plaintext.remove(folder.name)
+        create_output_dir(client, folder.name, output_owners)
+        move_to_done(client, folder, output_owners, journal, failure=str(e))
+        return None
+    # dataset_stats only go to the enclave metrics: output owners can read
+    # metrics.yaml and run_stats.json, and whether a dataset came from the
+    # cache tells them another project used it recently
+    plaintext.record(folder.name)
+    STAGING_SECONDS.observe(timings["staging_seconds"])
+    for stage in ("queue_wait", "slot_wait"):
+        JOB_STAGE_SECONDS.observe(timings[f"{stage}_seconds"], stage=stage)
+    logger.info(
+        f"Data of {folder.name} staged in {timings['staging_seconds']}s "
+        f"after {timings['queue_wait_seconds']}s in the prefetch queue, "
+        f"waited {timings['slot_wait_seconds']}s for a slot"
     )
+    dec_dataset_paths = [task.target_dir for task in tasks] # Decrypted dataset paths
+
+    proj_output_dir = create_output_dir(client, folder.name, output_owners)
+    job_env = {"DATA_DIR" : ",".join([str(path) for path in dec_dataset_paths]),
+               "OUTPUT_DIR" : str(proj_output_dir),
+    }
     
-    # Step 4: Decrypt the ZIP file
-    aesgcm = AESGCM(aes_key)
-    zip_bytes = aesgcm.decrypt(nonce, ciphertext, associated_data=None)
+    cmd = [python, str(code_dir / entrypoint)]
 
-    return zip_bytes
+    # Set up environment variables for direct Python execution
+    env = os.environ.copy()
+    env.update(job_env)
 
-def extract_enc_data(client: Client, enc_file_path: Path, target_dir: Path):
-    zip_bytes = decrypt_data(client, enc_file_path)
+    logger.info(f"Running enclave project {folder.name} with command: {cmd}")
+    # Stream logs to execution.log in the project folder, the scheduler
+    # closes it once the process exits
+    log_file_path = folder / "execution.log"
+    log_file = open(log_file_path, "w")
+    # Entered by the job's process before the entrypoint runs, so neither
+    # the project code nor its children ever run unconstrained
+    cgroup = cgroups.create(folder.name, limits)
+    rlimits = job_rlimits(limits, use_address_space_for_memory=cgroup is None)
+    cgroup_path = str(cgroup) if cgroup is not None else None
+    try:
+        process = None
+        if warm_pool is not None and python == env_cache.base_python:
+            process = warm_pool.spawn(cmd, env, log_file, rlimits=rlimits, cgroup=cgroup_path)
+        JOBS_STARTED.inc(runner="process" if process is None else "warm_pool")
+        if process is None:
+            process = subprocess.Popen(
+                cmd,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=env,
+                # Own process group, so the whole job can be killed on shutdown
+                start_new_session=True,
+                preexec_fn=lambda: apply_limits(rlimits, cgroup_path),
+            )
+    except subprocess.SubprocessError as e:
+        # Raised when apply_limits failed in the child, nothing ran
+        log_file.close()
+        Cgroups.remove(cgroup)
+        reason = f"could not apply resource limits: {e}"
+        logger.error(f"Enclave project {folder.name} {reason}")
+        ERRORS.inc(stage="limits")
+        log_file_path.write_text(f"Job not started. Could not apply resource limits: {e}\n")
+        observe_done(update_run_stats(folder, states={"done": time.time()}, failure=reason))
+        dataset_cache.release(folder.name)
+        env_cache.release(folder.name)
+        plaintext.remove(folder.name)
+        move_to_done(client, folder, output_owners, journal, failure=reason)
+        return None
+    except Exception:
+        log_file.close()
+        Cgroups.remove(cgroup)
+        raise
+    started_at = time.time()
+    attempt = journal.increment_attempts(folder.name)
+    journal.transition(folder.name, STARTED, started_at=started_at)
+    update_run_stats(
+        folder,
+        states={"started": started_at},
+        attempt=attempt,
+        dataset_bytes={
+            "encrypted": sum(stats.get("encrypted_bytes", 0) for stats in dataset_stats.values()),
+        },
+    )
+    context = {
+        "output_owners": output_owners,
+        "output_dir": proj_output_dir,
+        "timings": timings,
+        "limits": limits,
+        "reuse_results": spec.reuse_results,
+        "cgroup": cgroup,
+    }
+    return Job(
+        name=folder.name,
+        folder=folder,
+        process=process,
+        log_file=log_file,
+        started_at=started_at,
+        deadline=started_at + limits.wall_time_seconds if limits.wall_time_seconds else None,
+        context=context,
+    )
 
-    # Extract the zip file to the target directory
-    extract_zip(zip_bytes, target_dir)
-    logger.info(f"Extracted {enc_file_path} to {target_dir}")
-    
+def finish_enclave_project(
+    client: Client,
+    job: Job,
+    returncode: int,
+    dataset_cache: DatasetCache,
+    plaintext: PlaintextStore,
+    env_cache: EnvCache,
+    journal: JobJournal,
+    result_cache: ResultCache,
+):
+    """
+    Moves a project whose entrypoint has exited to the done directory
+    and deletes its decrypted data. Why a failed job failed, e.g. the limit
+    it exceeded, is appended to its execution.log. Its resource usage and
+    output size are added to run_stats.json. The outputs of a successful
+    job are kept in the result cache, unless it opted out.
+    """
+    Cgroups.remove(job.context.get("cgroup"))
+    reason = failure_reason(returncode, job.context["limits"], job.context, job.rusage)
+    if reason is not None:
+        logger.warning(f"Enclave project {job.name} failed: {reason}")
+        with open(job.folder / "execution.log", "a") as log_file:
+            log_file.write(f"\nJob failed: {reason}\n")
+    observe_done(update_run_stats(
+        job.folder,
+        states={"finished": job.finished_at, "done": time.time()},
+        exit_code=returncode,
+        failure=reason,
+        resources=job.rusage,
+        output_bytes=directory_size(job.context["output_dir"]),
+    ))
+    fingerprint = journal.get(job.name)["fingerprint"]
+    if reason is None and fingerprint and job.context["reuse_results"] and result_cache.enabled:
+        try:
+            result_cache.store(fingerprint, job.name, job.context["output_dir"], job.folder / "execution.log")
+            RESULT_CACHE.inc(event="stored")
+        except OSError as e:
+            logger.warning(f"Could not keep the result of {job.name}: {e}")
+            ERRORS.inc(stage="result_cache")
+    dataset_cache.release(job.name)
+    env_cache.release(job.name)
+    plaintext.remove(job.name)
+    move_to_done(
+        client, job.folder, job.context["output_owners"], journal,
+        exit_code=returncode, failure=reason, finished_at=job.finished_at,
+    )
 
-def run_enclave_project(client: Client):
+def fail_enclave_project(
+    client: Client,
+    job: Job,
+    returncode: int,
+    error: str,
+    dataset_cache: DatasetCache,
+    plaintext: PlaintextStore,
+    env_cache: EnvCache,
+    journal: JobJournal,
+):
     """
-    Runs the enclave project with the given client.
+    Moves a project that finish_enclave_project failed on to done as
+    failed, with the error in its execution.log. Each step is best effort,
+    any of them may be what failed before.
     """
-    running_dir = client.app_data(APP_NAME) / "jobs" / "running"
-    done_dir = client.app_data(APP_NAME) / "jobs" / "done"
-    output_dir = client.app_data(APP_NAME) / "jobs" / "outputs"
-    # Iterates through each folder inside the running folder and looks for 
-    # config.yaml file and code directory
-    for folder in running_dir.iterdir():
-        if folder.is_dir():
-            config_file_path = folder / "config.yaml"
-            code_dir = folder / "code"
-            
-            with open(config_file_path, "r") as f:
-                config_file = yaml.safe_load(f)
+    logger.error(f"Enclave project {job.name} {error}")
+    for release in (dataset_cache.release, env_cache.release, plaintext.remove):
+        try:
+            release(job.name)
+        except Exception as e:
+            logger.warning(f"Could not clean up after {job.name}: {e}")
+    if not job.folder.exists():
+        # Moved before the failure, only the journal is behind
+        journal.transition(job.name, DONE, exit_code=returncode, failure=error)
+        return
+    with open(job.folder / "execution.log", "a") as log_file:
+        log_file.write(f"\nJob failed: {error}\n")
+    try:
+        observe_done(update_run_stats(job.folder, states={"done": time.time()}, exit_code=returncode, failure=error))
+    except Exception as e:
+        logger.warning(f"Could not update the run stats of {job.name}: {e}")
+    output_owners = job.context.get("output_owners") or project_output_owners(job.folder)
+    move_to_done(
+        client, job.folder, output_owners, journal,
+        exit_code=returncode, failure=error, finished_at=job.finished_at,
+    )
 
-            entrypoint = config_file.get("code",{}).get("entrypoint")
-            if not entrypoint:
-                logger.warning(f"Entrypoint not found in {config_file_path}")
-                continue
+def reuse_result(
+    client: Client,
+    folder: Path,
+    journal: JobJournal,
+    result_cache: ResultCache,
+    env_cache: EnvCache,
+) -> bool:
+    """
+    Fingerprints a project waiting for a slot. If an identical project
+    succeeded before and the project doesn't opt out with
+    `reuse_results: false`, the cached outputs and execution log are
+    published and the project is moved to done without running. A project
+    with an invalid config.yaml is moved to done as failed.
+    Returns whether it was moved.
+    """
+    try:
+        spec = load_job_spec(folder / "config.yaml")
+    except ValueError as e:
+        quarantine_project(client, folder, journal, str(e))
+        return True
+    except OSError as e:
+        # e.g. removed meanwhile, tried again on the next pass
+        logger.warning(f"Could not read the config of enclave project {folder.name}: {e}")
+        return False
+    output_owners = spec.output
+    try:
+        fingerprint = job_fingerprint(
+            folder / "code",
+            spec.code.entrypoint,
+            [(dataset_id, dataset_key(path)) for dataset_id, _, path in get_project_sources(client, folder)],
+            output_owners,
+            env_cache.runtime_version,
+        )
+    except (OSError, ValueError) as e:
+        # Not reused, the project runs and reports the problem
+        logger.warning(f"Could not fingerprint enclave project {folder.name}: {e}")
+        journal.transition(folder.name, RUNNING, fingerprint="")
+        return False
+    journal.transition(folder.name, RUNNING, fingerprint=fingerprint)
+    update_run_stats(folder, fingerprint=fingerprint)
+    if not result_cache.enabled or not spec.reuse_results:
+        return False
 
-            app_pvt_dir = get_app_private_data(client, APP_NAME)
-            pvt_proj_dir = app_pvt_dir / folder.name
-            pvt_proj_dir.mkdir(parents=True, exist_ok=True)
-            
+    cached = result_cache.lookup(fingerprint)
+    RESULT_CACHE.inc(event="miss" if cached is None else "hit")
+    if cached is None:
+        return False
+    logger.info(f"Reusing the result of {cached['project']} for identical enclave project {folder.name}")
+    proj_output_dir = create_output_dir(client, folder.name, output_owners)
+    try:
+        result_cache.publish(fingerprint, proj_output_dir, folder / "execution.log")
+    except OSError as e:
+        logger.error(f"Could not reuse the result of {cached['project']} for {folder.name}, running it: {e}")
+        ERRORS.inc(stage="result_cache")
+        return False
+    with open(folder / "execution.log", "a") as log_file:
+        log_file.write(f"\nJob not run, the result of identical project {cached['project']} was reused.\n")
+    done_at = time.time()
+    observe_done(update_run_stats(
+        folder,
+        states={"done": done_at},
+        exit_code=0,
+        reused_result=cached["project"],
+        output_bytes=directory_size(proj_output_dir),
+    ))
+    move_to_done(client, folder, output_owners, journal, exit_code=0, finished_at=done_at)
+    return True
 
-            dataset_paths, _ = get_dataset_path_from_config(client,config_file_path)
+def run_enclave_project(
+    client: Client,
+    scheduler: JobScheduler,
+    journal: JobJournal,
+    policy: FairSharePolicy,
+    queue_status: QueueStatus,
+    result_cache: ResultCache,
+    env_cache: EnvCache,
+):
+    """
+    Runs the enclave projects with the given client.
+    Finished projects are completed and waiting ones started in free slots,
+    without blocking on any running project. Waiting projects are offered
+    in the order of the scheduling policy, which is written to the queue
+    status file and, for started projects, to their run_stats.json.
+    Projects identical to one that succeeded before are completed with its
+    result instead of waiting.
+    """
+    running_dir = client.app_data(APP_NAME) / "jobs" / "running"
+    # Completions first, so their slots and shares count for the order
+    scheduler.reap()
+    for row in journal.jobs(RUNNING):
+        if row["fingerprint"] is None:
+            reuse_result(client, running_dir / row["name"], journal, result_cache, env_cache)
+    now = time.time()
+    usage = policy.usage(journal.usage_rows(now - policy.usage_window), now)
+    decisions = policy.order(journal.jobs(RUNNING), usage, now)
+    queue_status.update(decisions, usage)
 
-            
-            dec_dataset_paths = [] # Decrypted dataset paths
-            for dataset_path in dataset_paths:
-                if not dataset_path.exists():
-                    logger.warning(f"Ignoring missing dataset path: {dataset_path}")
-                    continue
-                # Extract the encrypted data to the private project directory
-                dec_dataset_path = pvt_proj_dir / dataset_path.name
-                extract_enc_data(client, dataset_path, dec_dataset_path)
-                dec_dataset_paths.append(dec_dataset_path)
-
-            proj_output_dir = output_dir / folder.name
-            proj_output_dir.mkdir(parents=True, exist_ok=True)
-            output_owners = config_file.get("output",[])
-            # Add permission rules for the output directory
-            add_permission_rule(
-                proj_output_dir,
-                '**',
-                read=output_owners,
-                write=[],
-            )
-            job_env = {"DATA_DIR" : ",".join([str(path) for path in dec_dataset_paths]),
-                       "OUTPUT_DIR" : proj_output_dir,
-            }
-            
-            cmd = ["python3", str(code_dir / entrypoint)]
-
-            # Set up environment variables for direct Python execution
-            env = os.environ.copy()
-            env.update(job_env)
-
-            logger.info(f"Running enclave project {folder.name} with command: {cmd}")
-            # Stream logs to execution.log in the project output directory and wait for process to finish
-            log_file_path = folder / "execution.log"
-            with open(log_file_path, "w") as log_file:
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=log_file,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    env=env,
+    started = set(scheduler.active)
+    scheduler.poll(running_dir / decision.name for decision in decisions)
+    by_name = {decision.name: decision for decision in decisions}
+    for name in scheduler.active.keys() - started:
+        decision = by_name[name]
+        logger.info(
+            f"Started {name} at queue position {decision.position}: priority {decision.priority}, "
+            f"waited {decision.waited_seconds:.0f}s, {decision.submitter} using a share of {decision.usage:.2f}"
+        )
+        update_run_stats(scheduler.active[name].folder, scheduling=decision.as_dict())
+
+def recover_jobs(client: Client, journal: JobJournal):
+    """
+    Reconciles the journal with the job folders when the enclave starts:
+    interrupted moves are rolled back or completed, projects that were
+    running are queued again, or moved to done once they were interrupted
+    JOB_MAX_ATTEMPTS times, and folders the journal doesn't know about are
+    added. Running it twice changes nothing.
+    """
+    jobs_dir = client.app_data(APP_NAME) / "jobs"
+    layout = get_jobs_layout(client)
+    for row in journal.jobs(LAUNCH, LAUNCHING, RUNNING, STARTED, FINISHING):
+        name, state = row["name"], row["state"]
+        launch_folder = jobs_dir / "launch" / name
+        running_folder = jobs_dir / "running" / name
+        if state == LAUNCHING and launch_folder.exists() and running_folder.exists():
+            # Interrupted copy across filesystems, the launch folder is intact
+            logger.warning(f"Rolling back the interrupted launch of {name}")
+            shutil.rmtree(running_folder)
+        if state == FINISHING:
+            if running_folder.exists():
+                logger.warning(f"Completing the interrupted move of {name} to done")
+                shutil.rmtree(layout.done_dir(name) / name, ignore_errors=True)
+                move_to_done(client, running_folder, project_output_owners(running_folder), journal)
+            else:
+                journal.transition(name, DONE)
+        elif running_folder.exists():
+            if state == STARTED and row["attempts"] >= JOB_MAX_ATTEMPTS:
+                fail_interrupted_project(client, running_folder, journal, row["attempts"])
+            else:
+                if state == STARTED:
+                    logger.warning(f"Enclave project {name} was interrupted, running it again")
+                journal.transition(name, RUNNING)
+        elif launch_folder.exists():
+            journal.transition(name, LAUNCH)
+        else:
+            # Removed while the enclave was down
+            journal.remove(name)
+
+    # Folders of older enclave versions, or of a lost journal
+    for state, folder_name in [(LAUNCH, "launch"), (RUNNING, "running")]:
+        for folder in (jobs_dir / folder_name).iterdir():
+            if folder.is_dir() and journal.get(folder.name) is None:
+                try:
+                    spec = load_job_spec(folder / "config.yaml")
+                except (OSError, ValueError):
+                    # Quarantined once it is looked at
+                    spec = None
+                journal.transition(
+                    folder.name, state,
+                    launched_at=time.time() if state == RUNNING else None,
+                    submitter=project_submitter(spec),
+                    priority=spec.priority if spec is not None else 0,
                 )
-                process.wait()
-            
-            # Move the folder to the done directory
-            project_done_dir = done_dir / folder.name
-            project_done_dir.mkdir(parents=True, exist_ok=True)
-            # Add permission rules for the done directory
-            add_permission_rule(
-                project_done_dir,
-                '**',
-                read=output_owners,
-                write=[],
-            )
-            # Move the folder to the done directory
-            logger.info(f"Moving {folder} to done directory")
-            shutil.move(folder, project_done_dir)
+
+def fail_interrupted_project(client: Client, folder: Path, journal: JobJournal, attempts: int):
+    """
+    Moves a project whose runs keep getting interrupted, e.g. because it
+    crashes the host, to done instead of starting it again.
+    """
+    reason = f"interrupted {attempts} times, not started again"
+    logger.error(f"Enclave project {folder.name} was {reason}")
+    with open(folder / "execution.log", "a") as log_file:
+        log_file.write(f"\nJob failed: {reason}\n")
+    observe_done(update_run_stats(folder, states={"done": time.time()}, failure=reason))
+    output_owners = project_output_owners(folder)
+    create_output_dir(client, folder.name, output_owners)
+    move_to_done(client, folder, output_owners, journal, failure=reason)
+
+def observe_queues(
+    journal: JobJournal,
+    scheduler: JobScheduler,
+    prefetcher: Prefetcher,
+    plaintext: PlaintextStore,
+):
+    """
+    Updates the gauges of the enclave metrics, once per main loop pass.
+    """
+    counts = journal.counts()
+    JOBS.set(counts.get(LAUNCH, 0), state="launch")
+    JOBS.set(counts.get(RUNNING, 0), state="waiting")
+    JOBS.set(counts.get(STARTED, 0), state="running")
+    JOB_SLOTS.set(scheduler.slots)
+    PREFETCHED.set(len(prefetcher.staged))
+    usage = plaintext.metrics()
+    for kind in ("project", "memory", "shared"):
+        PLAINTEXT_BYTES.set(usage[f"{kind}_bytes"], kind=kind)
+
+def collect_plaintext(plaintext: PlaintextStore, journal: JobJournal):
+    """
+    Periodically removes decrypted data of projects that are no longer running.
+    """
+    plaintext.sweep(set(journal.names(RUNNING, STARTED, FINISHING)))
 
 
+def get_memory_staging_dir(client: Client) -> Optional[Path]:
+    """
+    Returns the tmpfs directory for the "memory" staging mode, or None when
+    datasets are staged on disk.
+    """
+    if STAGING_MODE == "disk":
+        return None
+    if STAGING_MODE != "memory":
+        raise ValueError(f"Unknown staging mode {STAGING_MODE!r}")
+    memory_dir = Path(STAGING_MEMORY_DIR)
+    if not memory_dir.is_dir():
+        logger.warning(f"{memory_dir} does not exist, staging datasets on disk")
+        return None
+    logger.info(f"Staging datasets in memory under {memory_dir}")
+    # Private to this enclave, several can share a host
+    return memory_dir / f"syftbox-enclave-{client.email}"
+
+def _request_stop(signum, frame):
+    logger.info(f"Received signal {signum}, shutting down the enclave")
+    stop_event.set()
+
 
 if __name__ == "__main__":
 
@@ -377,14 +1111,122 @@ if __name__ == "__main__":
     
     create_key_pair(client)
 
-    while True:
-        
-        # Check if the enclave is ready to launch
-        launch_enclave_project(client)
+    # The private key is parsed once here and only reloaded if it changes
+    key_manager = KeyManager(get_private_key_path(client))
+    key_manager.private_key()
+    decrypt_pool = DecryptPool(key_manager)
+    # Decrypted datasets shared by projects using the same .enc files
+    app_pvt_dir = get_app_private_data(client, APP_NAME)
+    dataset_cache = DatasetCache(app_pvt_dir / ".dataset_cache")
+    # Per-project decrypted data, removed when projects are done
+    plaintext = PlaintextStore(
+        app_pvt_dir / PROJECTS_DIR,
+        shared_usage=lambda: dataset_cache.size,
+        metrics_file=app_pvt_dir / "enclave_metrics.yaml",
+        memory_root=get_memory_staging_dir(client),
+    )
+
+    # Job states, recovered from an interrupted previous run
+    journal = JobJournal(app_pvt_dir / "jobs.db")
+    recover_jobs(client, journal)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    # Wakes up on file events (or polls), on job exits, on stop signals
+    # and when prefetched data is ready
+    watcher = create_watcher(WATCH_MODE)
+
+    # Data of waiting projects is staged in the background while others run
+    prefetcher = Prefetcher(
+        stage=lambda folder: stage_project_data(client, folder, decrypt_pool, dataset_cache, plaintext),
+        on_ready=watcher.wake,
+    )
+    # Environments of projects shipping requirements, built once per hash
+    env_cache = EnvCache(app_pvt_dir / ".envs", on_ready=watcher.wake)
+    # Outputs of successful jobs, reused by identical projects
+    result_cache = ResultCache(app_pvt_dir / ".result_cache")
+    # Per-job memory limits, when a cgroup v2 subtree is delegated to the enclave
+    cgroups = Cgroups()
+    # Entrypoints forked from a warm interpreter with common imports done
+    warm_pool = None
+    if WARM_POOL:
+        warm_pool = WarmPool(on_exit=watcher.wake)
+        warm_pool.start()
+    scheduler = JobScheduler(
+        start_job=lambda folder: start_enclave_project(
+            client, folder, prefetcher, dataset_cache, plaintext, env_cache, cgroups, journal, warm_pool
+        ),
+        finish_job=lambda job, returncode: finish_enclave_project(
+            client, job, returncode, dataset_cache, plaintext, env_cache, journal, result_cache
+        ),
+        can_start=lambda folder, idle: admit_enclave_project(client, folder, decrypt_pool, plaintext, idle),
+        prefetch=prefetcher.submit,
+        fail_job=lambda job, returncode, error: fail_enclave_project(
+            client, job, returncode, error, dataset_cache, plaintext, env_cache, journal
+        ),
+    )
+    # Order of the projects waiting for a slot, and why
+    policy = FairSharePolicy()
+    queue_status = QueueStatus(app_pvt_dir / "queue.yaml")
+    launch_index = LaunchIndex(
+        client.app_data(APP_NAME) / "jobs" / "launch",
+        load_project=lambda config_file_path: load_launch_project(client, config_file_path),
+    )
+    # Old done folders, archived in the private directory
+    archiver = Archiver(app_pvt_dir / ARCHIVE_DIR, journal, get_jobs_layout(client))
+    # Prometheus text format metrics, over HTTP and/or in a textfile
+    metrics_exporter = MetricsExporter()
+    metrics_exporter.start()
+
+    try:
+        # Everything is checked on the first pass
+        changed = None
+        while not stop_event.is_set():
+            
+            # Check if the enclave is ready to launch
+            launch_enclave_project(client, launch_index, env_cache, journal, changed)
+
+            # Run the Enclave Project
+            run_enclave_project(client, scheduler, journal, policy, queue_status, result_cache, env_cache)
+
+            # One syft.pub.yaml write per directory for this pass
+            with PERMISSION_FLUSH_SECONDS.time():
+                PERMISSION_FILES_WRITTEN.inc(permission_manager.flush())
 
-        # Run the Enclave Project
-        run_enclave_project(client)
+            # Remove plaintext left behind by crashed projects
+            collect_plaintext(plaintext, journal)
 
-        sleep(3)
+            # Compact old done folders into monthly tarballs
+            archiver.run()
 
+            observe_queues(journal, scheduler, prefetcher, plaintext)
+            metrics_exporter.tick()
 
+            # Directories watched for the first time may have changed before
+            # the watch existed, they are checked on the next pass
+            new_watches = watcher.refresh(get_watch_paths(client, launch_index))
+            # Woken up in time to kill jobs running past their wall time
+            # limit, and to quarantine invalid projects
+            timeout = None
+            deadlines = [scheduler.next_deadline(), *invalid_spec_deadlines(launch_index).values()]
+            deadline = min(filter(None, deadlines), default=None)
+            if deadline is not None:
+                timeout = min(watcher.interval, max(0.0, deadline - time.time()) + 0.1)
+            changed = watcher.wait(timeout)
+            if changed is not None:
+                changed.update(new_watches)
+    finally:
+        scheduler.shutdown()
+        for row in journal.jobs(STARTED):
+            # Stopped by the shutdown, which doesn't count as an attempt
+            journal.transition(row["name"], RUNNING, attempts=row["attempts"] - 1)
+        if warm_pool is not None:
+            warm_pool.shutdown()
+        prefetcher.shutdown()
+        env_cache.shutdown()
+        permission_manager.flush()
+        decrypt_pool.shutdown()
+        metrics_exporter.shutdown()
+        journal.close()
+        watcher.close()
@@ -0,0 +1,288 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from settings import METRICS_HOST, METRICS_INTERVAL, METRICS_PORT, METRICS_TEXTFILE
+from utils import write_text_atomic
+
+# Seconds, from a quick file operation up to a long job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600, 14400)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        with self._lock:
+            samples = self._samples()
+        header = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return "\n".join(header + samples)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, e.g. a number of jobs or bytes.
+    """
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+        if not self.label_names:
+            # Exported from the start, so rates and absence alerts work
+            self._values[()] = 0
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, e.g. a queue depth.
+    """
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, e.g. durations, in cumulative buckets.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (per-bucket counts, sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """
+        Observes how long the block took, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(round(total, 6))}")
+            samples.append(f"{self.name}_count{labels} {cumulative}")
+        return samples
+
+
+class Registry:
+    """
+    The metrics of the enclave, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+LAUNCH_SCAN_SECONDS = registry.histogram(
+    "enclave_launch_scan_seconds", "Time spent checking jobs/launch for projects to launch"
+)
+VERIFY_SECONDS = registry.histogram(
+    "enclave_dataset_verification_seconds", "Time spent verifying the datasets of a launch project"
+)
+PROJECTS_LAUNCHED = registry.counter(
+    "enclave_projects_launched_total", "Projects moved from jobs/launch to jobs/running"
+)
+JOBS = registry.gauge(
+    "enclave_jobs", "Projects by state: waiting in launch, waiting for a slot, running", ["state"]
+)
+JOB_SLOTS = registry.gauge("enclave_job_slots", "Number of jobs that may run at the same time")
+PREFETCHED = registry.gauge("enclave_prefetch_staged", "Projects queued or staged ahead of a free slot")
+STAGING_SECONDS = registry.histogram(
+    "enclave_staging_seconds", "Time spent staging all the datasets of a project"
+)
+DECRYPT_SECONDS = registry.histogram("enclave_dataset_decrypt_seconds", "Time spent decrypting a dataset")
+EXTRACT_SECONDS = registry.histogram("enclave_dataset_extract_seconds", "Time spent extracting a dataset")
+DATASETS_STAGED = registry.counter(
+    "enclave_datasets_staged_total", "Datasets staged, from the dataset cache or decrypted", ["cache"]
+)
+ENCRYPTED_BYTES = registry.counter("enclave_dataset_encrypted_bytes_total", "Bytes of .enc datasets staged")
+EXTRACTED_BYTES = registry.counter("enclave_dataset_extracted_bytes_total", "Bytes of plaintext datasets staged")
+JOBS_STARTED = registry.counter("enclave_jobs_started_total", "Entrypoints started", ["runner"])
+JOBS_FINISHED = registry.counter("enclave_jobs_finished_total", "Projects moved to done", ["status"])
+JOB_STAGE_SECONDS = registry.histogram(
+    "enclave_job_stage_seconds", "Time finished projects spent in each stage of their run", ["stage"]
+)
+LAST_FINISHED = registry.gauge(
+    "enclave_last_job_finished_timestamp_seconds", "Unix time the last project was moved to done"
+)
+ERRORS = registry.counter("enclave_errors_total", "Errors by the stage they happened in", ["stage"])
+PERMISSION_FLUSH_SECONDS = registry.histogram(
+    "enclave_permission_flush_seconds", "Time spent writing queued syft.pub.yaml rules"
+)
+PERMISSION_FILES_WRITTEN = registry.counter(
+    "enclave_permission_files_written_total", "syft.pub.yaml files written"
+)
+RESULT_CACHE = registry.counter(
+    "enclave_result_cache_total", "Results of identical projects reused (hit) or not (miss), and results kept", ["event"]
+)
+PLAINTEXT_BYTES = registry.gauge("enclave_plaintext_bytes", "Decrypted data on disk or in memory", ["kind"])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry: Registry = registry
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """
+    Exposes the registry on http://<host>:<port>/metrics (port 0: no
+    server) and/or writes it to `textfile` for node_exporter's textfile
+    collector, at most every `interval` seconds when tick() is called.
+    """
+
+    def __init__(
+        self,
+        metrics: Registry = registry,
+        textfile: str = METRICS_TEXTFILE,
+        port: int = METRICS_PORT,
+        host: str = METRICS_HOST,
+        interval: float = METRICS_INTERVAL,
+    ):
+        self.registry = metrics
+        self.textfile = textfile
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._written_at = 0.0
+
+    def start(self):
+        if not self.port:
+            return
+        handler = type("MetricsHandler", (_Handler,), {"registry": self.registry})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Serving metrics on http://{self.host}:{self._server.server_port}/metrics")
+
+    def tick(self, force: bool = False):
+        if not self.textfile:
+            return
+        now = time.monotonic()
+        if not force and now - self._written_at < self.interval:
+            return
+        self._written_at = now
+        try:
+            write_text_atomic(self.textfile, self.registry.render())
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.textfile}: {e}")
+
+    def shutdown(self):
+        self.tick(force=True)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
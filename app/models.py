@@ -1,6 +1,7 @@
 from enum import Enum
 
+
 class DatasetStatus(Enum):
     PENDING = "pending"
     SUCCESS = "success"
-    ERROR = "error"
\ No newline at end of file
+    ERROR = "error"
@@ -1,30 +1,29 @@
+import copy
+from collections import OrderedDict
 from pathlib import Path
 import yaml
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+from utils import write_yaml_atomic
 
-def add_permission_rule(path: str, pattern: str, read: List[str], write: List[str]):
+PERMISSION_FILE = "syft.pub.yaml"
+
+
+def _merge_values(existing: List[str], new_values: List[str]) -> List[str]:
     """
-    Adds or updates a permission rule in syft.pub.yaml in the given path (must be a folder).
-    If a rule with the same pattern exists, update only missing read/write entries (no duplicates).
-    Raises ValueError if path is not a directory.
+    Appends new values that are not present yet, keeping the existing order.
+    """
+    merged = list(existing)
+    for value in new_values:
+        if value not in merged:
+            merged.append(value)
+    return merged
+
+
+def _merge_rule(data: dict, pattern: str, read: List[str], write: List[str]) -> bool:
+    """
+    Merges a rule into parsed syft.pub.yaml data. Returns whether it changed.
     """
-    folder = Path(path)
-    if not folder.is_dir():
-        raise ValueError(f"Provided path '{path}' is not a directory.")
-    yaml_file = folder / "syft.pub.yaml"
-    rule = {
-        "pattern": pattern,
-        "access": {
-            "read": read,
-            "write": write
-        }
-    }
-    if yaml_file.exists():
-        with open(yaml_file, "r") as f:
-            data = yaml.safe_load(f) or {}
-    else:
-        data = {}
     if "rules" not in data or not isinstance(data["rules"], list):
         data["rules"] = []
     # Check for existing pattern
@@ -32,13 +31,112 @@ def add_permission_rule(path: str, pattern: str, read: List[str], write: List[st
         if existing_rule.get("pattern") == pattern:
             # Update read and write lists, avoiding duplicates
             existing_access = existing_rule.setdefault("access", {})
+            changed = False
             for key, new_values in [("read", read), ("write", write)]:
-                existing = set(existing_access.get(key, []))
-                updated = list(existing.union(new_values))
-                existing_access[key] = updated
-            break
-    else:
-        # No existing pattern, append new rule
-        data["rules"].append(rule)
-    with open(yaml_file, "w") as f:
-        yaml.safe_dump(data, f, sort_keys=False)
+                existing = existing_access.get(key, [])
+                updated = _merge_values(existing, new_values)
+                if updated != existing or key not in existing_access:
+                    existing_access[key] = updated
+                    changed = True
+            return changed
+    # No existing pattern, append new rule
+    data["rules"].append({
+        "pattern": pattern,
+        "access": {
+            "read": _merge_values([], read),
+            "write": _merge_values([], write),
+        }
+    })
+    return True
+
+
+class PermissionManager:
+    """
+    Batches syft.pub.yaml updates.
+
+    add_rule() only records the change; flush() merges all changes queued
+    for a directory into one atomic write, and skips the write when the
+    rules are already in place. Parsed files are cached by their stat
+    signature, so repeated updates don't re-read unchanged files.
+    """
+
+    def __init__(self, max_cached_files: int = 1024):
+        self.max_cached_files = max_cached_files
+        self._pending: Dict[Path, List[Tuple[str, List[str], List[str]]]] = {}
+        self._cache: "OrderedDict[Path, Tuple[Tuple[int, int], dict]]" = OrderedDict()
+
+    def add_rule(self, path, pattern: str, read: List[str], write: List[str]):
+        """
+        Queues a rule for syft.pub.yaml in the given path (must be a folder).
+        Raises ValueError if path is not a directory.
+        """
+        folder = Path(path)
+        if not folder.is_dir():
+            raise ValueError(f"Provided path '{path}' is not a directory.")
+        self._pending.setdefault(folder, []).append((pattern, list(read), list(write)))
+
+    def _signature(self, yaml_file: Path) -> Optional[Tuple[int, int]]:
+        try:
+            st = yaml_file.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, yaml_file: Path) -> dict:
+        signature = self._signature(yaml_file)
+        if signature is None:
+            return {}
+        cached = self._cache.get(yaml_file)
+        if cached is not None and cached[0] == signature:
+            self._cache.move_to_end(yaml_file)
+            return copy.deepcopy(cached[1])
+        with open(yaml_file, "r") as f:
+            return yaml.safe_load(f) or {}
+
+    def _remember(self, yaml_file: Path, data: dict):
+        signature = self._signature(yaml_file)
+        if signature is None:
+            return
+        self._cache[yaml_file] = (signature, data)
+        self._cache.move_to_end(yaml_file)
+        while len(self._cache) > self.max_cached_files:
+            self._cache.popitem(last=False)
+
+    def flush(self) -> int:
+        """
+        Writes all queued rules, at most once per directory.
+        Returns the number of files written.
+        """
+        pending, self._pending = self._pending, {}
+        written = 0
+        for folder, rules in pending.items():
+            yaml_file = folder / PERMISSION_FILE
+            if not folder.is_dir():
+                # Moved or removed since the rule was queued
+                self._cache.pop(yaml_file, None)
+                continue
+            data = self._load(yaml_file)
+            changed = False
+            for pattern, read, write in rules:
+                changed |= _merge_rule(data, pattern, read, write)
+            if changed:
+                write_yaml_atomic(yaml_file, data, sort_keys=False)
+                written += 1
+            self._remember(yaml_file, data)
+        return written
+
+
+def add_permission_rule(path: str, pattern: str, read: List[str], write: List[str]):
+    """
+    Adds or updates a permission rule in syft.pub.yaml in the given path (must be a folder).
+    If a rule with the same pattern exists, update only missing read/write entries (no duplicates).
+    Raises ValueError if path is not a directory.
+    """
+    manager = PermissionManager()
+    manager.add_rule(path, pattern, read, write)
+    manager.flush()
+
+
+# Shared by the enclave daemon, flushed once per main loop pass and before
+# projects are moved to done
+permission_manager = PermissionManager()
@@ -0,0 +1,244 @@
+import os
+import shutil
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from settings import GC_INTERVAL, PLAINTEXT_QUOTA, STAGING_MEMORY_LIMIT
+from utils import directory_size, write_yaml_atomic
+
+
+def make_private_dir(path: Path):
+    """
+    Creates `path` if needed and checks that it is a directory (not a
+    symlink) owned by us with mode 0700, raising ValueError otherwise.
+    For directories at predictable paths in shared locations like /dev/shm,
+    which another user may have created first.
+    """
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise ValueError(f"{path} is not a directory")
+    if st.st_uid != os.geteuid():
+        raise ValueError(f"{path} is owned by uid {st.st_uid}")
+    if stat.S_IMODE(st.st_mode) != 0o700:
+        raise ValueError(f"{path} has mode {stat.S_IMODE(st.st_mode):o} instead of 700")
+
+
+class PlaintextStore:
+    """
+    Lifecycle of the per-project plaintext directories, `root/<name>`.
+    `root` holds nothing else, so a project's name can't collide with
+    the enclave's own files (keys, caches) in the private data dir.
+
+    A project's directory is removed as soon as the project is done, and
+    sweep() removes directories left behind by crashes (any directory
+    whose project is no longer running). admit() holds back new projects
+    while the plaintext on disk plus the new project's estimated need
+    would exceed `quota` bytes (0 means no quota).
+
+    Usage includes the projects' copies of cached datasets, the cache
+    itself is accounted for by `shared_usage`.
+
+    With a `memory_root` (a directory on tmpfs such as /dev/shm), projects
+    whose estimated size fits in the remaining `memory_limit` are staged
+    in RAM instead, so their plaintext never reaches persistent storage.
+    The disk quota does not apply to them.
+
+    Safe to use from the prefetch thread and the main loop at once.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        quota: int = PLAINTEXT_QUOTA,
+        shared_usage=lambda: 0,
+        metrics_file: Optional[Path] = None,
+        memory_root: Optional[Path] = None,
+        memory_limit: int = STAGING_MEMORY_LIMIT,
+    ):
+        self.root = Path(root)
+        self.memory_root = Path(memory_root) if memory_root is not None else None
+        self.memory_limit = memory_limit
+        self.quota = quota
+        self.shared_usage = shared_usage
+        self.metrics_file = metrics_file
+        self.usage: Dict[str, int] = {}
+        # Projects staged under memory_root
+        self.in_memory: Set[str] = set()
+        self.stats = {
+            "removed_projects": 0,
+            "orphans_removed": 0,
+            "reclaimed_bytes": 0,
+            "held_back": 0,
+            "memory_staged": 0,
+            "memory_fallbacks": 0,
+        }
+        self._last_sweep = 0.0
+        self._held: Optional[str] = None
+        self._lock = threading.RLock()
+        self.root.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if self.memory_root is not None:
+            try:
+                make_private_dir(self.memory_root)
+            except (OSError, ValueError) as e:
+                logger.error(f"Not staging datasets in memory, {e}")
+                self.memory_root = None
+        if self.memory_root is not None:
+            self.in_memory = self._project_names(self.memory_root)
+        for name in self._project_names():
+            self.usage[name] = directory_size(self.project_dir(name), include_hardlinked=False)
+
+    def _project_names(self, root: Optional[Path] = None) -> Set[str]:
+        if root is None:
+            return self._project_names(self.root) | (
+                self._project_names(self.memory_root) if self.memory_root is not None else set()
+            )
+        if not root.is_dir():
+            return set()
+        return {
+            entry.name for entry in os.scandir(root)
+            if entry.is_dir(follow_symlinks=False)
+            and not entry.name.startswith(".")
+        }
+
+    def project_dir(self, name: str) -> Path:
+        if name in self.in_memory:
+            return self.memory_root / name
+        return self.root / name
+
+    @property
+    def used(self) -> int:
+        return sum(size for name, size in self.usage.items() if name not in self.in_memory) + self.shared_usage()
+
+    @property
+    def memory_used(self) -> int:
+        return sum(size for name, size in self.usage.items() if name in self.in_memory)
+
+    def _fits_in_memory(self, needed: int) -> bool:
+        return self.memory_root is not None and self.memory_used + needed <= self.memory_limit
+
+    def stage(self, name: str, needed: int, memory: bool = True) -> Path:
+        """
+        Creates the directory for a project's plaintext, in RAM when it is
+        enabled and `needed` bytes fit, on disk otherwise (or when `memory`
+        is False, e.g. after the tmpfs ran out of space).
+        """
+        with self._lock:
+            if memory and self._fits_in_memory(needed):
+                self.in_memory.add(name)
+                self.stats["memory_staged"] += 1
+            elif name in self.in_memory:
+                # Staging in memory failed, start over on disk
+                shutil.rmtree(self.memory_root / name, ignore_errors=True)
+                self.in_memory.discard(name)
+                self.stats["memory_fallbacks"] += 1
+            elif memory and self.memory_root is not None:
+                logger.info(f"Staging {name} on disk, {needed / 2**20:.1f} MiB does not fit in memory")
+                self.stats["memory_fallbacks"] += 1
+            path = self.project_dir(name)
+            if path.is_symlink() or (path.exists() and not path.is_dir()):
+                # Never write plaintext through something planted there
+                path.unlink()
+            path.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # Reserved until record() measures the actual size
+            self.usage[name] = needed
+            return path
+
+    def admit(self, name: str, needed: int, idle: bool) -> bool:
+        """
+        Whether a project needing about `needed` bytes of plaintext may start.
+        When nothing is running it is always admitted, so an oversized
+        project cannot block the queue forever.
+        """
+        with self._lock:
+            # A project staged ahead of time already counts in `used`
+            used = self.used - self.usage.get(name, 0)
+            if self.quota <= 0 or self._fits_in_memory(needed) or used + needed <= self.quota:
+                self._held = None
+                return True
+            if idle:
+                logger.warning(
+                    f"Starting {name} although it needs {needed / 2**20:.1f} MiB "
+                    f"and the plaintext quota is exhausted"
+                )
+                self._held = None
+                return True
+            if self._held != name:
+                # Logged once per project instead of on every pass
+                logger.info(
+                    f"Holding back {name}: {used / 2**20:.1f} MiB of "
+                    f"{self.quota / 2**20:.1f} MiB plaintext quota in use"
+                )
+                self._held = name
+                self.stats["held_back"] += 1
+                self.write_metrics()
+            return False
+
+    def record(self, name: str):
+        """
+        Updates the usage of a project after its data was staged.
+        """
+        with self._lock:
+            self.usage[name] = directory_size(self.project_dir(name), include_hardlinked=False)
+            self.write_metrics()
+
+    def remove(self, name: str, orphan: bool = False) -> int:
+        """
+        Deletes a project's plaintext and returns the bytes reclaimed.
+        """
+        with self._lock:
+            reclaimed = 0
+            # Both locations, a crash may have left a copy in the other one
+            for root in (self.root, self.memory_root):
+                if root is None:
+                    continue
+                path = root / name
+                if path.is_symlink():
+                    path.unlink()
+                elif path.is_dir():
+                    reclaimed += directory_size(path, include_hardlinked=False)
+                    shutil.rmtree(path, ignore_errors=True)
+            self.usage.pop(name, None)
+            self.in_memory.discard(name)
+            self.stats["orphans_removed" if orphan else "removed_projects"] += 1
+            self.stats["reclaimed_bytes"] += reclaimed
+            self.write_metrics()
+            return reclaimed
+
+    def sweep(self, active: Set[str], force: bool = False) -> int:
+        """
+        Removes project directories not in `active`, at most every
+        GC_INTERVAL seconds unless forced. Returns the bytes reclaimed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_sweep < GC_INTERVAL:
+                return 0
+            self._last_sweep = now
+            reclaimed = 0
+            for name in self._project_names() - active:
+                logger.info(f"Removing orphaned plaintext of {name}")
+                reclaimed += self.remove(name, orphan=True)
+            if reclaimed:
+                logger.info(f"Reclaimed {reclaimed / 2**20:.1f} MiB of orphaned plaintext")
+            return reclaimed
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "projects": len(self.usage),
+            "project_bytes": self.used - self.shared_usage(),
+            "memory_bytes": self.memory_used,
+            "shared_bytes": self.shared_usage(),
+            "quota_bytes": self.quota,
+        }
+
+    def write_metrics(self):
+        with self._lock:
+            if self.metrics_file is not None:
+                write_yaml_atomic(self.metrics_file, {"plaintext": self.metrics()})
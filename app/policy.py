@@ -0,0 +1,153 @@
+import heapq
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from spec import JobSpec
+from settings import FAIR_SHARE_HALF_LIFE, MAX_PRIORITY, SCHEDULER_AGING_SECONDS
+from utils import write_yaml_atomic
+
+# Submitter of projects whose config doesn't name one
+UNKNOWN_SUBMITTER = "unknown"
+
+
+def project_submitter(spec: Optional[JobSpec]) -> Optional[str]:
+    """
+    Who submitted a project: the `submitter` of its config.yaml, or the
+    first output owner for projects created by older clients.
+    """
+    if spec is None:
+        return None
+    owners = spec.output or [None]
+    return spec.submitter or owners[0]
+
+
+@dataclass
+class Decision:
+    """
+    Why a waiting project is at its position in the queue.
+    """
+    name: str
+    position: int
+    submitter: str
+    priority: int
+    waited_seconds: float
+    # Share the submitter had used when the project was placed
+    usage: float
+    score: float
+
+    def as_dict(self) -> dict:
+        return {
+            key: round(value, 3) if isinstance(value, float) else value
+            for key, value in asdict(self).items()
+        }
+
+
+class FairSharePolicy:
+    """
+    Orders the projects waiting for a slot.
+
+    A project's score is its priority (clamped to +/- max_priority), plus
+    one point per `aging_seconds` it has waited, minus the share its
+    submitter is using: one point per running project, and per project
+    finished recently, decaying with `half_life` seconds. Projects are
+    placed one at a time, best score first, each placement adding a point
+    to its submitter's share, so a submitter with many waiting projects
+    takes turns with the others instead of going first with all of them.
+    """
+
+    def __init__(
+        self,
+        aging_seconds: float = SCHEDULER_AGING_SECONDS,
+        half_life: float = FAIR_SHARE_HALF_LIFE,
+        max_priority: int = MAX_PRIORITY,
+    ):
+        self.aging_seconds = max(1, aging_seconds)
+        self.half_life = max(1, half_life)
+        self.max_priority = max_priority
+
+    @property
+    def usage_window(self) -> float:
+        # Finished projects older than this weigh less than 1/1000
+        return 10 * self.half_life
+
+    def usage(self, rows: Iterable, now: Optional[float] = None) -> Dict[str, float]:
+        """
+        Share used per submitter, from journal rows of started and recently
+        finished projects.
+        """
+        now = time.time() if now is None else now
+        usage: Dict[str, float] = {}
+        for row in rows:
+            if row["finished_at"] is None:
+                weight = 1.0
+            else:
+                weight = 0.5 ** (max(0.0, now - row["finished_at"]) / self.half_life)
+            submitter = row["submitter"] or UNKNOWN_SUBMITTER
+            usage[submitter] = usage.get(submitter, 0.0) + weight
+        return usage
+
+    def order(self, waiting: Iterable, usage: Dict[str, float], now: Optional[float] = None) -> List[Decision]:
+        """
+        Orders journal rows of waiting projects, returning the decisions.
+        """
+        now = time.time() if now is None else now
+        usage = dict(usage)
+        # Per submitter, own projects by priority and age
+        queues: Dict[str, list] = {}
+        for row in waiting:
+            priority = max(-self.max_priority, min(self.max_priority, row["priority"] or 0))
+            waited = max(0.0, now - (row["launched_at"] or now))
+            base = priority + waited / self.aging_seconds
+            submitter = row["submitter"] or UNKNOWN_SUBMITTER
+            queues.setdefault(submitter, []).append((-base, row["launched_at"] or now, row["name"], priority, waited))
+        for queue in queues.values():
+            heapq.heapify(queue)
+
+        def head(submitter: str) -> tuple:
+            neg_base, launched_at, name, _, _ = queues[submitter][0]
+            return (neg_base + usage.get(submitter, 0.0), launched_at, name, submitter)
+
+        heads = [head(submitter) for submitter in queues]
+        heapq.heapify(heads)
+        decisions = []
+        while heads:
+            neg_score, _, _, submitter = heapq.heappop(heads)
+            _, _, name, priority, waited = heapq.heappop(queues[submitter])
+            decisions.append(Decision(
+                name=name,
+                position=len(decisions) + 1,
+                submitter=submitter,
+                priority=priority,
+                waited_seconds=waited,
+                usage=usage.get(submitter, 0.0),
+                score=-neg_score,
+            ))
+            usage[submitter] = usage.get(submitter, 0.0) + 1
+            if queues[submitter]:
+                heapq.heappush(heads, head(submitter))
+        return decisions
+
+
+class QueueStatus:
+    """
+    Writes the queue and the reasons for its order to a YAML status file,
+    whenever the order changes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._order: Optional[List[str]] = None
+
+    def update(self, decisions: List[Decision], usage: Dict[str, float]):
+        order = [decision.name for decision in decisions]
+        if order == self._order:
+            return
+        self._order = order
+        write_yaml_atomic(self.path, {
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "usage": {submitter: round(share, 3) for submitter, share in sorted(usage.items())},
+            "queue": [decision.as_dict() for decision in decisions],
+        }, sort_keys=False)
@@ -0,0 +1,145 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from loguru import logger
+
+from settings import PREFETCH_DEPTH
+
+
+@dataclass
+class StagedData:
+    """
+    The staging of one project's datasets and when each step happened.
+    """
+    name: str
+    future: Future
+    submitted_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def result(self):
+        """
+        Returns what `stage` returned, or raises what it raised.
+        """
+        return self.future.result()
+
+    def timings(self) -> dict:
+        """
+        Seconds spent waiting for the staging thread, staging, and staged
+        waiting for an execution slot.
+        """
+        now = time.monotonic()
+        started = self.started_at or now
+        finished = self.finished_at or now
+        return {
+            "queue_wait_seconds": round(started - self.submitted_at, 3),
+            "staging_seconds": round(finished - started, 3),
+            "slot_wait_seconds": round(now - finished, 3),
+        }
+
+
+class Prefetcher:
+    """
+    Stages the datasets of running projects in a background thread, ahead
+    of an execution slot opening up. `stage(folder)` does the staging.
+
+    At most `depth` projects are queued or staged without having been
+    taken; stagings run one at a time, each one decrypting its datasets
+    concurrently through the decrypt pool. `on_ready` is called (from the
+    staging thread) when a staging finishes. With a depth of 0 nothing is
+    prefetched and fetch() stages synchronously.
+    """
+
+    def __init__(
+        self,
+        stage: Callable[[Path], object],
+        depth: int = PREFETCH_DEPTH,
+        on_ready: Callable[[], None] = lambda: None,
+    ):
+        self.stage = stage
+        self.depth = max(0, depth)
+        self.on_ready = on_ready
+        self.staged: Dict[str, StagedData] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.depth > 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        return self._executor
+
+    def submit(self, folder: Path) -> bool:
+        """
+        Queues a project for staging unless it is queued already or the
+        queue is full. Returns whether the project is queued.
+        """
+        name = folder.name
+        if name in self.staged:
+            return True
+        if len(self.staged) >= self.depth:
+            return False
+        staged = StagedData(name=name, future=None)
+        staged.future = self._get_executor().submit(self._run, staged, folder)
+        # Runs once the future is done, so take() sees it as finished
+        staged.future.add_done_callback(lambda future: self.on_ready())
+        self.staged[name] = staged
+        logger.info(f"Staging data of {name} in the background")
+        return True
+
+    def _run(self, staged: StagedData, folder: Path):
+        staged.started_at = time.monotonic()
+        try:
+            return self.stage(folder)
+        finally:
+            staged.finished_at = time.monotonic()
+
+    def take(self, name: str) -> Optional[StagedData]:
+        """
+        Removes and returns a project's staging once it has finished.
+        """
+        staged = self.staged.get(name)
+        if staged is None or not staged.future.done():
+            return None
+        return self.staged.pop(name)
+
+    def discard(self, name: str):
+        """
+        Forgets a project's staging, e.g. when it won't be started. One that
+        is in progress still runs to completion.
+        """
+        staged = self.staged.pop(name, None)
+        if staged is not None:
+            staged.future.cancel()
+
+    def fetch(self, folder: Path) -> Optional[StagedData]:
+        """
+        Returns the finished staging of a project, queueing it if needed.
+        Returns None while it is queued or staging.
+        """
+        if not self.enabled:
+            staged = StagedData(name=folder.name, future=Future())
+            staged.started_at = time.monotonic()
+            try:
+                staged.future.set_result(self.stage(folder))
+            except Exception as e:
+                staged.future.set_exception(e)
+            staged.finished_at = time.monotonic()
+            return staged
+        self.submit(folder)
+        return self.take(folder.name)
+
+    def shutdown(self):
+        """
+        Cancels queued stagings and waits for the one in progress.
+        """
+        if self._executor is not None:
+            logger.info("Shutting down data prefetching")
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self.staged.clear()
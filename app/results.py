@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+from loguru import logger
+
+from settings import RESULT_CACHE_DAYS, RESULT_CACHE_LIMIT
+from utils import directory_size, write_json_atomic
+
+STAGING_PREFIX = ".staging-"
+RESULT_FILE = "result.json"
+OUTPUT_DIR = "output"
+LOG_FILE = "execution.log"
+# Written by the enclave in each output directory, not part of a result
+PERMISSION_FILE = "syft.pub.yaml"
+
+DAY = 24 * 3600
+
+
+def job_fingerprint(
+    code_dir: Path,
+    entrypoint: str,
+    datasets: Iterable[Tuple[str, str]],
+    output_owners: Iterable[str],
+    runtime: str,
+) -> str:
+    """
+    Fingerprint of what a job computes and for whom: the content of its
+    code tree, its entrypoint, the (dataset_id, dataset_key) of its
+    datasets in order, its output owners and the interpreter it runs with.
+    """
+    digest = hashlib.sha256()
+
+    def field(value: bytes):
+        # Length-prefixed, so adjacent fields can't be confused
+        digest.update(len(value).to_bytes(8, "big"))
+        digest.update(value)
+
+    for dirpath, dirnames, filenames in os.walk(code_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = Path(dirpath) / filename
+            field(path.relative_to(code_dir).as_posix().encode())
+            if path.is_symlink():
+                field(b"->" + os.readlink(path).encode())
+                continue
+            with open(path, "rb") as f:
+                field(hashlib.file_digest(f, "sha256").digest())
+    field(entrypoint.encode())
+    for dataset_id, key in datasets:
+        field(f"{dataset_id}:{key}".encode())
+    field(",".join(sorted(output_owners)).encode())
+    field(runtime.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Outputs and execution logs of successful jobs, by job fingerprint.
+
+    Each entry is stored under `root/<fingerprint>` with the project it
+    came from. Entries older than `retention_days` are not reused, and the
+    total size is kept under `budget` bytes by evicting the least recently
+    used ones. A budget of 0 disables the cache. Only used from the main
+    thread.
+    """
+
+    def __init__(self, root: Path, budget: int = RESULT_CACHE_LIMIT, retention_days: int = RESULT_CACHE_DAYS):
+        self.root = Path(root)
+        self.budget = budget
+        self.retention = retention_days * DAY if retention_days > 0 else None
+        # fingerprint -> size in bytes, least recently used first
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget > 0
+
+    def _load(self):
+        # Rebuilds the index from disk, using mtimes as the LRU order
+        self.root.mkdir(parents=True, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.root):
+            path = Path(entry.path)
+            if entry.name.startswith(STAGING_PREFIX) or not (path / RESULT_FILE).exists():
+                # Left over from an interrupted store
+                shutil.rmtree(path, ignore_errors=True)
+            elif entry.is_dir(follow_symlinks=False):
+                found.append((entry.stat().st_mtime, entry.name, directory_size(path)))
+        for _, fingerprint, size in sorted(found):
+            self.entries[fingerprint] = size
+        if self.entries:
+            logger.info(f"Result cache has {len(self.entries)} entries, {sum(self.entries.values()) / 2**20:.1f} MiB")
+        self._evict()
+
+    def _expired(self, fingerprint: str) -> bool:
+        if self.retention is None:
+            return False
+        result = json.loads((self.root / fingerprint / RESULT_FILE).read_text())
+        return time.time() - result["stored_at"] > self.retention
+
+    def lookup(self, fingerprint: str) -> Optional[dict]:
+        """
+        Returns the metadata of a cached result (the project it came from,
+        when it was stored) and marks it as recently used.
+        """
+        if fingerprint not in self.entries:
+            return None
+        path = self.root / fingerprint
+        try:
+            if self._expired(fingerprint):
+                self._remove(fingerprint)
+                return None
+            result = json.loads((path / RESULT_FILE).read_text())
+        except (OSError, ValueError, KeyError):
+            # Removed or damaged on disk
+            self._remove(fingerprint)
+            return None
+        self.entries.move_to_end(fingerprint)
+        os.utime(path)
+        return result
+
+    def publish(self, fingerprint: str, output_dir: Path, log_path: Path):
+        """
+        Copies a cached result into a project's output directory, and its
+        execution log to `log_path`.
+        """
+        path = self.root / fingerprint
+        shutil.copytree(path / OUTPUT_DIR, output_dir, dirs_exist_ok=True)
+        shutil.copyfile(path / LOG_FILE, log_path)
+
+    def store(self, fingerprint: str, project: str, output_dir: Path, log_path: Path):
+        """
+        Keeps a copy of the outputs and execution log of a successful job.
+        """
+        if not self.enabled:
+            return
+        path = self.root / fingerprint
+        staging_dir = Path(tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{fingerprint}-", dir=self.root))
+        try:
+            shutil.copytree(
+                output_dir, staging_dir / OUTPUT_DIR, ignore=shutil.ignore_patterns(PERMISSION_FILE)
+            )
+            shutil.copyfile(log_path, staging_dir / LOG_FILE)
+            write_json_atomic(staging_dir / RESULT_FILE, {"project": project, "stored_at": time.time()})
+            # Replaces the result of an earlier run, e.g. of an opted out project
+            self._remove(fingerprint)
+            os.rename(staging_dir, path)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        self.entries[fingerprint] = directory_size(path)
+        self._evict()
+
+    def _remove(self, fingerprint: str):
+        self.entries.pop(fingerprint, None)
+        shutil.rmtree(self.root / fingerprint, ignore_errors=True)
+
+    def _evict(self):
+        total = sum(self.entries.values())
+        for fingerprint in list(self.entries):
+            if total <= self.budget:
+                break
+            size = self.entries.pop(fingerprint)
+            shutil.rmtree(self.root / fingerprint, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted result {fingerprint[:12]} from the cache ({size / 2**20:.1f} MiB)")
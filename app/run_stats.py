@@ -0,0 +1,65 @@
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from loguru import logger
+
+from utils import write_json_atomic
+
+RUN_STATS_FILE = "run_stats.json"
+
+# Job states in the order they are reached, and the durations between them.
+# The output owners can read the file, so staging is left out: how long it
+# took tells whether the datasets were in the dataset cache.
+STATES = (
+    "submitted",
+    "launched",
+    "started",
+    "finished",
+    "done",
+)
+DURATIONS = {
+    "launch_wait_seconds": ("submitted", "launched"),
+    "start_wait_seconds": ("launched", "started"),
+    "run_seconds": ("started", "finished"),
+    "total_seconds": ("submitted", "done"),
+}
+
+
+def _timestamp(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat()
+
+
+def _parse_timestamp(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def update_run_stats(folder: Path, states: Optional[Dict[str, float]] = None, **fields) -> dict:
+    """
+    Merges state transition times (time.time() values) and other fields
+    into the project's run_stats.json, which travels with the project
+    folder from running to done. Durations between the states reached so
+    far are recomputed. Returns the stats written.
+    """
+    path = folder / RUN_STATS_FILE
+    stats = {}
+    if path.exists():
+        try:
+            stats = json.loads(path.read_text())
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable {path}: {e}")
+    stats.setdefault("project", folder.name)
+
+    reached = stats.get("states", {})
+    for state, t in (states or {}).items():
+        reached[state] = _timestamp(t)
+    stats["states"] = {state: reached[state] for state in STATES if state in reached}
+    stats["durations"] = {
+        name: round(_parse_timestamp(reached[end]) - _parse_timestamp(reached[start]), 3)
+        for name, (start, end) in DURATIONS.items()
+        if start in reached and end in reached
+    }
+    stats.update(fields)
+    write_json_atomic(path, stats)
+    return stats
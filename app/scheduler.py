@@ -0,0 +1,212 @@
+import os
+import signal
+import subprocess
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, Optional
+
+from loguru import logger
+
+from metrics import ERRORS
+from settings import JOB_SLOTS, SHUTDOWN_GRACE_SECONDS
+
+
+@dataclass
+class Job:
+    """
+    A running enclave project and the child process executing it.
+    """
+    name: str
+    folder: Path
+    # subprocess.Popen, or a ForkedProcess when forked from the warm pool
+    process: subprocess.Popen
+    log_file: IO
+    started_at: float = field(default_factory=time.time)
+    # time.time() after which the job is killed, None for no wall time limit
+    deadline: Optional[float] = None
+    finished_at: Optional[float] = None
+    # CPU time and peak memory of the process, once reaped
+    rusage: Optional[dict] = None
+    # Whatever the start callback needs again on completion
+    context: dict = field(default_factory=dict)
+
+
+class JobScheduler:
+    """
+    Runs enclave projects in up to `slots` concurrent child processes.
+
+    poll() never blocks on a child: it reaps finished jobs, hands them to
+    `finish_job` and fills free slots by calling `start_job` on candidate
+    folders that are not already running. `start_job` may return None when
+    a project could not be started (it is then responsible for the folder)
+    or is not ready yet (it is offered again on the next poll).
+    When `can_start(folder, idle)` returns False the remaining candidates
+    are held back until the next poll. Candidates that don't get a slot
+    are handed to `prefetch`, to get them ready in the meantime.
+    Jobs still running past their deadline are killed and completed with
+    a "failure" reason in their context. If `finish_job` raises, the job
+    is handed to `fail_job` with the error, so it isn't left in running.
+    """
+
+    def __init__(
+        self,
+        start_job: Callable[[Path], Optional[Job]],
+        finish_job: Callable[[Job, int], None],
+        slots: int = JOB_SLOTS,
+        can_start: Optional[Callable[[Path, bool], bool]] = None,
+        prefetch: Optional[Callable[[Path], None]] = None,
+        fail_job: Optional[Callable[[Job, int, str], None]] = None,
+    ):
+        self.start_job = start_job
+        self.finish_job = finish_job
+        self.can_start = can_start
+        self.prefetch = prefetch
+        self.fail_job = fail_job
+        self.slots = max(1, slots)
+        self.active: Dict[str, Job] = {}
+
+    @property
+    def free_slots(self) -> int:
+        return self.slots - len(self.active)
+
+    def poll(self, candidates: Iterable[Path]):
+        """
+        Reaps finished jobs, then starts candidates while slots are free.
+        """
+        self.reap()
+        for folder in candidates:
+            if folder.name in self.active:
+                continue
+            if self.free_slots <= 0 and self.prefetch is None:
+                break
+            if self.can_start is not None and not self.can_start(folder, not self.active):
+                # Later candidates wait as well, so the held project is not starved
+                break
+            if self.free_slots <= 0:
+                try:
+                    self.prefetch(folder)
+                except Exception as e:
+                    logger.exception(f"Failed to prefetch enclave project {folder.name}: {e}")
+                    ERRORS.inc(stage="prefetch")
+                continue
+            try:
+                job = self.start_job(folder)
+            except Exception as e:
+                logger.exception(f"Failed to start enclave project {folder.name}: {e}")
+                ERRORS.inc(stage="start")
+                continue
+            if job is not None:
+                self.active[job.name] = job
+
+    def reap(self):
+        """
+        Completes every job whose process has exited or ran out of time.
+        """
+        now = time.time()
+        for name, job in list(self.active.items()):
+            returncode = _poll(job)
+            if returncode is None and job.deadline is not None and now >= job.deadline:
+                limit = job.deadline - job.started_at
+                logger.warning(f"Enclave project {name} exceeded its wall time limit of {limit:.0f}s, killing it")
+                job.context["failure"] = f"wall time limit of {limit:.0f}s exceeded"
+                try:
+                    os.killpg(job.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                returncode = _poll(job, block=True)
+            if returncode is None:
+                continue
+            self._complete(job, returncode)
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        The earliest deadline of the running jobs, if any.
+        """
+        deadlines = [job.deadline for job in self.active.values() if job.deadline is not None]
+        return min(deadlines, default=None)
+
+    def _complete(self, job: Job, returncode: int):
+        del self.active[job.name]
+        job.finished_at = time.time()
+        job.log_file.close()
+        logger.info(
+            f"Enclave project {job.name} finished with exit code {returncode} "
+            f"in {time.time() - job.started_at:.1f}s"
+        )
+        try:
+            self.finish_job(job, returncode)
+        except Exception as e:
+            logger.exception(f"Failed to complete enclave project {job.name}: {e}")
+            ERRORS.inc(stage="finish")
+            if self.fail_job is None:
+                return
+            try:
+                self.fail_job(job, returncode, f"could not be completed: {e}")
+            except Exception as e:
+                logger.exception(f"Failed to move enclave project {job.name} to done: {e}")
+
+    def shutdown(self, grace_seconds: float = SHUTDOWN_GRACE_SECONDS):
+        """
+        Lets running jobs drain for up to `grace_seconds`, then kills the rest.
+        Killed jobs are not completed, they stay in `running` and are started
+        again when the enclave comes back.
+        """
+        if self.active:
+            logger.info(f"Waiting up to {grace_seconds}s for {len(self.active)} running job(s)")
+        deadline = time.monotonic() + grace_seconds
+        while self.active and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.2)
+
+        for job in list(self.active.values()):
+            logger.warning(f"Killing enclave project {job.name}, it will be restarted on the next run")
+            _kill_process_group(job.process)
+            job.log_file.close()
+        self.active.clear()
+
+
+def _poll(job: Job, block: bool = False) -> Optional[int]:
+    """
+    process.poll() (or wait() when blocking) that also records the resource
+    usage of the exited process in job.rusage.
+    """
+    process = job.process
+    if not isinstance(process, subprocess.Popen):
+        # Reaped by the fork server, which reports the usage with the exit code
+        returncode = process.wait() if block else process.poll()
+        if returncode is not None and process.rusage is not None:
+            job.rusage = rusage_stats(*process.rusage)
+        return returncode
+    if process.returncode is not None:
+        return process.returncode
+    try:
+        pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+    except ChildProcessError:
+        return process.poll()
+    if pid == 0:
+        return None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    job.rusage = rusage_stats(rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss)
+    return process.returncode
+
+
+def rusage_stats(user_cpu: float, system_cpu: float, max_rss_kb: int) -> dict:
+    return {
+        "user_cpu_seconds": round(user_cpu, 3),
+        "system_cpu_seconds": round(system_cpu, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "max_rss_bytes": max_rss_kb * 1024,
+    }
+
+
+def _kill_process_group(process: subprocess.Popen, timeout: float = 5):
+    # Jobs run in their own session, so this also reaches their children
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
@@ -0,0 +1,152 @@
+import os
+
+# Enclave-wide tunables, overridable through environment variables
+
+MiB = 1024 * 1024
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Environment variable {name} must be an integer, got {value!r}")
+
+
+# Number of processes decrypting datasets concurrently (<= 1 decrypts inline)
+DECRYPT_WORKERS = _env_int("ENCLAVE_DECRYPT_WORKERS", min(os.cpu_count() or 1, 8))
+
+# Upper bound on the estimated memory of all in-flight dataset decryptions
+DECRYPT_MEMORY_LIMIT = _env_int("ENCLAVE_DECRYPT_MEMORY_LIMIT_MB", 512) * MiB
+
+# Number of unwrapped AES data keys kept in memory (0 disables the cache)
+KEY_CACHE_SIZE = _env_int("ENCLAVE_KEY_CACHE_SIZE", 256)
+
+# Number of enclave projects executing at the same time
+JOB_SLOTS = _env_int("ENCLAVE_JOB_SLOTS", 2)
+
+# Seconds running jobs get to finish when the enclave shuts down
+SHUTDOWN_GRACE_SECONDS = _env_int("ENCLAVE_SHUTDOWN_GRACE_SECONDS", 30)
+
+# How the main loop waits for work: "auto", "inotify" or "poll"
+WATCH_MODE = os.environ.get("ENCLAVE_WATCH_MODE", "auto")
+
+# Seconds between scans when polling
+POLL_INTERVAL = _env_int("ENCLAVE_POLL_INTERVAL", 3)
+
+# Seconds between safety scans when woken up by inotify events
+EVENT_FALLBACK_INTERVAL = _env_int("ENCLAVE_EVENT_FALLBACK_INTERVAL", 30)
+
+# Disk budget of the shared cache of decrypted datasets (0 disables it)
+DATASET_CACHE_LIMIT = _env_int("ENCLAVE_DATASET_CACHE_LIMIT_MB", 10240) * MiB
+
+# Disk quota for decrypted data of running projects, including the dataset
+# cache (0 means no quota). New projects are held back while it is exceeded.
+PLAINTEXT_QUOTA = _env_int("ENCLAVE_PLAINTEXT_QUOTA_MB", 0) * MiB
+
+# Seconds between sweeps for plaintext left behind by crashed projects
+GC_INTERVAL = _env_int("ENCLAVE_GC_INTERVAL", 600)
+
+# Where decrypted datasets are staged: "disk" (the private data dir) or
+# "memory" (a tmpfs directory, falling back to disk when they don't fit)
+STAGING_MODE = os.environ.get("ENCLAVE_STAGING", "disk")
+
+# tmpfs mount used by the "memory" staging mode
+STAGING_MEMORY_DIR = os.environ.get("ENCLAVE_STAGING_MEMORY_DIR", "/dev/shm")
+
+# Total size of the datasets staged in memory at the same time
+STAGING_MEMORY_LIMIT = _env_int("ENCLAVE_STAGING_MEMORY_LIMIT_MB", 1024) * MiB
+
+# Number of running projects whose datasets are staged in the background
+# ahead of a free slot (0 stages them when the project starts)
+PREFETCH_DEPTH = _env_int("ENCLAVE_PREFETCH_DEPTH", 2)
+
+# Run entrypoints in children forked from a warm python3 (1) instead of
+# starting a new interpreter for every job (0)
+WARM_POOL = _env_int("ENCLAVE_WARM_POOL", 0)
+
+# Modules the warm interpreter imports once, before forking jobs
+WARM_POOL_PRELOAD = os.environ.get("ENCLAVE_WARM_POOL_PRELOAD", "pandas,numpy")
+
+# Number of per-requirements virtualenvs kept for projects shipping a
+# requirements file
+ENV_CACHE_SIZE = _env_int("ENCLAVE_ENV_CACHE_SIZE", 8)
+
+# Local directory of wheels to build environments from without network
+# access (empty: use the configured package index)
+WHEELHOUSE = os.environ.get("ENCLAVE_WHEELHOUSE", "")
+
+# Seconds a single environment build step may take
+ENV_BUILD_TIMEOUT = _env_int("ENCLAVE_ENV_BUILD_TIMEOUT", 900)
+
+# Per-job limits, 0 meaning unlimited. Projects may lower them in the
+# `limits` section of their config.yaml, but not raise them.
+# Seconds a job may run before it is killed
+JOB_WALL_TIME_SECONDS = _env_int("ENCLAVE_JOB_WALL_TIME_SECONDS", 0)
+
+# CPU seconds a job may use (RLIMIT_CPU)
+JOB_CPU_SECONDS = _env_int("ENCLAVE_JOB_CPU_SECONDS", 0)
+
+# Resident memory of a job in MB: memory.max of its cgroup when
+# ENCLAVE_CGROUP_ROOT is set, its address space limit otherwise
+JOB_MEMORY_MB = _env_int("ENCLAVE_JOB_MEMORY_MB", 0)
+
+# Address space of a job in MB (RLIMIT_AS)
+JOB_ADDRESS_SPACE_MB = _env_int("ENCLAVE_JOB_ADDRESS_SPACE_MB", 0)
+
+# Open file descriptors of a job (RLIMIT_NOFILE)
+JOB_OPEN_FILES = _env_int("ENCLAVE_JOB_OPEN_FILES", 0)
+
+# cgroup v2 directory delegated to the enclave, per-job cgroups are
+# created under it (empty: no cgroups)
+CGROUP_ROOT = os.environ.get("ENCLAVE_CGROUP_ROOT", "")
+
+# Port of the local HTTP /metrics endpoint in the Prometheus text format
+# (0 disables it), and the address it listens on
+METRICS_PORT = _env_int("ENCLAVE_METRICS_PORT", 0)
+METRICS_HOST = os.environ.get("ENCLAVE_METRICS_HOST", "127.0.0.1")
+
+# File the metrics are written to for node_exporter's textfile collector
+# (empty: not written), and the seconds between writes
+METRICS_TEXTFILE = os.environ.get("ENCLAVE_METRICS_TEXTFILE", "")
+METRICS_INTERVAL = _env_int("ENCLAVE_METRICS_INTERVAL", 15)
+
+# Times a project may be interrupted while running (e.g. by a crash of the
+# enclave or the host) before it is moved to done instead of run again
+JOB_MAX_ATTEMPTS = _env_int("ENCLAVE_JOB_MAX_ATTEMPTS", 3)
+
+# Scheduling of the projects waiting for a slot: one point of priority is
+# worth SCHEDULER_AGING_SECONDS of waiting, or one project of the same
+# submitter running (or finished FAIR_SHARE_HALF_LIFE seconds ago, half
+# a point). Priorities in config.yaml are clamped to +/- MAX_PRIORITY.
+SCHEDULER_AGING_SECONDS = _env_int("ENCLAVE_SCHEDULER_AGING_SECONDS", 600)
+FAIR_SHARE_HALF_LIFE = _env_int("ENCLAVE_FAIR_SHARE_HALF_LIFE", 3600)
+MAX_PRIORITY = _env_int("ENCLAVE_MAX_PRIORITY", 5)
+
+# Layout of jobs/done and jobs/outputs: "flat" (<name>) or "sharded"
+# (<2 hex digits of sha256(name)>/<name>); both are always readable
+JOBS_LAYOUT = os.environ.get("ENCLAVE_JOBS_LAYOUT", "flat")
+
+# Done folders older than this many days are compacted into per-month
+# tarballs in the private archive directory (0 keeps them)
+ARCHIVE_AFTER_DAYS = _env_int("ENCLAVE_ARCHIVE_AFTER_DAYS", 0)
+
+# Seconds between archival passes, and done folders archived per pass
+ARCHIVE_INTERVAL = _env_int("ENCLAVE_ARCHIVE_INTERVAL", 3600)
+ARCHIVE_BATCH = _env_int("ENCLAVE_ARCHIVE_BATCH", 500)
+
+# Disk budget of the outputs of successful jobs kept to be reused by
+# identical projects (0 disables reuse), and days they are reused for
+RESULT_CACHE_LIMIT = _env_int("ENCLAVE_RESULT_CACHE_LIMIT_MB", 1024) * MiB
+RESULT_CACHE_DAYS = _env_int("ENCLAVE_RESULT_CACHE_DAYS", 7)
+
+# Seconds a launch project's config.yaml must stay invalid before the
+# project is moved to done as failed, in case it was still being written
+INVALID_SPEC_GRACE_SECONDS = _env_int("ENCLAVE_INVALID_SPEC_GRACE_SECONDS", 60)
+
+# Only decrypt .enc files that come with a manifest from their owner
+# (<dataset_id>.enc.manifest.json), also for legacy files without a size
+# in their header
+REQUIRE_DATASET_MANIFEST = _env_int("ENCLAVE_REQUIRE_DATASET_MANIFEST", 0)
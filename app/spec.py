@@ -0,0 +1 @@
+../src/syftbox_enclave/spec.py
\ No newline at end of file
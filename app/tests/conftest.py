@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The enclave app is a directory of scripts importing each other by name
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
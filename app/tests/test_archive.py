@@ -0,0 +1,83 @@
+import tarfile
+import time
+
+import pytest
+import yaml
+
+from archive import Archiver
+from journal import ARCHIVED, DONE, JobJournal
+from layout import SHARDED, JobsLayout
+from permissions import add_permission_rule
+
+OLD = time.time() - 30 * 24 * 3600
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = JobJournal(tmp_path / "jobs.db")
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def layout(tmp_path):
+    return JobsLayout(tmp_path / "jobs", SHARDED)
+
+
+def make_done(layout, journal, name: str, updated_at: float = OLD, **result):
+    folder = layout.done_dir(name)
+    folder.mkdir(parents=True)
+    (folder / "execution.log").write_text(f"{name} ran\n")
+    add_permission_rule(folder, "**", read=["owner@x.org"], write=[])
+    journal.transition(name, DONE, updated_at=updated_at, **result)
+    return folder
+
+
+def test_archives_old_done_folders(tmp_path, journal, layout):
+    make_done(layout, journal, "old", exit_code=0)
+    recent = make_done(layout, journal, "recent", updated_at=time.time(), exit_code=0)
+    archiver = Archiver(tmp_path / "archive", journal, layout, after_days=7)
+
+    assert archiver.run(force=True) == 1
+    assert layout.find_done("old") is None
+    assert recent.is_dir()
+    row = journal.get("old")
+    assert row["state"] == ARCHIVED
+    with tarfile.open(row["archive"]) as tar:
+        assert tar.extractfile("old/execution.log").read() == b"old ran\n"
+
+
+def test_leaves_a_readable_stub(tmp_path, journal, layout):
+    make_done(layout, journal, "ok", exit_code=0, finished_at=OLD)
+    make_done(layout, journal, "bad", exit_code=-9, failure="killed by SIGKILL", finished_at=OLD)
+    Archiver(tmp_path / "archive", journal, layout, after_days=7).run(force=True)
+
+    stub_path = layout.find_archived("ok")
+    assert stub_path == layout.done_dir("ok").with_name("ok.archived.yaml")
+    stub = yaml.safe_load(stub_path.read_text())
+    assert stub["status"] == "success"
+    assert stub["exit_code"] == 0
+    assert stub["archive"] == time.strftime("%Y-%m.tar", time.gmtime(OLD))
+    bad = yaml.safe_load(layout.find_archived("bad").read_text())
+    assert bad["status"] == "failed"
+    assert bad["failure"] == "killed by SIGKILL"
+
+    # Readable by the project's owners only, like its done folder was
+    rules = yaml.safe_load((stub_path.parent / "syft.pub.yaml").read_text())["rules"]
+    patterns = {rule["pattern"]: rule["access"]["read"] for rule in rules}
+    assert patterns["ok.archived.yaml"] == ["owner@x.org"]
+
+
+def test_removed_folder_is_marked_archived(tmp_path, journal, layout):
+    journal.transition("gone", DONE, updated_at=OLD)
+    Archiver(tmp_path / "archive", journal, layout, after_days=7).run(force=True)
+    row = journal.get("gone")
+    assert row["state"] == ARCHIVED
+    assert row["archive"] is None
+    assert layout.find_archived("gone") is None
+
+
+def test_disabled(tmp_path, journal, layout):
+    folder = make_done(layout, journal, "old")
+    assert Archiver(tmp_path / "archive", journal, layout, after_days=0).run(force=True) == 0
+    assert folder.is_dir()
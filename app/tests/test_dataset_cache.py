@@ -0,0 +1,95 @@
+import os
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from dataset_cache import STAGING_PREFIX, DatasetCache, dataset_key
+from encryption import encrypt_file
+
+
+def add_entry(cache: DatasetCache, key: str, size: int):
+    staging_dir = cache.staging_dir(key)
+    (staging_dir / "data.csv").write_bytes(b"x" * size)
+    return cache.commit(key, staging_dir)
+
+
+def test_key_changes_with_every_encryption(tmp_path):
+    public_key = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()
+    src = tmp_path / "data.zip"
+    src.write_bytes(b"same plaintext")
+    encrypt_file(src, tmp_path / "a.enc", public_key)
+    encrypt_file(src, tmp_path / "b.enc", public_key)
+    assert dataset_key(tmp_path / "a.enc") == dataset_key(tmp_path / "a.enc")
+    assert dataset_key(tmp_path / "a.enc") != dataset_key(tmp_path / "b.enc")
+
+
+def test_jobs_get_their_own_copy(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=1000)
+    add_entry(cache, "k1", 10)
+    target = tmp_path / "job" / "data"
+    cache.copy("k1", target)
+    (target / "data.csv").write_bytes(b"changed by the job")
+    assert (cache.lookup("k1") / "data.csv").read_bytes() == b"x" * 10
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=250)
+    add_entry(cache, "k1", 100)
+    add_entry(cache, "k2", 100)
+    cache.lookup("k1")
+    add_entry(cache, "k3", 100)
+    cache.release("nobody")
+    assert list(cache.entries) == ["k1", "k3"]
+    assert not (tmp_path / "cache" / "k2").exists()
+
+
+def test_referenced_entries_are_kept(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=150)
+    add_entry(cache, "k1", 100)
+    cache.acquire("p1", "k1")
+    add_entry(cache, "k2", 100)
+    cache.release("nobody")
+    # Over budget while p1 runs
+    assert list(cache.entries) == ["k1"]
+    cache.release("p1")
+    assert cache.size <= 150
+
+
+def test_concurrent_commits_keep_the_first(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=1000)
+    first = cache.staging_dir("k1")
+    second = cache.staging_dir("k1")
+    (first / "data.csv").write_text("first")
+    (second / "data.csv").write_text("second")
+    cache.commit("k1", first)
+    cache.commit("k1", second)
+    assert (cache.lookup("k1") / "data.csv").read_text() == "first"
+    assert not second.exists()
+
+
+def test_reloads_from_disk(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=1000)
+    add_entry(cache, "k1", 10)
+    os.utime(cache.root / "k1", (0, 0))
+    add_entry(cache, "k2", 10)
+    # An interrupted decryption
+    (cache.staging_dir("k3") / "data.csv").write_text("partial")
+
+    reloaded = DatasetCache(tmp_path / "cache", budget=1000)
+    assert list(reloaded.entries) == ["k1", "k2"]
+    assert not any(entry.startswith(STAGING_PREFIX) for entry in os.listdir(reloaded.root))
+
+
+def test_disabled(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=0)
+    assert not cache.enabled
+    assert not (tmp_path / "cache").exists()
+    assert cache.lookup("k1") is None
+
+
+def test_lookup_of_a_removed_entry(tmp_path):
+    cache = DatasetCache(tmp_path / "cache", budget=1000)
+    path = add_entry(cache, "k1", 10)
+    (path / "data.csv").unlink()
+    path.rmdir()
+    assert cache.lookup("k1") is None
+    assert "k1" not in cache.entries
@@ -0,0 +1,75 @@
+import zipfile
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from decrypt_pool import DatasetDecryptError, DatasetTask, DecryptPool
+from encryption import encrypt_file
+from keys import KeyManager
+
+CHUNK_SIZE = 4096
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def pool(tmp_path, private_key):
+    key_path = tmp_path / "key.pem"
+    key_path.write_bytes(private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return DecryptPool(KeyManager(key_path), max_workers=1)
+
+
+def make_dataset(tmp_path, private_key, files: dict, name: str = "data"):
+    zip_path = tmp_path / f"{name}.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as z:
+        for filename, content in files.items():
+            z.writestr(filename, content)
+    enc_path = tmp_path / f"{name}.enc"
+    encrypt_file(zip_path, enc_path, private_key.public_key(), chunk_size=CHUNK_SIZE)
+    return enc_path
+
+
+def test_extracted_size_is_the_uncompressed_size(tmp_path, private_key, pool):
+    # Compresses to a small fraction of its size
+    enc_path = make_dataset(tmp_path, private_key, {"a.csv": b"0" * 1_000_000, "b.csv": b"1,2\n"})
+    assert enc_path.stat().st_size < 100_000
+    assert pool.extracted_size(enc_path) == 1_000_004
+
+
+def test_extracted_size_is_cached_per_file_version(tmp_path, private_key, pool):
+    enc_path = make_dataset(tmp_path, private_key, {"a.csv": b"0" * 1000})
+    assert pool.extracted_size(enc_path) == 1000
+    assert pool.extracted_size(enc_path) == 1000
+    assert len(pool._sizes) == 1
+    make_dataset(tmp_path, private_key, {"a.csv": b"0" * 2000})
+    assert pool.extracted_size(enc_path) == 2000
+
+
+def test_unreadable_files_fall_back_to_their_size(tmp_path, pool):
+    enc_path = tmp_path / "broken.enc"
+    enc_path.write_bytes(b"not an enc file")
+    assert pool.extracted_size(enc_path) == len(b"not an enc file")
+    # Not cached, the file may still be being written
+    assert not pool._sizes
+
+
+def test_extracts_datasets(tmp_path, private_key, pool):
+    enc_path = make_dataset(tmp_path, private_key, {"dir/a.csv": b"1,2\n"})
+    stats = pool.run([DatasetTask("d1", "alice@x.org", enc_path, tmp_path / "out")])
+    assert (tmp_path / "out" / "dir" / "a.csv").read_bytes() == b"1,2\n"
+    assert stats["d1"]["extracted_bytes"] == 4
+
+
+def test_failure_names_the_dataset(tmp_path, pool):
+    enc_path = tmp_path / "broken.enc"
+    enc_path.write_bytes(b"not an enc file")
+    with pytest.raises(DatasetDecryptError) as e:
+        pool.run([DatasetTask("d1", "alice@x.org", enc_path, tmp_path / "out")])
+    assert e.value.task.dataset_id == "d1"
+    assert "broken.enc" in str(e.value)
@@ -0,0 +1,147 @@
+import io
+import os
+import struct
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from encryption import (
+    ENC_V1,
+    ENC_V2,
+    OAEP_PADDING,
+    TAG_SIZE,
+    InvalidEncFile,
+    check_enc_file,
+    decrypt_file,
+    encrypt_file,
+    load_header,
+    manifest_path,
+    open_decrypted,
+    unwrap_key,
+)
+
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def plaintext():
+    # Three full chunks and a partial one
+    return os.urandom(3 * CHUNK_SIZE + 100)
+
+
+@pytest.fixture
+def enc_file(tmp_path, private_key, plaintext):
+    src = tmp_path / "data.zip"
+    src.write_bytes(plaintext)
+    path = tmp_path / "data.enc"
+    encrypt_file(src, path, private_key.public_key(), chunk_size=CHUNK_SIZE)
+    return path
+
+
+def decrypt(path, private_key) -> bytes:
+    out = io.BytesIO()
+    decrypt_file(path, private_key, out)
+    return out.getvalue()
+
+
+def chunk_offset(path, index: int) -> int:
+    header = load_header(path)
+    return header.payload_offset + index * (CHUNK_SIZE + TAG_SIZE)
+
+
+def test_round_trip(enc_file, private_key, plaintext):
+    header = load_header(enc_file)
+    assert header.version == ENC_V2
+    assert header.chunk_count == 4
+    assert enc_file.stat().st_size == header.expected_file_size
+    assert decrypt(enc_file, private_key) == plaintext
+
+
+def test_random_access(enc_file, private_key, plaintext):
+    aes_key = unwrap_key(private_key, load_header(enc_file).wrapped_key)
+    with open_decrypted(enc_file, aes_key) as f:
+        f.seek(2 * CHUNK_SIZE - 10)
+        assert f.read(20) == plaintext[2 * CHUNK_SIZE - 10:2 * CHUNK_SIZE + 10]
+        f.seek(0)
+        assert f.read() == plaintext
+
+
+def test_empty_plaintext(tmp_path, private_key):
+    src = tmp_path / "empty.zip"
+    src.write_bytes(b"")
+    path = tmp_path / "empty.enc"
+    encrypt_file(src, path, private_key.public_key(), chunk_size=CHUNK_SIZE)
+    assert load_header(path).chunk_count == 1
+    assert decrypt(path, private_key) == b""
+
+
+def test_truncated_file_rejected(enc_file, private_key):
+    data = enc_file.read_bytes()
+    enc_file.write_bytes(data[:-10])
+    with pytest.raises(InvalidEncFile):
+        check_enc_file(enc_file)
+    with pytest.raises(InvalidEncFile):
+        decrypt(enc_file, private_key)
+
+
+def test_dropped_final_chunk_rejected(enc_file, private_key):
+    # Cut at a chunk boundary and shrink the declared size to match: the
+    # header no longer matches the one the chunks were sealed with
+    data = bytearray(enc_file.read_bytes()[:chunk_offset(enc_file, 3)])
+    struct.pack_into(">Q", data, 10, 3 * CHUNK_SIZE)
+    enc_file.write_bytes(bytes(data))
+    manifest_path(enc_file).unlink()
+    # Looks complete from its size alone
+    check_enc_file(enc_file)
+    with pytest.raises(InvalidTag):
+        decrypt(enc_file, private_key)
+
+
+def test_reordered_chunks_rejected(enc_file, private_key):
+    data = bytearray(enc_file.read_bytes())
+    first, second = chunk_offset(enc_file, 0), chunk_offset(enc_file, 1)
+    size = CHUNK_SIZE + TAG_SIZE
+    data[first:first + size], data[second:second + size] = data[second:second + size], data[first:first + size]
+    enc_file.write_bytes(bytes(data))
+    with pytest.raises(InvalidTag):
+        decrypt(enc_file, private_key)
+
+
+def test_tampered_chunk_rejected(enc_file, private_key):
+    data = bytearray(enc_file.read_bytes())
+    data[chunk_offset(enc_file, 2) + 5] ^= 1
+    enc_file.write_bytes(bytes(data))
+    with pytest.raises(InvalidTag):
+        decrypt(enc_file, private_key)
+
+
+def test_trailing_data_rejected(enc_file, private_key):
+    with open(enc_file, "ab") as f:
+        f.write(b"x")
+    with pytest.raises(InvalidEncFile):
+        check_enc_file(enc_file)
+    with pytest.raises(InvalidEncFile):
+        decrypt(enc_file, private_key)
+
+
+def test_v1_auto_detected(tmp_path, private_key, plaintext):
+    # The single-shot layout written by older data owners
+    aes_key = AESGCM.generate_key(bit_length=256)
+    nonce = os.urandom(12)
+    wrapped_key = private_key.public_key().encrypt(aes_key, OAEP_PADDING)
+    path = tmp_path / "legacy.enc"
+    path.write_bytes(
+        len(wrapped_key).to_bytes(2, "big") + wrapped_key + nonce
+        + AESGCM(aes_key).encrypt(nonce, plaintext, None)
+    )
+    assert load_header(path).version == ENC_V1
+    assert decrypt(path, private_key) == plaintext
+    with open_decrypted(path, aes_key) as f:
+        assert f.read() == plaintext
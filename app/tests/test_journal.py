@@ -0,0 +1,136 @@
+import sqlite3
+
+import pytest
+import yaml
+
+from journal import DONE, FINISHING, LAUNCH, LAUNCHING, RUNNING, STARTED, JobJournal
+
+CONFIG = yaml.safe_dump({"code": {"entrypoint": "main.py"}, "data": [], "output": ["owner@x.org"]})
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = JobJournal(tmp_path / "jobs.db")
+    yield journal
+    journal.close()
+
+
+def test_transition_keeps_other_columns(journal):
+    journal.transition("p1", LAUNCH, submitter="a@x.org", priority=2)
+    journal.transition("p1", RUNNING, launched_at=10.0)
+    row = journal.get("p1")
+    assert (row["state"], row["submitter"], row["priority"], row["launched_at"]) == (RUNNING, "a@x.org", 2, 10.0)
+    assert journal.increment_attempts("p1") == 1
+
+
+def test_jobs_in_launch_order(journal):
+    journal.transition("b", RUNNING, launched_at=1.0)
+    journal.transition("a", RUNNING, launched_at=2.0)
+    journal.transition("c", DONE, launched_at=0.0)
+    assert journal.names(RUNNING) == ["b", "a"]
+    assert journal.counts() == {RUNNING: 2, DONE: 1}
+
+
+def test_sync_launch_forgets_withdrawn_projects(journal):
+    journal.transition("kept", LAUNCH)
+    journal.transition("withdrawn", LAUNCH)
+    journal.set_datasets("withdrawn", [("d1", "alice", "/data/d1.enc", False)])
+    journal.sync_launch(["kept"])
+    assert journal.names(LAUNCH) == ["kept"]
+    assert journal.datasets("withdrawn") == []
+
+
+def test_migrates_older_journals(tmp_path):
+    # The jobs table of the first journal version
+    conn = sqlite3.connect(tmp_path / "jobs.db")
+    conn.execute(
+        "CREATE TABLE jobs (name TEXT PRIMARY KEY, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+        "submitted_at REAL, launched_at REAL, started_at REAL, finished_at REAL, exit_code INTEGER, "
+        "failure TEXT, updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO jobs (name, state, updated_at) VALUES ('p1', 'done', 1.0)")
+    conn.commit()
+    conn.close()
+    journal = JobJournal(tmp_path / "jobs.db")
+    row = journal.get("p1")
+    assert row["priority"] == 0 and row["fingerprint"] is None
+    journal.close()
+
+
+class Client:
+    def __init__(self, root):
+        self.root = root
+
+    def app_data(self, name, datasite=None):
+        return self.root / "app"
+
+
+@pytest.fixture
+def main():
+    pytest.importorskip("syft_core")
+    import main
+    return main
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    jobs = tmp_path / "app" / "jobs"
+    for kind in ("launch", "running", "done"):
+        (jobs / kind).mkdir(parents=True)
+    return jobs
+
+
+def add_folder(jobs, kind: str, name: str):
+    folder = jobs / kind / name
+    folder.mkdir()
+    (folder / "config.yaml").write_text(CONFIG)
+    return folder
+
+
+def test_recovery_rolls_back_interrupted_launches(tmp_path, main, jobs, journal):
+    add_folder(jobs, "launch", "p1")
+    add_folder(jobs, "running", "p1")
+    journal.transition("p1", LAUNCHING)
+    main.recover_jobs(Client(tmp_path), journal)
+    assert not (jobs / "running" / "p1").exists()
+    assert journal.get("p1")["state"] == LAUNCH
+
+
+def test_recovery_completes_interrupted_moves_to_done(tmp_path, main, jobs, journal):
+    add_folder(jobs, "running", "p1")
+    journal.transition("p1", FINISHING, exit_code=0)
+    main.recover_jobs(Client(tmp_path), journal)
+    layout = main.get_jobs_layout(Client(tmp_path))
+    assert (layout.done_dir("p1") / "p1" / "config.yaml").exists()
+    assert journal.get("p1")["state"] == DONE
+    assert journal.get("p1")["exit_code"] == 0
+
+
+def test_recovery_requeues_interrupted_jobs(tmp_path, main, jobs, journal):
+    add_folder(jobs, "running", "again")
+    journal.transition("again", STARTED, attempts=1)
+    add_folder(jobs, "running", "crashing")
+    journal.transition("crashing", STARTED, attempts=main.JOB_MAX_ATTEMPTS)
+    main.recover_jobs(Client(tmp_path), journal)
+
+    assert journal.get("again")["state"] == RUNNING
+    row = journal.get("crashing")
+    assert row["state"] == DONE
+    assert row["failure"] == f"interrupted {main.JOB_MAX_ATTEMPTS} times, not started again"
+    layout = main.get_jobs_layout(Client(tmp_path))
+    assert "not started again" in (layout.done_dir("crashing") / "crashing" / "execution.log").read_text()
+
+
+def test_recovery_adds_unknown_folders_and_forgets_removed_ones(tmp_path, main, jobs, journal):
+    add_folder(jobs, "launch", "new")
+    add_folder(jobs, "running", "old_version")
+    journal.transition("removed", RUNNING)
+    main.recover_jobs(Client(tmp_path), journal)
+    assert journal.get("new")["state"] == LAUNCH
+    assert journal.get("old_version")["state"] == RUNNING
+    assert journal.get("removed") is None
+
+    # Running it again changes nothing
+    before = {row["name"]: row["state"] for row in journal.jobs(LAUNCH, RUNNING)}
+    main.recover_jobs(Client(tmp_path), journal)
+    assert {row["name"]: row["state"] for row in journal.jobs(LAUNCH, RUNNING)} == before
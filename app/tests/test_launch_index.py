@@ -0,0 +1,174 @@
+import os
+
+import pytest
+import yaml
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from encryption import encrypt_file
+from launch_index import LaunchIndex
+from spec import JobSpec
+
+
+@pytest.fixture(scope="module")
+def public_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    path = tmp_path / "datasites" / "alice" / "private"
+    path.mkdir(parents=True)
+    return path
+
+
+@pytest.fixture
+def index(tmp_path, data_dir):
+    launch_dir = tmp_path / "launch"
+    launch_dir.mkdir()
+    loads = []
+
+    def load_project(config_file_path):
+        loads.append(config_file_path.parent.name)
+        spec = JobSpec.from_yaml(config_file_path.read_text())
+        return spec, [data_dir / f"{dataset_id}.enc" for _, dataset_id in spec.data], spec.data
+
+    index = LaunchIndex(launch_dir, load_project)
+    index.loads = loads
+    return index
+
+
+def add_project(index, name: str, datasets=("d1",), text: str = None):
+    folder = index.launch_dir / name
+    folder.mkdir()
+    (folder / "config.yaml").write_text(text if text is not None else yaml.safe_dump({
+        "code": {"entrypoint": "main.py"},
+        "data": [["alice", dataset_id] for dataset_id in datasets],
+        "output": ["alice"],
+    }))
+    return folder
+
+
+def add_dataset(tmp_path, public_key, data_dir, dataset_id: str):
+    src = tmp_path / f"{dataset_id}.zip"
+    src.write_bytes(b"plaintext")
+    encrypt_file(src, data_dir / f"{dataset_id}.enc", public_key)
+
+
+def bump(path):
+    # Directory mtimes may not change within a clock tick
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def names(projects):
+    return sorted(project.name for project in projects)
+
+
+def test_config_is_parsed_once(tmp_path, public_key, data_dir, index):
+    add_dataset(tmp_path, public_key, data_dir, "d1")
+    add_project(index, "p1")
+    assert names(index.refresh()) == ["p1"]
+    assert not index.projects["p1"].missing
+    # Nothing changed, nothing to re-evaluate
+    assert index.refresh() == []
+    assert index.loads == ["p1"]
+
+
+def test_changed_config_is_parsed_again(index):
+    folder = add_project(index, "p1")
+    index.refresh()
+    (folder / "config.yaml").write_text((folder / "config.yaml").read_text() + "priority: 2\n")
+    assert names(index.refresh({folder})) == ["p1"]
+    assert index.projects["p1"].spec.priority == 2
+    assert index.loads == ["p1", "p1"]
+
+
+def test_only_changed_directories_are_checked(index):
+    index.refresh()
+    add_project(index, "p1")
+    bump(index.launch_dir)
+    # Events elsewhere don't reveal the new folder
+    assert index.refresh({index.launch_dir.parent / "other"}) == []
+    assert names(index.refresh({index.launch_dir})) == ["p1"]
+
+
+def test_config_not_written_yet(index):
+    folder = add_project(index, "p1", text="")
+    assert index.refresh() == []
+    assert index.projects["p1"].error == "config.yaml not found"
+    assert not index.invalid
+    (folder / "config.yaml").write_text(yaml.safe_dump({
+        "code": {"entrypoint": "main.py"}, "data": [], "output": ["alice"],
+    }))
+    assert names(index.refresh({folder})) == ["p1"]
+
+
+def test_invalid_config(index):
+    folder = add_project(index, "p1", text="code: {entrypoint: ../main.py}\ndata: []\noutput: []\n")
+    assert index.refresh() == []
+    assert index.invalid == {"p1"}
+    assert "entrypoint" in index.projects["p1"].error
+    # Fixed by the client
+    (folder / "config.yaml").write_text("code: {entrypoint: main.py}\ndata: []\noutput: []\n")
+    assert names(index.refresh({folder})) == ["p1"]
+    assert not index.invalid
+
+
+def test_removed_folders_leave_the_index(index):
+    add_project(index, "p1")
+    index.refresh()
+    (index.launch_dir / "p1" / "config.yaml").unlink()
+    (index.launch_dir / "p1").rmdir()
+    bump(index.launch_dir)
+    index.refresh({index.launch_dir})
+    assert index.projects == {}
+    assert index.waiting == {}
+
+
+def test_waits_for_missing_datasets(tmp_path, public_key, data_dir, index):
+    add_project(index, "p1", datasets=("d1", "d2"))
+    add_project(index, "p2", datasets=("d1",))
+    index.refresh()
+    assert index.waiting == {data_dir: {data_dir / "d1.enc": {"p1", "p2"}, data_dir / "d2.enc": {"p1"}}}
+
+    add_dataset(tmp_path, public_key, data_dir, "d1")
+    # Events under an ancestor of the data dir count too
+    assert names(index.refresh({data_dir.parent})) == ["p1", "p2"]
+    assert index.waiting == {data_dir: {data_dir / "d2.enc": {"p1"}}}
+    assert index.projects["p1"].missing == [data_dir / "d2.enc"]
+    assert index.projects["p2"].found_ids == {"d1"}
+
+
+def test_waiting_stops_with_the_project(index, data_dir):
+    add_project(index, "p1", datasets=("d1",))
+    add_project(index, "p2", datasets=("d1",))
+    index.refresh()
+    index.remove("p1")
+    assert index.waiting == {data_dir: {data_dir / "d1.enc": {"p2"}}}
+    index.remove("p2")
+    assert index.waiting == {}
+
+
+def test_incomplete_datasets_are_waited_for(tmp_path, public_key, data_dir, index):
+    add_dataset(tmp_path, public_key, data_dir, "d1")
+    enc_path = data_dir / "d1.enc"
+    complete = enc_path.read_bytes()
+    # Still syncing
+    enc_path.write_bytes(complete[:-10])
+    add_project(index, "p1")
+    index.refresh()
+    assert index.projects["p1"].missing == [enc_path]
+    assert index.projects["p1"].incomplete[enc_path].startswith("Size mismatch")
+    enc_path.write_bytes(complete)
+    assert names(index.refresh({data_dir})) == ["p1"]
+    assert not index.projects["p1"].missing
+    assert index.projects["p1"].incomplete == {}
+
+
+def test_recheck_catches_replaced_datasets(tmp_path, public_key, data_dir, index):
+    add_dataset(tmp_path, public_key, data_dir, "d1")
+    add_project(index, "p1")
+    project = index.refresh()[0]
+    (data_dir / "d1.enc").write_bytes(b"partial")
+    assert not index.recheck(project)
+    assert index.waiting == {data_dir: {data_dir / "d1.enc": {"p1"}}}
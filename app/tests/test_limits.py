@@ -0,0 +1,95 @@
+import resource
+import signal
+import subprocess
+import sys
+
+import pytest
+
+from forkserver import apply_limits
+from limits import JobLimits, failure_reason, job_rlimits
+
+
+def test_success():
+    assert failure_reason(0, JobLimits(cpu_seconds=10), {}) is None
+
+
+def test_exit_code():
+    assert failure_reason(3, JobLimits(), {}) == "exited with code 3"
+
+
+def test_recorded_failure_wins():
+    context = {"failure": "wall time limit of 5s exceeded"}
+    assert failure_reason(-signal.SIGKILL, JobLimits(), context) == "wall time limit of 5s exceeded"
+
+
+def test_sigxcpu_blames_cpu_limit():
+    assert failure_reason(-signal.SIGXCPU, JobLimits(cpu_seconds=10), {}) == "CPU time limit of 10s exceeded"
+
+
+def test_sigkill_blames_cpu_limit_only_when_used():
+    limits = JobLimits(cpu_seconds=10)
+    used = {"user_cpu_seconds": 9.5, "system_cpu_seconds": 0.6}
+    idle = {"user_cpu_seconds": 0.1, "system_cpu_seconds": 0.0}
+    assert failure_reason(-signal.SIGKILL, limits, {}, used) == "CPU time limit of 10s exceeded"
+    assert failure_reason(-signal.SIGKILL, limits, {}, idle) == "killed by SIGKILL"
+    assert failure_reason(-signal.SIGKILL, limits, {}) == "killed by SIGKILL"
+
+
+def test_sigkill_without_cpu_limit():
+    assert failure_reason(-signal.SIGKILL, JobLimits(cpu_seconds=0), {}) == "killed by SIGKILL"
+
+
+def test_realtime_signal():
+    signum = signal.SIGRTMIN + 6
+    assert failure_reason(-signum, JobLimits(), {}) == f"killed by signal {signum}"
+
+
+def test_spec_limits_capped_by_enclave():
+    class Spec:
+        limits = {"cpu_seconds": 100, "open_files": 64}
+
+    limits = JobLimits.from_spec(Spec())
+    default = JobLimits()
+    # A project can lower a limit but not raise it, 0 means unlimited
+    assert limits.cpu_seconds == (min(100, default.cpu_seconds) if default.cpu_seconds else 100)
+    assert limits.open_files == (min(64, default.open_files) if default.open_files else 64)
+    assert limits.memory_mb == default.memory_mb
+
+
+def test_project_wall_time_without_an_enclave_limit(monkeypatch):
+    # Unlimited by default, so a project's own limit is taken as is
+    monkeypatch.setattr(JobLimits, "wall_time_seconds", 0)
+
+    class Spec:
+        limits = {"wall_time_seconds": 60}
+
+    assert JobLimits.from_spec(Spec()).wall_time_seconds == 60
+
+
+def test_job_rlimits():
+    rlimits = {rlimit: (soft, hard) for rlimit, soft, hard in job_rlimits(
+        JobLimits(cpu_seconds=10, memory_mb=64, address_space_mb=0, open_files=32),
+        use_address_space_for_memory=True,
+    )}
+    assert rlimits[resource.RLIMIT_CPU][0] <= 10
+    assert rlimits[resource.RLIMIT_AS][0] <= 64 * 1024 * 1024
+    assert rlimits[resource.RLIMIT_NOFILE][0] <= 32
+    # With a cgroup the memory limit is not an address space limit
+    without_as = job_rlimits(JobLimits(memory_mb=64, address_space_mb=0))
+    assert resource.RLIMIT_AS not in [rlimit for rlimit, _, _ in without_as]
+
+
+def test_limits_apply_before_the_code_runs():
+    rlimits = job_rlimits(JobLimits(cpu_seconds=10, memory_mb=0, address_space_mb=0, open_files=32))
+    # The job's own children inherit them as well
+    code = (
+        "import resource, subprocess, sys;"
+        "print(resource.getrlimit(resource.RLIMIT_NOFILE)[0]);"
+        "subprocess.run([sys.executable, '-c', 'import resource; print(resource.getrlimit(resource.RLIMIT_CPU)[0])'])"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True,
+        preexec_fn=lambda: apply_limits(rlimits),
+    ).stdout.split()
+    assert int(output[0]) <= 32
+    assert int(output[1]) <= 10
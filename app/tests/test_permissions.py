@@ -0,0 +1,95 @@
+import shutil
+
+import pytest
+import yaml
+
+from permissions import PERMISSION_FILE, PermissionManager
+
+
+def rules(folder):
+    return yaml.safe_load((folder / PERMISSION_FILE).read_text())["rules"]
+
+
+def test_rules_for_a_folder_are_merged_into_one_write(tmp_path):
+    manager = PermissionManager()
+    manager.add_rule(tmp_path, "**", read=["a@x.org"], write=[])
+    manager.add_rule(tmp_path, "**", read=["b@x.org", "a@x.org"], write=["a@x.org"])
+    manager.add_rule(tmp_path, "*.csv", read=["c@x.org"], write=[])
+    assert manager.flush() == 1
+    assert rules(tmp_path) == [
+        {"pattern": "**", "access": {"read": ["a@x.org", "b@x.org"], "write": ["a@x.org"]}},
+        {"pattern": "*.csv", "access": {"read": ["c@x.org"], "write": []}},
+    ]
+
+
+def test_existing_rules_are_kept(tmp_path):
+    (tmp_path / PERMISSION_FILE).write_text(yaml.safe_dump({
+        "rules": [{"pattern": "**", "access": {"read": ["a@x.org"], "write": []}}],
+    }))
+    manager = PermissionManager()
+    manager.add_rule(tmp_path, "**", read=["b@x.org"], write=[])
+    manager.flush()
+    assert rules(tmp_path)[0]["access"]["read"] == ["a@x.org", "b@x.org"]
+
+
+def test_unchanged_rules_are_not_rewritten(tmp_path):
+    manager = PermissionManager()
+    manager.add_rule(tmp_path, "**", read=["a@x.org"], write=[])
+    assert manager.flush() == 1
+    manager.add_rule(tmp_path, "**", read=["a@x.org"], write=[])
+    assert manager.flush() == 0
+    assert manager.flush() == 0
+
+
+def test_cached_rules_are_not_shared(tmp_path):
+    manager = PermissionManager()
+    manager.add_rule(tmp_path, "**", read=["a@x.org"], write=[])
+    manager.flush()
+    # Served from the cache, changing it must not change the cache
+    manager._load(tmp_path / PERMISSION_FILE)["rules"].clear()
+    manager.add_rule(tmp_path, "**", read=["a@x.org"], write=[])
+    assert manager.flush() == 0
+    assert len(rules(tmp_path)) == 1
+
+
+def test_folders_gone_before_the_flush_are_skipped(tmp_path):
+    folder = tmp_path / "moved"
+    folder.mkdir()
+    manager = PermissionManager()
+    manager.add_rule(folder, "**", read=["a@x.org"], write=[])
+    shutil.rmtree(folder)
+    assert manager.flush() == 0
+
+
+def test_rules_need_a_directory(tmp_path):
+    with pytest.raises(ValueError):
+        PermissionManager().add_rule(tmp_path / "missing", "**", read=[], write=[])
+
+
+def test_done_permissions_are_written_before_the_move(tmp_path, monkeypatch):
+    pytest.importorskip("syft_core")
+    import main
+    from journal import DONE, JobJournal
+
+    class Client:
+        def app_data(self, name, datasite=None):
+            return tmp_path / "app"
+
+    running = tmp_path / "app" / "jobs" / "running" / "p1"
+    running.mkdir(parents=True)
+    done_dir = main.get_jobs_layout(Client()).done_dir("p1")
+    moves = []
+    real_move = shutil.move
+
+    def move(src, dst):
+        # A crash right after the move must not lose the rules
+        moves.append((dst / PERMISSION_FILE).exists())
+        return real_move(src, dst)
+
+    monkeypatch.setattr(main.shutil, "move", move)
+    journal = JobJournal(tmp_path / "jobs.db")
+    main.move_to_done(Client(), running, ["owner@x.org"], journal)
+    assert moves == [True]
+    assert rules(done_dir)[0]["access"]["read"] == ["owner@x.org"]
+    assert journal.get("p1")["state"] == DONE
+    journal.close()
@@ -0,0 +1,93 @@
+import os
+
+from plaintext import PlaintextStore
+
+MiB = 1024 * 1024
+
+
+def make_store(tmp_path, **kwargs):
+    return PlaintextStore(tmp_path / "plaintext", memory_root=tmp_path / "shm", **kwargs)
+
+
+def test_stages_in_memory_while_it_fits(tmp_path):
+    store = make_store(tmp_path, memory_limit=10 * MiB)
+    assert store.stage("a", 6 * MiB) == tmp_path / "shm" / "a"
+    # The reservation of "a" counts until record() measures it
+    assert store.stage("b", 6 * MiB) == tmp_path / "plaintext" / "b"
+    assert store.in_memory == {"a"}
+    assert store.stats["memory_fallbacks"] == 1
+
+
+def test_measured_size_frees_the_reservation(tmp_path):
+    store = make_store(tmp_path, memory_limit=10 * MiB)
+    path = store.stage("a", 8 * MiB)
+    (path / "data.csv").write_bytes(b"x" * MiB)
+    store.record("a")
+    assert store.memory_used == MiB
+    assert store.stage("b", 8 * MiB).parent == tmp_path / "shm"
+
+
+def test_falls_back_to_disk(tmp_path):
+    store = make_store(tmp_path, memory_limit=10 * MiB)
+    path = store.stage("a", MiB)
+    (path / "partial.csv").write_bytes(b"x")
+    # Staging again without memory, e.g. after ENOSPC on the tmpfs
+    assert store.stage("a", MiB, memory=False) == tmp_path / "plaintext" / "a"
+    assert not (tmp_path / "shm" / "a").exists()
+    assert store.in_memory == set()
+
+
+def test_memory_staging_skips_the_disk_quota(tmp_path):
+    store = make_store(tmp_path, memory_limit=10 * MiB, quota=MiB)
+    assert store.admit("a", 5 * MiB, idle=False)
+    assert not store.admit("b", 20 * MiB, idle=False)
+
+
+def test_quota_holds_back_projects(tmp_path):
+    store = PlaintextStore(tmp_path / "plaintext", quota=10 * MiB)
+    store.stage("a", 6 * MiB)
+    assert store.admit("a", 6 * MiB, idle=False)
+    assert not store.admit("b", 6 * MiB, idle=False)
+    assert store.stats["held_back"] == 1
+    # Counted once, not on every pass
+    store.admit("b", 6 * MiB, idle=False)
+    assert store.stats["held_back"] == 1
+    # An idle enclave starts it anyway
+    assert store.admit("b", 6 * MiB, idle=True)
+
+
+def test_shared_usage_counts(tmp_path):
+    store = PlaintextStore(tmp_path / "plaintext", quota=10 * MiB, shared_usage=lambda: 8 * MiB)
+    assert not store.admit("a", 4 * MiB, idle=False)
+
+
+def test_removing_frees_the_quota(tmp_path):
+    store = PlaintextStore(tmp_path / "plaintext", quota=10 * MiB)
+    path = store.stage("a", 8 * MiB)
+    (path / "data.csv").write_bytes(b"x" * 100)
+    store.record("a")
+    assert store.remove("a") == 100
+    assert not path.exists()
+    assert store.admit("b", 8 * MiB, idle=False)
+
+
+def test_sweep_removes_orphans(tmp_path):
+    root = tmp_path / "plaintext"
+    (root / "crashed").mkdir(parents=True)
+    (root / "crashed" / "data.csv").write_bytes(b"x" * 10)
+    (root / "running").mkdir()
+    store = PlaintextStore(root)
+    assert store.usage == {"crashed": 10, "running": 0}
+    assert store.sweep({"running"}, force=True) == 10
+    assert sorted(os.listdir(root)) == ["running"]
+    assert store.stats["orphans_removed"] == 1
+
+
+def test_planted_symlinks_are_replaced(tmp_path):
+    target = tmp_path / "elsewhere"
+    target.mkdir()
+    root = tmp_path / "plaintext"
+    root.mkdir()
+    (root / "a").symlink_to(target)
+    path = PlaintextStore(root).stage("a", 0)
+    assert path.is_dir() and not path.is_symlink()
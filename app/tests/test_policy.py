@@ -0,0 +1,79 @@
+import yaml
+
+from policy import UNKNOWN_SUBMITTER, FairSharePolicy, QueueStatus, project_submitter
+from spec import JobSpec
+
+NOW = 1_000_000.0
+
+
+def row(name: str, submitter: str = "a", priority: int = 0, launched_at: float = NOW, finished_at=None):
+    return {
+        "name": name,
+        "submitter": submitter,
+        "priority": priority,
+        "launched_at": launched_at,
+        "finished_at": finished_at,
+    }
+
+
+def order(waiting, usage=None, **kwargs):
+    policy = FairSharePolicy(**{"aging_seconds": 60, "half_life": 600, "max_priority": 5, **kwargs})
+    return [decision.name for decision in policy.order(waiting, usage or {}, now=NOW)]
+
+
+def test_submitters_take_turns():
+    waiting = [row("a1", "a"), row("a2", "a"), row("a3", "a"), row("b1", "b")]
+    assert order(waiting) == ["a1", "b1", "a2", "a3"]
+
+
+def test_busy_submitters_go_last():
+    waiting = [row("a1", "a"), row("b1", "b")]
+    assert order(waiting, {"a": 2.0}) == ["b1", "a1"]
+
+
+def test_priority_is_clamped():
+    waiting = [row("low", "a", priority=-100), row("high", "b", priority=100), row("plain", "c")]
+    policy = FairSharePolicy(aging_seconds=60, half_life=600, max_priority=5)
+    decisions = policy.order(waiting, {}, now=NOW)
+    assert [d.name for d in decisions] == ["high", "plain", "low"]
+    assert [d.priority for d in decisions] == [5, 0, -5]
+
+
+def test_waiting_projects_age_past_higher_priorities():
+    waiting = [row("urgent", "a", priority=2, launched_at=NOW), row("old", "b", launched_at=NOW - 180)]
+    assert order(waiting) == ["old", "urgent"]
+
+
+def test_ties_go_by_launch_time_then_name():
+    waiting = [row("b", "x"), row("a", "y"), row("c", "z", launched_at=NOW - 1)]
+    assert order(waiting, aging_seconds=10**9) == ["c", "a", "b"]
+
+
+def test_usage_decays():
+    policy = FairSharePolicy(half_life=600)
+    usage = policy.usage([
+        row("running", "a"),
+        row("recent", "a", finished_at=NOW),
+        row("older", "b", finished_at=NOW - 600),
+        row("unknown", None, finished_at=NOW - 1200),
+    ], now=NOW)
+    assert usage == {"a": 2.0, "b": 0.5, UNKNOWN_SUBMITTER: 0.25}
+
+
+def test_submitter_falls_back_to_the_first_owner():
+    spec = JobSpec(code={"entrypoint": "main.py"}, data=[], output=["owner@x.org", "other@x.org"])
+    assert project_submitter(spec) == "owner@x.org"
+    assert project_submitter(spec.model_copy(update={"submitter": "me@x.org"})) == "me@x.org"
+    assert project_submitter(None) is None
+
+
+def test_queue_status_is_written_when_the_order_changes(tmp_path):
+    path = tmp_path / "queue.yaml"
+    status = QueueStatus(path)
+    policy = FairSharePolicy()
+    decisions = policy.order([row("a1", "a"), row("b1", "b")], {}, now=NOW)
+    status.update(decisions, {"a": 1.0})
+    assert [entry["name"] for entry in yaml.safe_load(path.read_text())["queue"]] == ["a1", "b1"]
+    path.unlink()
+    status.update(decisions, {"a": 1.0})
+    assert not path.exists()
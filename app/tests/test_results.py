@@ -0,0 +1,165 @@
+import json
+import os
+import time
+
+import pytest
+
+from results import RESULT_FILE, ResultCache, job_fingerprint
+
+
+@pytest.fixture
+def code_dir(tmp_path):
+    code_dir = tmp_path / "code"
+    (code_dir / "lib").mkdir(parents=True)
+    (code_dir / "main.py").write_text("print(1)")
+    (code_dir / "lib" / "util.py").write_text("X = 1")
+    return code_dir
+
+
+def fingerprint(code_dir, entrypoint="main.py", datasets=(("d1", "k1"),), owners=("a", "b"), runtime="3.12"):
+    return job_fingerprint(code_dir, entrypoint, datasets, owners, runtime)
+
+
+def test_fingerprint_is_stable(code_dir):
+    assert fingerprint(code_dir) == fingerprint(code_dir, owners=("b", "a"))
+
+
+@pytest.mark.parametrize("change", [
+    {"entrypoint": "lib/util.py"},
+    {"datasets": (("d1", "k2"),)},
+    {"datasets": (("d2", "k1"),)},
+    {"owners": ("a",)},
+    {"runtime": "3.13"},
+])
+def test_fingerprint_changes_with_the_job(code_dir, change):
+    assert fingerprint(code_dir, **change) != fingerprint(code_dir)
+
+
+def test_fingerprint_changes_with_the_code(code_dir):
+    before = fingerprint(code_dir)
+    (code_dir / "lib" / "util.py").write_text("X = 2")
+    assert fingerprint(code_dir) != before
+    (code_dir / "lib" / "util.py").rename(code_dir / "util.py")
+    assert fingerprint(code_dir) != before
+
+
+def make_output(tmp_path, name: str = "p1"):
+    output_dir = tmp_path / "outputs" / name
+    output_dir.mkdir(parents=True)
+    (output_dir / "result.csv").write_text("1,2\n")
+    (output_dir / "syft.pub.yaml").write_text("rules: []\n")
+    log_path = tmp_path / f"{name}.log"
+    log_path.write_text("ran\n")
+    return output_dir, log_path
+
+
+def test_stores_and_publishes_results(tmp_path):
+    cache = ResultCache(tmp_path / "cache", budget=10**6)
+    output_dir, log_path = make_output(tmp_path)
+    cache.store("f1", "p1", output_dir, log_path)
+    assert cache.lookup("f1")["project"] == "p1"
+
+    target = tmp_path / "outputs" / "p2"
+    target.mkdir()
+    cache.publish("f1", target, tmp_path / "p2.log")
+    assert (target / "result.csv").read_text() == "1,2\n"
+    # The permissions of the output it came from are not copied
+    assert not (target / "syft.pub.yaml").exists()
+    assert (tmp_path / "p2.log").read_text() == "ran\n"
+
+
+def test_expired_results_are_not_reused(tmp_path):
+    cache = ResultCache(tmp_path / "cache", budget=10**6, retention_days=1)
+    cache.store("f1", "p1", *make_output(tmp_path))
+    result_file = cache.root / "f1" / RESULT_FILE
+    result_file.write_text(json.dumps({"project": "p1", "stored_at": time.time() - 2 * 24 * 3600}))
+    assert cache.lookup("f1") is None
+    assert not (cache.root / "f1").exists()
+
+
+def test_damaged_results_are_dropped(tmp_path):
+    cache = ResultCache(tmp_path / "cache", budget=10**6)
+    cache.store("f1", "p1", *make_output(tmp_path))
+    (cache.root / "f1" / RESULT_FILE).write_text("{")
+    assert cache.lookup("f1") is None
+    assert "f1" not in cache.entries
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path / "cache", budget=10**6)
+    for name in ("p1", "p2", "p3"):
+        cache.store(name, name, *make_output(tmp_path, name))
+    cache.lookup("p1")
+    # All three are the same size, two of them fit
+    cache.budget = 2 * cache.entries["p1"]
+    cache._evict()
+    assert list(cache.entries) == ["p3", "p1"]
+    assert not (cache.root / "p2").exists()
+
+
+def test_interrupted_stores_are_cleaned_up(tmp_path):
+    cache = ResultCache(tmp_path / "cache", budget=10**6)
+    cache.store("f1", "p1", *make_output(tmp_path))
+    (cache.root / ".staging-f2-abc").mkdir()
+    (cache.root / "f3").mkdir()
+    reloaded = ResultCache(tmp_path / "cache", budget=10**6)
+    assert list(reloaded.entries) == ["f1"]
+    assert sorted(os.listdir(reloaded.root)) == ["f1"]
+
+
+def test_disabled(tmp_path):
+    cache = ResultCache(tmp_path / "cache", budget=0)
+    cache.store("f1", "p1", *make_output(tmp_path))
+    assert cache.lookup("f1") is None
+    assert not (tmp_path / "cache").exists()
+
+
+class Client:
+    email = "enclave@x.org"
+
+    def __init__(self, root):
+        self.root = root
+
+    def app_data(self, name, datasite=None):
+        return self.root / "app"
+
+
+class EnvCache:
+    runtime_version = "3.12"
+
+
+def make_project(tmp_path, name: str, reuse_results: bool = True):
+    folder = tmp_path / "app" / "jobs" / "running" / name
+    (folder / "code").mkdir(parents=True)
+    (folder / "code" / "main.py").write_text("print(1)")
+    (folder / "config.yaml").write_text(json.dumps({
+        "code": {"entrypoint": "main.py"}, "data": [], "output": ["owner@x.org"], "reuse_results": reuse_results,
+    }))
+    return folder
+
+
+@pytest.mark.parametrize("reuse_results", [True, False])
+def test_identical_projects_reuse_results(tmp_path, reuse_results):
+    pytest.importorskip("syft_core")
+    import main
+    from journal import DONE, RUNNING, JobJournal
+
+    client = Client(tmp_path)
+    journal = JobJournal(tmp_path / "jobs.db")
+    cache = ResultCache(tmp_path / "cache", budget=10**6)
+    first = make_project(tmp_path, "first")
+    assert not main.reuse_result(client, first, journal, cache, EnvCache())
+    cache.store(journal.get("first")["fingerprint"], "first", *make_output(tmp_path))
+
+    second = make_project(tmp_path, "second", reuse_results=reuse_results)
+    assert main.reuse_result(client, second, journal, cache, EnvCache()) == reuse_results
+    row = journal.get("second")
+    assert row["fingerprint"] == journal.get("first")["fingerprint"]
+    if reuse_results:
+        layout = main.get_jobs_layout(client)
+        assert row["state"] == DONE and row["exit_code"] == 0
+        assert (layout.output_dir("second") / "result.csv").read_text() == "1,2\n"
+        assert "identical project first was reused" in (layout.done_dir("second") / "second" / "execution.log").read_text()
+    else:
+        assert row["state"] == RUNNING
+    journal.close()
@@ -0,0 +1,28 @@
+import json
+
+from run_stats import RUN_STATS_FILE, STATES, update_run_stats
+
+
+def test_states_and_durations(tmp_path):
+    update_run_stats(tmp_path, states={"submitted": 100.0, "launched": 101.5})
+    stats = update_run_stats(tmp_path, states={"started": 110.0, "finished": 120.0, "done": 121.0}, exit_code=0)
+    assert list(stats["states"]) == ["submitted", "launched", "started", "finished", "done"]
+    assert stats["durations"] == {
+        "launch_wait_seconds": 1.5,
+        "start_wait_seconds": 8.5,
+        "run_seconds": 10.0,
+        "total_seconds": 21.0,
+    }
+    assert json.loads((tmp_path / RUN_STATS_FILE).read_text()) == stats
+
+
+def test_no_staging_states():
+    # Visible to output owners, the staging time would tell cache hits apart
+    assert not any("staging" in state or state == "staged" for state in STATES)
+
+
+def test_unreadable_file_is_replaced(tmp_path):
+    (tmp_path / RUN_STATS_FILE).write_text("{")
+    stats = update_run_stats(tmp_path, failure="x")
+    assert stats["project"] == tmp_path.name
+    assert stats["failure"] == "x"
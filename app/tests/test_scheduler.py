@@ -0,0 +1,100 @@
+import subprocess
+import sys
+import time
+
+from scheduler import Job, JobScheduler
+
+
+def start(tmp_path, code: str, deadline: float = None):
+    def start_job(folder):
+        log_file = open(tmp_path / f"{folder.name}.log", "w")
+        process = subprocess.Popen([sys.executable, "-c", code], stdout=log_file, start_new_session=True)
+        return Job(name=folder.name, folder=folder, process=process, log_file=log_file, deadline=deadline)
+
+    return start_job
+
+
+def wait_until_done(scheduler: JobScheduler, timeout: float = 10):
+    end = time.monotonic() + timeout
+    while scheduler.active and time.monotonic() < end:
+        scheduler.reap()
+        time.sleep(0.02)
+    assert not scheduler.active
+
+
+def test_fills_free_slots_only(tmp_path):
+    scheduler = JobScheduler(start(tmp_path, "import time; time.sleep(0.2)"), lambda job, code: None, slots=2)
+    scheduler.poll(tmp_path / name for name in ("a", "b", "c"))
+    assert sorted(scheduler.active) == ["a", "b"]
+    wait_until_done(scheduler)
+
+
+def test_not_ready_is_offered_again(tmp_path):
+    scheduler = JobScheduler(lambda folder: None, lambda job, code: None, slots=1)
+    scheduler.poll([tmp_path / "a"])
+    assert not scheduler.active
+
+
+def test_held_back_candidates_are_prefetched_in_order(tmp_path):
+    prefetched = []
+    scheduler = JobScheduler(
+        start(tmp_path, "import time; time.sleep(0.2)"),
+        lambda job, code: None,
+        slots=1,
+        can_start=lambda folder, idle: folder.name != "c",
+        prefetch=lambda folder: prefetched.append(folder.name),
+    )
+    scheduler.poll(tmp_path / name for name in ("a", "b", "c", "d"))
+    assert list(scheduler.active) == ["a"]
+    # "c" is held back and "d" waits behind it
+    assert prefetched == ["b"]
+    wait_until_done(scheduler)
+
+
+def test_completes_with_exit_code(tmp_path):
+    finished = {}
+    scheduler = JobScheduler(
+        start(tmp_path, "import sys; sys.exit(3)"),
+        lambda job, code: finished.update({job.name: (code, job.rusage is not None)}),
+    )
+    scheduler.poll([tmp_path / "a"])
+    wait_until_done(scheduler)
+    assert finished == {"a": (3, True)}
+
+
+def test_failed_completion_is_handed_to_fail_job(tmp_path):
+    failed = {}
+
+    def finish_job(job, code):
+        raise OSError("disk full")
+
+    scheduler = JobScheduler(
+        start(tmp_path, "pass"),
+        finish_job,
+        fail_job=lambda job, code, error: failed.update({job.name: (code, error)}),
+    )
+    scheduler.poll([tmp_path / "a"])
+    wait_until_done(scheduler)
+    assert failed == {"a": (0, "could not be completed: disk full")}
+
+
+def test_fail_job_errors_do_not_escape(tmp_path):
+    def broken(*args):
+        raise RuntimeError("broken")
+
+    scheduler = JobScheduler(start(tmp_path, "pass"), broken, fail_job=broken)
+    scheduler.poll([tmp_path / "a"])
+    wait_until_done(scheduler)
+
+
+def test_deadline_kills_job(tmp_path):
+    finished = {}
+    scheduler = JobScheduler(
+        start(tmp_path, "import time; time.sleep(30)", deadline=time.time() + 0.2),
+        lambda job, code: finished.update({job.name: (code, job.context.get("failure"))}),
+    )
+    scheduler.poll([tmp_path / "a"])
+    wait_until_done(scheduler)
+    code, failure = finished["a"]
+    assert code < 0
+    assert failure.startswith("wall time limit")
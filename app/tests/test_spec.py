@@ -0,0 +1,76 @@
+from dataclasses import fields
+from pathlib import Path
+
+import pytest
+
+from limits import JobLimits
+from spec import LIMIT_NAMES, JobSpec, shard, validate_limits, write_yaml_atomic
+
+APP_DIR = Path(__file__).resolve().parents[1]
+
+CONFIG = """
+code:
+  entrypoint: main.py
+data:
+  - [alice@x.org, census]
+output: [alice@x.org]
+limits:
+  cpu_seconds: 60
+"""
+
+
+def test_client_and_enclave_share_the_spec():
+    # The app imports the client package's module, not a copy of it
+    assert (APP_DIR / "spec.py").resolve() == APP_DIR.parent / "src" / "syftbox_enclave" / "spec.py"
+
+
+def test_limit_names_match_job_limits():
+    assert set(LIMIT_NAMES) == {f.name for f in fields(JobLimits)}
+
+
+def test_valid_config():
+    spec = JobSpec.from_yaml(CONFIG + "unknown_key: 1\n")
+    assert spec.code.entrypoint == "main.py"
+    assert spec.data == [("alice@x.org", "census")]
+    assert spec.limits == {"cpu_seconds": 60}
+    assert spec.priority == 0 and spec.reuse_results
+
+
+@pytest.mark.parametrize("text, error", [
+    ("code: [", "Error parsing YAML file"),
+    ("- a\n- b\n", "must be a mapping"),
+    ("output: []\n", "code: Field required"),
+    (CONFIG.replace("main.py", "../main.py"), "entrypoint must be a path inside the code directory"),
+    (CONFIG.replace("main.py", "/main.py"), "entrypoint must be a path inside the code directory"),
+    (CONFIG.replace("census", "../census"), "invalid datasite or dataset id"),
+    (CONFIG.replace("alice@x.org, census", "'.', census"), "invalid datasite or dataset id"),
+    (CONFIG.replace("cpu_seconds", "gpus"), "Unknown limit gpus"),
+    (CONFIG + "priority: high\n", "priority"),
+    (CONFIG + "reuse_results: 1\n", "reuse_results"),
+])
+def test_invalid_config(text, error):
+    with pytest.raises(ValueError, match=error):
+        JobSpec.from_yaml(text)
+
+
+@pytest.mark.parametrize("limits", [[], {"gpus": 1}, {"cpu_seconds": 0}, {"cpu_seconds": True}, {"open_files": "8"}])
+def test_invalid_limits(limits):
+    with pytest.raises(ValueError):
+        validate_limits(limits)
+
+
+def test_shard():
+    # Part of the paths clients read, must never change
+    assert shard("project") == "24"
+    assert all(len(shard(f"p{i}")) == 2 for i in range(100))
+
+
+def test_write_yaml_atomic_keeps_the_mode(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_yaml_atomic(path, {"b": 1, "a": 2})
+    assert path.read_text() == "a: 2\nb: 1\n"
+    assert path.stat().st_mode & 0o777 == 0o644
+    path.chmod(0o600)
+    write_yaml_atomic(path, {"a": 3}, sort_keys=False)
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,70 @@
+import resource
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from warm_pool import WarmPool
+
+JOB = textwrap.dedent("""
+    import atexit
+    import sys
+    import threading
+    import time
+
+    def late():
+        time.sleep(0.2)
+        print("thread done")
+
+    atexit.register(lambda: print("atexit ran"))
+    threading.Thread(target=late).start()
+    sys.stdout.write("buffered, no newline")
+    sys.exit(int(sys.argv[1]))
+""")
+
+
+@pytest.fixture
+def warm_pool():
+    pool = WarmPool(python=sys.executable, preload="")
+    pool.start()
+    assert pool._ready.wait(10)
+    yield pool
+    pool.shutdown()
+
+
+def run_cold(script, tmp_path, code: int):
+    with open(tmp_path / "cold.log", "w") as log_file:
+        returncode = subprocess.run(
+            [sys.executable, str(script), str(code)], stdout=log_file, stderr=subprocess.STDOUT
+        ).returncode
+    return returncode, (tmp_path / "cold.log").read_text()
+
+
+def run_warm(warm_pool, script, tmp_path, code: int):
+    with open(tmp_path / "warm.log", "w") as log_file:
+        process = warm_pool.spawn([sys.executable, str(script), str(code)], {}, log_file, cwd=str(tmp_path))
+        assert process is not None
+        returncode = process.wait(10)
+    return returncode, (tmp_path / "warm.log").read_text()
+
+
+@pytest.mark.parametrize("code", [0, 3])
+def test_warm_job_exits_like_a_fresh_interpreter(warm_pool, tmp_path, code):
+    script = tmp_path / "main.py"
+    script.write_text(JOB)
+    cold = run_cold(script, tmp_path, code)
+    assert cold[0] == code
+    assert "thread done" in cold[1] and "atexit ran" in cold[1]
+    assert run_warm(warm_pool, script, tmp_path, code) == cold
+
+
+def test_warm_job_enters_its_limits(warm_pool, tmp_path):
+    script = tmp_path / "main.py"
+    script.write_text("import resource; print(resource.getrlimit(resource.RLIMIT_NOFILE)[0])")
+    with open(tmp_path / "warm.log", "w") as log_file:
+        process = warm_pool.spawn(
+            [sys.executable, str(script)], {}, log_file, rlimits=[(resource.RLIMIT_NOFILE, 32, 32)]
+        )
+        assert process.wait(10) == 0
+    assert (tmp_path / "warm.log").read_text().strip() == "32"
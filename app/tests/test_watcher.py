@@ -0,0 +1,73 @@
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from watcher import InotifyWatcher, Watcher, create_watcher
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+
+@pytest.fixture
+def watcher():
+    watcher = InotifyWatcher()
+    yield watcher
+    watcher.close()
+
+
+def test_reports_changed_directories(tmp_path, watcher):
+    a, b = tmp_path / "a", tmp_path / "b"
+    a.mkdir()
+    b.mkdir()
+    assert watcher.refresh([a, b, tmp_path / "missing"]) == [a, b]
+    assert watcher.refresh([a, b]) == []
+    (b / "data.enc").write_bytes(b"x")
+    assert watcher.wait(timeout=5) == {b}
+
+
+def test_enclave_writes_do_not_wake(tmp_path, watcher):
+    watcher.refresh([tmp_path])
+    (tmp_path / "syft.pub.yaml").write_text("rules: []\n")
+    (tmp_path / ".config.yaml.abc.tmp").write_text("half")
+    assert watcher.wait(timeout=0.2) is None
+    # The rename completing an atomic write does
+    (tmp_path / ".config.yaml.abc.tmp").rename(tmp_path / "config.yaml")
+    assert watcher.wait(timeout=5) == {tmp_path}
+
+
+def test_moved_directories_are_unwatched(tmp_path, watcher):
+    project = tmp_path / "launch" / "p1"
+    project.mkdir(parents=True)
+    watcher.refresh([project])
+    project.rename(tmp_path / "p1")
+    watcher.wait(timeout=0.2)
+    assert watcher._watches == {}
+    # Watched again once something is at the path
+    project.mkdir()
+    assert watcher.refresh([project]) == [project]
+
+
+def test_wake_from_another_thread(watcher):
+    threading.Timer(0.1, watcher.wake).start()
+    start = time.monotonic()
+    # Nothing changed in the watched directories
+    assert watcher.wait(timeout=5) == set()
+    assert time.monotonic() - start < 4
+
+
+def test_child_exit_wakes(watcher):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    start = time.monotonic()
+    watcher.wait(timeout=5)
+    assert time.monotonic() - start < 4
+    process.wait()
+
+
+def test_watch_modes():
+    watcher = create_watcher("poll")
+    assert type(watcher) is Watcher
+    watcher.close()
+    with pytest.raises(ValueError):
+        create_watcher("fanotify")
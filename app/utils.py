@@ -1,46 +1,129 @@
+import json
+import os
 from pathlib import Path
-import yaml
+import shutil
+import threading
+from collections import OrderedDict
 from io import BytesIO
-from typing import Dict, List, Optional, Union
+from typing import BinaryIO, Dict, List, Optional, Union
 from zipfile import ZipFile
 
+from spec import JobSpec, write_atomic, write_yaml_atomic
+
 PathLike = Union[str, Path]
 
+COPY_BUFSIZE = 1024 * 1024
 
-def validate_config_file(config_file_path: Path) -> bool:
-    """
-    Validates the config.yaml file
-    """
 
-    try:
-        with open(config_file_path, "r") as f:
-            config_file = yaml.safe_load(f)
-    except yaml.YAMLError as e:
-        raise ValueError(f"Error parsing YAML file: {e}")
+# Parsed config.yaml files kept by load_job_spec
+SPEC_CACHE_SIZE = 1024
 
-    required_keys = [
-        "code",
-        "data",
-        "output",
-    ]
+_spec_cache: "OrderedDict[tuple, JobSpec]" = OrderedDict()
+_spec_lock = threading.Lock()
+
+
+def load_job_spec(config_file_path: PathLike) -> JobSpec:
+    """
+    Parses and validates a config.yaml, raising ValueError if it's invalid.
 
-    for key in required_keys:
-        if key not in config_file:
-            raise ValueError(f"Required key {key} is missing in config.yaml")
+    Specs are cached by file identity and version (device, inode, mtime,
+    size), so a project's config is parsed once, and not again when its
+    folder is moved from launch to running.
+    """
+    with open(config_file_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        with _spec_lock:
+            spec = _spec_cache.get(key)
+            if spec is not None:
+                _spec_cache.move_to_end(key)
+                return spec
+        text = f.read().decode()
+    spec = JobSpec.from_yaml(text)
+    with _spec_lock:
+        _spec_cache[key] = spec
+        while len(_spec_cache) > SPEC_CACHE_SIZE:
+            _spec_cache.popitem(last=False)
+    return spec
+
+
+
+def write_json_atomic(path: PathLike, data) -> None:
+    """
+    Writes data as indented JSON, atomically like write_yaml_atomic.
+    """
+    write_atomic(path, lambda f: json.dump(data, f, indent=2))
 
-    return True
 
+def write_text_atomic(path: PathLike, text: str) -> None:
+    """
+    Writes text atomically like write_yaml_atomic.
+    """
+    write_atomic(path, lambda f: f.write(text))
 
 
-def extract_zip(zip_data: bytes, target_dir: PathLike) -> None:
+def extract_zip(zip_data: Union[bytes, BinaryIO], target_dir: PathLike) -> None:
     """Extract zip data to a target directory.
 
     Args:
-        zip_data: Bytes containing zip content
+        zip_data: Bytes containing zip content, or a seekable binary file object
         target_dir: Directory to extract files to
     """
-    with ZipFile(BytesIO(zip_data)) as z:
-        z.extractall(str(target_dir))
+    if isinstance(zip_data, (bytes, bytearray)):
+        zip_data = BytesIO(zip_data)
+    target_dir = Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with ZipFile(zip_data) as z:
+        # Extract member by member so nothing larger than a copy buffer
+        # is held in memory
+        for info in z.infolist():
+            member_path = safe_member_path(target_dir, info.filename)
+            if info.is_dir():
+                member_path.mkdir(parents=True, exist_ok=True)
+                continue
+            member_path.parent.mkdir(parents=True, exist_ok=True)
+            with z.open(info) as src, open(member_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+
+
+def zip_extracted_size(zip_data: BinaryIO) -> int:
+    """
+    Total uncompressed size of the members of a zip file, read from its
+    central directory without extracting anything. Extraction never
+    writes more than that, zipfile stops each member at its file_size.
+    """
+    with ZipFile(zip_data) as z:
+        return sum(info.file_size for info in z.infolist())
+
+
+def safe_member_path(target_dir: Path, member_name: str) -> Path:
+    """
+    Resolves a zip member name inside target_dir.
+    Raises ValueError for absolute paths or paths escaping target_dir (zip slip).
+    """
+    root = target_dir.resolve()
+    member_path = (root / member_name).resolve()
+    if member_path == root or not member_path.is_relative_to(root):
+        raise ValueError(f"Unsafe path in zip archive: {member_name!r}")
+    return member_path
+
+
+def directory_size(path: PathLike, include_hardlinked: bool = True) -> int:
+    """
+    Total size in bytes of the files under path (0 if it does not exist).
+    With include_hardlinked=False, files with other hardlinks are skipped,
+    which gives the space that removing the directory would free.
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                continue
+            if include_hardlinked or st.st_nlink == 1:
+                total += st.st_size
+    return total
 
 
 def zip_to_bytes(
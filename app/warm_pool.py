@@ -0,0 +1,211 @@
+import itertools
+import json
+import os
+import signal
+import socket
+import subprocess
+import threading
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from forkserver import MAX_MESSAGE_SIZE
+from settings import WARM_POOL_PRELOAD
+
+FORKSERVER_PATH = Path(__file__).parent / "forkserver.py"
+
+
+class ForkedProcess:
+    """
+    Popen-like handle of a job forked by the fork server. The fork server
+    is its parent, so the exit code is reported over the control socket.
+    """
+
+    def __init__(self, args: List[str], pid: int):
+        self.args = args
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        # (user CPU seconds, system CPU seconds, max RSS in KB) once exited
+        self.rusage: Optional[tuple] = None
+        self._exited = threading.Event()
+
+    def poll(self) -> Optional[int]:
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def _set_returncode(self, returncode: int, rusage: Optional[list] = None):
+        self.rusage = tuple(rusage) if rusage else None
+        self.returncode = returncode
+        self._exited.set()
+
+
+class WarmPool:
+    """
+    Runs entrypoints in children of a warm fork server (app/forkserver.py)
+    that has the `preload` modules imported already.
+
+    The fork server is started with the same python3 as regular jobs and
+    restarted if it dies. spawn() returns None until it is ready, callers
+    then start the job the regular way. `on_exit` is called (from the
+    reader thread) whenever a forked job exits.
+    """
+
+    def __init__(
+        self,
+        python: str = "python3",
+        preload: str = WARM_POOL_PRELOAD,
+        on_exit: Callable[[], None] = lambda: None,
+    ):
+        self.python = python
+        self.preload = preload
+        self.on_exit = on_exit
+        self._server: Optional[subprocess.Popen] = None
+        self._sock: Optional[socket.socket] = None
+        self._reader: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._ids = itertools.count()
+        self._replies: Dict[int, dict] = {}
+        self._reply_ready = threading.Condition()
+        self._processes: Dict[int, ForkedProcess] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the fork server, it becomes ready once the preloads are imported.
+        """
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        env = os.environ.copy()
+        env["ENCLAVE_WARM_POOL_PRELOAD"] = self.preload
+        try:
+            self._server = subprocess.Popen(
+                [self.python, str(FORKSERVER_PATH), str(child_sock.fileno())],
+                pass_fds=[child_sock.fileno()],
+                env=env,
+                stdin=subprocess.DEVNULL,
+            )
+        finally:
+            child_sock.close()
+        self._sock = parent_sock
+        self._ready.clear()
+        self._reader = threading.Thread(
+            target=self._read, args=(parent_sock, self._server), name="warm-pool", daemon=True
+        )
+        self._reader.start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def _read(self, sock: socket.socket, server: subprocess.Popen):
+        while True:
+            try:
+                message = sock.recv(MAX_MESSAGE_SIZE)
+            except OSError:
+                message = b""
+            if not message:
+                break
+            reply = json.loads(message)
+            if "ready" in reply:
+                logger.info(f"Warm pool ready, preloaded: {', '.join(reply['preloaded']) or 'nothing'}")
+                self._ready.set()
+            elif "exited" in reply:
+                with self._lock:
+                    process = self._processes.pop(reply["exited"], None)
+                if process is not None:
+                    process._set_returncode(reply["returncode"], reply.get("rusage"))
+                    self.on_exit()
+            else:
+                with self._reply_ready:
+                    if "pid" in reply:
+                        # Registered here, before any exit of it can be read
+                        reply["process"] = ForkedProcess([], reply["pid"])
+                        with self._lock:
+                            self._processes[reply["pid"]] = reply["process"]
+                    self._replies[reply["id"]] = reply
+                    self._reply_ready.notify_all()
+        self._lost(sock, server)
+
+    def _lost(self, sock: socket.socket, server: subprocess.Popen):
+        # The fork server is gone, its jobs can no longer be reaped
+        self._ready.clear()
+        with self._lock:
+            orphans, self._processes = self._processes, {}
+        if orphans:
+            logger.error(f"Warm pool exited, killing {len(orphans)} job(s) started from it")
+        for process in orphans.values():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            process._set_returncode(-signal.SIGKILL)
+        if orphans:
+            self.on_exit()
+        with self._reply_ready:
+            self._reply_ready.notify_all()
+        server.wait()
+        sock.close()
+
+    def spawn(
+        self,
+        args: List[str],
+        env: Dict[str, str],
+        log_file: IO,
+        cwd: Optional[str] = None,
+        rlimits: Iterable[Tuple[int, int, int]] = (),
+        cgroup: Optional[str] = None,
+    ) -> Optional[ForkedProcess]:
+        """
+        Forks a job running `args` (python3 <script> [args...]) with the
+        given environment, writing its output to log_file. The child enters
+        `cgroup` and sets `rlimits` before the script starts.
+        Returns None when the fork server is not available.
+        """
+        if self._server is None:
+            self.start()
+        elif self._server.poll() is not None and not self._reader.is_alive():
+            # Restarted once the jobs of the previous one are accounted for
+            logger.warning("Warm pool is not running, restarting it")
+            self.start()
+        if not self.ready:
+            return None
+        request_id = next(self._ids)
+        request = {
+            "id": request_id,
+            "argv": args[1:],
+            "env": env,
+            "cwd": cwd or os.getcwd(),
+            "rlimits": list(rlimits),
+            "cgroup": cgroup,
+        }
+        try:
+            socket.send_fds(self._sock, [json.dumps(request).encode()], [log_file.fileno()])
+        except OSError as e:
+            logger.warning(f"Could not reach the warm pool: {e}")
+            return None
+        with self._reply_ready:
+            self._reply_ready.wait_for(lambda: request_id in self._replies or not self.ready)
+            reply = self._replies.pop(request_id, None)
+        if reply is None or "error" in reply:
+            logger.warning(f"Warm pool could not start the job: {reply['error'] if reply else 'fork server exited'}")
+            return None
+        process = reply["process"]
+        process.args = args
+        return process
+
+    def shutdown(self):
+        if self._server is None:
+            return
+        logger.info("Shutting down the warm pool")
+        # Ends the reader thread and tells the fork server to exit
+        self._sock.shutdown(socket.SHUT_RDWR)
+        try:
+            self._server.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._server.kill()
+            self._server.wait()
+        self._server = None
@@ -0,0 +1,240 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+from settings import EVENT_FALLBACK_INTERVAL, POLL_INTERVAL
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Files only the enclave writes, events on them must not wake the loop.
+# metrics.yaml is also written by clients, the launch index ignores the
+# enclave's own writes to it.
+IGNORED_NAMES = {"syft.pub.yaml", "execution.log"}
+
+
+class Watcher:
+    """
+    Polling watcher: wait() sleeps for `interval` seconds.
+
+    Signals with a Python handler (stop requests, SIGCHLD when a job
+    process exits) and wake() calls are written to a wake-up pipe, so
+    waiting ends as soon as there is something to do. Must be created in
+    the main thread.
+    """
+
+    interval: float = POLL_INTERVAL
+
+    def __init__(self):
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        signal.set_wakeup_fd(self._wake_w, warn_on_full_buffer=False)
+        # SIGCHLD is ignored by default, a handler makes it reach the pipe
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    def refresh(self, paths: Iterable[Path]) -> List[Path]:
+        """
+        Updates the set of watched directories and returns the newly watched
+        ones (no-op when polling).
+        """
+        return []
+
+    def wake(self):
+        """
+        Ends the current wait(), callable from any thread.
+        """
+        try:
+            os.write(self._wake_w, b"\0")
+        except OSError:
+            # A full pipe already has a wake-up pending, a closed one is shut down
+            pass
+
+    def _fds(self) -> List[int]:
+        return [self._wake_r]
+
+    def _handle(self, fd: int, changed: Set[Path]) -> bool:
+        _drain(fd)
+        return True
+
+    def wait(self, timeout: float = None) -> Optional[Set[Path]]:
+        """
+        Blocks until a watched directory changes, a signal arrives or the
+        timeout (default: the watcher interval) elapses.
+
+        Returns the directories that had events, or None when the caller
+        should look at everything (polling, timeouts, lost events).
+        """
+        deadline = time.monotonic() + (self.interval if timeout is None else timeout)
+        changed: Set[Path] = set()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            ready, _, _ = select.select(self._fds(), [], [], remaining)
+            if not ready:
+                return None
+            # Evaluate every ready fd so all of them get drained
+            if any([self._handle(fd, changed) for fd in ready]):
+                return self._result(changed)
+
+    def _result(self, changed: Set[Path]) -> Optional[Set[Path]]:
+        return None
+
+    def close(self):
+        signal.set_wakeup_fd(-1)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+
+class InotifyWatcher(Watcher):
+    """
+    Wakes up on Linux inotify events in the watched directories.
+    A long periodic timeout remains as a fallback for missed events.
+    """
+
+    interval: float = EVENT_FALLBACK_INTERVAL
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._watches: Dict[Path, int] = {}
+        self._paths: Dict[int, Path] = {}
+        self._overflowed = False
+        super().__init__()
+
+    def refresh(self, paths: Iterable[Path]) -> List[Path]:
+        paths = list(paths)
+        # e.g. projects that left jobs/launch, watched until now
+        for path in self._watches.keys() - set(paths):
+            self._unwatch(path)
+        added = []
+        for path in paths:
+            if path in self._watches or not path.is_dir():
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    logger.warning(f"inotify watch limit reached, not watching {path}")
+                elif err != errno.ENOENT:
+                    logger.warning(f"Failed to watch {path}: {os.strerror(err)}")
+                continue
+            self._watches[path] = wd
+            self._paths[wd] = path
+            added.append(path)
+        return added
+
+    def _unwatch(self, path: Path):
+        wd = self._watches.pop(path)
+        self._paths.pop(wd, None)
+        # Fails with EINVAL if the kernel already dropped the watch
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _fds(self) -> List[int]:
+        return [self._fd, self._wake_r]
+
+    def _handle(self, fd: int, changed: Set[Path]) -> bool:
+        if fd != self._fd:
+            return super()._handle(fd, changed)
+        relevant = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = _EVENT_HEADER.unpack_from(data, offset)
+                start = offset + _EVENT_HEADER.size
+                name = data[start:start + name_len].rstrip(b"\0").decode(errors="replace")
+                offset = start + name_len
+                if not _is_ignored(name):
+                    relevant = True
+                    if wd in self._paths:
+                        changed.add(self._paths[wd])
+                if mask & IN_Q_OVERFLOW:
+                    logger.warning("inotify queue overflowed, doing a full scan")
+                    self._overflowed = True
+                    relevant = True
+                if mask & (IN_MOVE_SELF | IN_DELETE_SELF | IN_IGNORED):
+                    # The watch would follow a moved directory (e.g. a project
+                    # moved to running) under its old path. A later refresh()
+                    # watches whatever is at the path then.
+                    path = self._paths.get(wd)
+                    if path is not None:
+                        self._unwatch(path)
+
+    def _result(self, changed: Set[Path]) -> Optional[Set[Path]]:
+        if self._overflowed:
+            self._overflowed = False
+            return None
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+        super().close()
+
+
+def _is_ignored(name: str) -> bool:
+    # Hidden temp files are the first half of an atomic write, the rename
+    # that follows produces the event that matters
+    return name in IGNORED_NAMES or (name.startswith(".") and name.endswith(".tmp"))
+
+
+def _drain(fd: int):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def create_watcher(mode: str) -> Watcher:
+    """
+    Creates the watcher for ENCLAVE_WATCH_MODE: "inotify", "poll" or
+    "auto" (inotify when available, polling otherwise).
+    """
+    if mode not in ("auto", "inotify", "poll"):
+        raise ValueError(f"Unknown watch mode {mode!r}")
+    if mode != "poll" and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher()
+            logger.info("Watching enclave directories with inotify")
+            return watcher
+        except (OSError, AttributeError) as e:
+            if mode == "inotify":
+                raise
+            logger.warning(f"inotify unavailable ({e}), falling back to polling")
+    elif mode == "inotify":
+        raise OSError("inotify is only available on Linux")
+    logger.info(f"Polling enclave directories every {POLL_INTERVAL}s")
+    return Watcher()
@@ -1,6 +1,6 @@
 from pathlib import Path
 import time
-from typing import Any
+from typing import Any, List, Optional, Tuple
 import shutil
 import yaml
 from enum import Enum
@@ -16,6 +16,7 @@ from rich.console import Group
 from loguru import logger
 
 
+from .spec import ARCHIVED_SUFFIX, CodeSpec, JobSpec, shard, write_yaml_atomic
 from .utils import open_path_in_explorer
 
 def connect(email: str):
@@ -45,8 +46,17 @@ class EnclaveClient(BaseModel):
                        datasets: list[Any],
                        output_owners: list[str],
                        code_path: str | Path,
-                       entrypoint: str | None = None):
-        
+                       entrypoint: str | None = None,
+                       priority: int = 0,
+                       reuse_results: bool = True):
+        """
+        Submits a project to the enclave. Projects with a higher priority
+        are started first, within the enclave's fair share between the
+        data scientists submitting projects. Unless reuse_results is False,
+        e.g. for code with random results, a project identical to one that
+        succeeded before gets its outputs without running again.
+        """
+
         enclave_app_path = self.client.app_data("enclave", datasite=self.email)
         
         if not enclave_app_path.exists():
@@ -84,25 +94,32 @@ class EnclaveClient(BaseModel):
             shutil.copy(code_path, code_dir)
 
         # Write config.yaml
-        config = {
-            'code': {'entrypoint': entrypoint},
-            'data': data_sources,
-            'output': output_owners
-        }
-        config_path = enclave_proj_dir / 'config.yaml'
-        with open(config_path, 'w') as f:
-            yaml.dump(config, f)
-        
+        try:
+            spec = JobSpec(
+                code=CodeSpec(entrypoint=entrypoint),
+                data=data_sources,
+                output=output_owners,
+                submitter=self.client.email,
+                priority=priority,
+                reuse_results=reuse_results,
+            )
+        except ValueError:
+            shutil.rmtree(enclave_proj_dir)
+            raise
+        config = spec.model_dump(mode="json", exclude_defaults=True)
         metrics_path = enclave_proj_dir / 'metrics.yaml'
-        with open(metrics_path, 'w') as f:
-            yaml.dump(metrics, f)
+        write_yaml_atomic(metrics_path, metrics)
+
+        # config.yaml is written last, the enclave only picks up a project
+        # once it has a config
+        config_path = enclave_proj_dir / 'config.yaml'
+        write_yaml_atomic(config_path, config)
 
         logger.info(f"Project {project_name} created in enclave app path {enclave_app_path}.")
 
         return EnclaveProject(client=self.client, email=self.email, project_name=project_name)
 
 
-
 class EnclaveProject(BaseModel):
 
     client: Client
@@ -115,9 +132,30 @@ class EnclaveProject(BaseModel):
     
     @property
     def output_dir(self) -> Path:
-        enclave_app_path = self.client.app_data("enclave", datasite=self.email)
-        return enclave_app_path / "jobs" / "outputs" / self.project_name
+        outputs_dir = self.client.app_data("enclave", datasite=self.email) / "jobs" / "outputs"
+        # Enclaves using the sharded layout keep outputs under a hash prefix
+        sharded = outputs_dir / shard(self.project_name) / self.project_name
+        if sharded.exists():
+            return sharded
+        return outputs_dir / self.project_name
     
+    @property
+    def archived(self) -> Optional[dict]:
+        """
+        Status, exit code and archive of the project once the enclave has
+        archived its done folder, None before that.
+        """
+        done_dir = self.client.app_data("enclave", datasite=self.email) / "jobs" / "done"
+        # Same as JobsLayout.find_archived in the enclave app's layout.py
+        for stub in (
+            done_dir / shard(self.project_name) / f"{self.project_name}{ARCHIVED_SUFFIX}",
+            done_dir / f"{self.project_name}{ARCHIVED_SUFFIX}",
+        ):
+            if stub.exists():
+                with open(stub, 'r') as f:
+                    return yaml.safe_load(f)
+        return None
+
     @property
     def _metrics_path(self) -> Path:
         enclave_app_path = self.client.app_data("enclave", datasite=self.email)
@@ -195,6 +233,9 @@ class EnclaveProject(BaseModel):
         metrics = self._get_metrics()
 
         if not metrics:
+            archived = self.archived
+            if archived is not None:
+                logger.info(f"Project {self.project_name} finished ({archived['status']}) and was archived")
             if self.output_dir.exists():
                 logger.info(f"Output already available for project {self.project_name} ✅")
             else:
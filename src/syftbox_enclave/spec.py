@@ -0,0 +1,146 @@
+"""
+What the client and the enclave app agree on: the config.yaml a project is
+submitted with, where its results are published, and how files the other
+side reads are written.
+
+The enclave app imports this same file as app/spec.py (a symlink), so it
+only depends on the standard library, PyYAML and pydantic.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path, PurePosixPath
+from typing import List, Optional, Tuple, Union
+
+import yaml
+from pydantic import BaseModel, ConfigDict, StrictBool, StrictInt, ValidationError, field_validator
+
+PathLike = Union[str, Path]
+
+# libyaml's loader when PyYAML was built with it, several times faster
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Keys of the `limits` section, the fields of the enclave's JobLimits
+LIMIT_NAMES = ("wall_time_seconds", "cpu_seconds", "memory_mb", "address_space_mb", "open_files")
+
+# Left in place of an archived done folder, <name>.archived.yaml
+ARCHIVED_SUFFIX = ".archived.yaml"
+
+
+def validate_limits(limits) -> None:
+    """
+    Validates the `limits` section of a config.yaml.
+    """
+    if not isinstance(limits, dict):
+        raise ValueError("limits must be a mapping")
+    for key, value in limits.items():
+        if key not in LIMIT_NAMES:
+            raise ValueError(f"Unknown limit {key}, expected one of {', '.join(sorted(LIMIT_NAMES))}")
+        if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+            raise ValueError(f"Limit {key} must be a positive integer")
+
+
+class CodeSpec(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    # Path of the script to run, relative to the project's code directory
+    entrypoint: str
+
+    @field_validator("entrypoint")
+    @classmethod
+    def _relative(cls, entrypoint: str) -> str:
+        path = PurePosixPath(entrypoint)
+        if not entrypoint or path.is_absolute() or ".." in path.parts:
+            raise ValueError("entrypoint must be a path inside the code directory")
+        return entrypoint
+
+
+class JobSpec(BaseModel):
+    """
+    A project's config.yaml, written by the client and read by the enclave.
+    """
+    # Keys added by newer clients are ignored
+    model_config = ConfigDict(frozen=True, extra="ignore", coerce_numbers_to_str=True)
+
+    code: CodeSpec
+    # (datasite, dataset_id) of each dataset, in the order of DATA_DIR
+    data: List[Tuple[str, str]]
+    # Who can read the outputs
+    output: List[str]
+    submitter: Optional[str] = None
+    priority: StrictInt = 0
+    reuse_results: StrictBool = True
+    limits: Optional[dict] = None
+
+    @field_validator("data")
+    @classmethod
+    def _names(cls, data: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        # Both end up in the path of the dataset's .enc file
+        for source in data:
+            for name in source:
+                if not name or "/" in name or "\\" in name or name in (".", ".."):
+                    raise ValueError(f"invalid datasite or dataset id {name!r}")
+        return data
+
+    @field_validator("limits")
+    @classmethod
+    def _limits(cls, limits: Optional[dict]) -> Optional[dict]:
+        if limits is not None:
+            validate_limits(limits)
+        return limits
+
+    @classmethod
+    def from_yaml(cls, text: str) -> "JobSpec":
+        """
+        Parses and validates a config.yaml, raising ValueError if it's invalid.
+        """
+        try:
+            config = yaml.load(text, Loader=YamlLoader)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Error parsing YAML file: {e}")
+        if not isinstance(config, dict):
+            raise ValueError("config.yaml must be a mapping")
+        try:
+            return cls.model_validate(config)
+        except ValidationError as e:
+            # One line per problem, without pydantic's links
+            raise ValueError("; ".join(
+                f"{'.'.join(str(loc) for loc in error['loc']) or 'config'}: {error['msg']}"
+                for error in e.errors()
+            )) from None
+
+
+def shard(name: str) -> str:
+    """
+    Shard of a project in the enclave's sharded jobs layout: the first two
+    hex digits of the sha256 of its name.
+    """
+    return hashlib.sha256(name.encode()).hexdigest()[:2]
+
+
+def write_atomic(path: PathLike, dump) -> None:
+    """
+    Writes a file through a temp file in the same directory and an atomic
+    rename, calling `dump` with the open temp file, so readers (and the
+    sync layer) never see a partially written file.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        # mkstemp creates 0600 files, keep the mode a plain open() would give
+        os.fchmod(fd, path.stat().st_mode & 0o777 if path.exists() else 0o644)
+        with os.fdopen(fd, "w") as f:
+            dump(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def write_yaml_atomic(path: PathLike, data, sort_keys: bool = True) -> None:
+    """
+    Writes data as YAML atomically, see write_atomic.
+    """
+    write_atomic(path, lambda f: yaml.dump(data, f, sort_keys=sort_keys))
@@ -15,4 +15,5 @@ def open_path_in_explorer(path: str | Path):
     if not path.exists():
         raise FileNotFoundError(f"The path {path} does not exist.")
     
-    webbrowser.open(path.as_uri())
\ No newline at end of file
+    webbrowser.open(path.as_uri())
+